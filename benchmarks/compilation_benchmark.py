@@ -0,0 +1,215 @@
+"""Wall time, CEGIS iterations, hole bits, sketch size and peak memory of
+compiling example specs end to end.
+
+Runs iterative_solver on every combination of --specs, --stateful-alus,
+--stateless-alus and --grids, a few at a time, each in a fresh temporary
+directory and with the Sketch cache bypassed. Results are written as JSON and
+CSV, and compared against a baseline written by an earlier run with
+--save-baseline. The exit code is 1 if any run regressed. Results also hold
+the features of each run for the cost model, see fit_cost_model.
+
+Example:
+    python benchmarks/compilation_benchmark.py \\
+        --specs simple.sk sampling.sk --grids 2x2 3x2 \\
+        --baseline baseline.json --output-json results.json
+"""
+import argparse
+import csv
+import glob
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+import psutil
+
+BASE_PATH = path.abspath(path.join(path.dirname(__file__), '..'))
+
+STATELESS_ALU_DIR = path.join(BASE_PATH, 'example_alus/stateless_alus/')
+STATEFUL_ALU_DIR = path.join(BASE_PATH, 'example_alus/stateful_alus/')
+SPEC_DIR = path.join(BASE_PATH, 'example_specs/')
+
+FIELDS = ['spec', 'stateful_alu', 'stateless_alu', 'stages',
+          'alus_per_stage', 'return_code', 'wall_seconds', 'iterations',
+          'hole_bits', 'sketch_bytes', 'peak_rss_bytes', 'initial_hole_bits',
+          'mux_hole_bits', 'num_state_groups', 'num_testcases',
+          'spec_tokens']
+
+# Fields that identify a run in the baseline.
+KEY_FIELDS = FIELDS[:5]
+
+
+def get_key(result):
+    return tuple(result[field] for field in KEY_FIELDS)
+
+
+def parse_grid(grid):
+    match = re.fullmatch(r'(\d+)x(\d+)', grid)
+    if not match:
+        raise argparse.ArgumentTypeError(
+            'Grid %s is not of the form <stages>x<alus per stage>' % grid)
+    return (int(match.group(1)), int(match.group(2)))
+
+
+def run_benchmark(args, spec, stateful_alu, stateless_alu, grid):
+    (num_pipeline_stages, num_alus_per_stage) = grid
+    result = dict(zip(KEY_FIELDS, (spec, stateful_alu, stateless_alu,
+                                   num_pipeline_stages, num_alus_per_stage)))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        solver_args = [
+            sys.executable, '-m', 'chipc.iterative_solver',
+            path.join(SPEC_DIR, spec),
+            path.join(STATEFUL_ALU_DIR, stateful_alu),
+            path.join(STATELESS_ALU_DIR, stateless_alu),
+            str(num_pipeline_stages), str(num_alus_per_stage),
+            args.constant_set, str(args.max_input_bit)] + args.solver_args
+        env = dict(os.environ)
+        # Even if --solver-args has --sketch-cache.
+        env['CHIPMUNK_SKETCH_CACHE'] = '0'
+        env['PYTHONPATH'] = os.pathsep.join(
+            [BASE_PATH] + ([env['PYTHONPATH']] if 'PYTHONPATH' in env
+                           else []))
+        # Features for the cost model, which iterative_solver prints as the
+        # last line with --dry-run.
+        dry_run = subprocess.run(solver_args + ['--dry-run'], cwd=tmp_dir,
+                                 env=env, stdout=subprocess.PIPE,
+                                 universal_newlines=True)
+        if dry_run.returncode == 0:
+            result.update(json.loads(dry_run.stdout.splitlines()[-1]))
+        output_file_name = path.join(tmp_dir, 'output.txt')
+        start = time.perf_counter()
+        with open(output_file_name, 'w') as output_file:
+            process = subprocess.Popen(solver_args, cwd=tmp_dir, env=env,
+                                       stdout=output_file,
+                                       stderr=subprocess.STDOUT)
+            # wait4 reports the peak RSS of the solver and the Sketch runs it
+            # waited for, unlike getrusage, which covers all children of this
+            # process.
+            (_, status, rusage) = os.wait4(process.pid, 0)
+        process.returncode = os.WEXITSTATUS(status) if \
+            os.WIFEXITED(status) else -os.WTERMSIG(status)
+        result['wall_seconds'] = time.perf_counter() - start
+        with open(output_file_name) as output_file:
+            output = output_file.read()
+
+        result['return_code'] = process.returncode
+        result['iterations'] = len(re.findall(r'^Iteration #', output,
+                                              re.MULTILINE))
+        hole_bits = re.findall(r'^Total number of hole bits is (\d+)', output,
+                               re.MULTILINE)
+        result['hole_bits'] = int(hole_bits[-1]) if hole_bits else None
+        sketch_sizes = [path.getsize(sketch_file_name) for sketch_file_name
+                        in glob.glob(path.join(tmp_dir, '*.sk'))]
+        result['sketch_bytes'] = max(sketch_sizes) if sketch_sizes else None
+        # ru_maxrss is in kilobytes on Linux.
+        result['peak_rss_bytes'] = rusage.ru_maxrss * 1024
+    return result
+
+
+def get_regressions(results, baseline, time_tolerance, min_seconds):
+    """Returns a list of messages about results that are worse than the ones
+    for the same runs in the baseline."""
+    baseline = {get_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old_result = baseline.get(get_key(result))
+        if old_result is None:
+            continue
+        name = ' '.join(str(value) for value in get_key(result))
+        if old_result['return_code'] == 0 and result['return_code'] != 0:
+            regressions.append(name + ': compilation failed')
+            continue
+        # Ignore small absolute changes in time, which are mostly noise.
+        if result['wall_seconds'] > \
+                old_result['wall_seconds'] * (1 + time_tolerance) and \
+                result['wall_seconds'] - old_result['wall_seconds'] > \
+                min_seconds:
+            regressions.append('%s: wall time %.1fs, was %.1fs' % (
+                name, result['wall_seconds'], old_result['wall_seconds']))
+        for field in ['iterations', 'hole_bits']:
+            if result[field] is not None and \
+                    old_result[field] is not None and \
+                    result[field] > old_result[field]:
+                regressions.append('%s: %s %d, was %d' % (
+                    name, field, result[field], old_result[field]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark compilation of example specs.')
+    parser.add_argument('--specs', nargs='+', default=['simple.sk'],
+                        help='Spec file names under example_specs/')
+    parser.add_argument('--stateful-alus', nargs='+', default=['raw.alu'],
+                        help='ALU file names under '
+                        'example_alus/stateful_alus/')
+    parser.add_argument('--stateless-alus', nargs='+',
+                        default=['stateless_alu.alu'],
+                        help='ALU file names under '
+                        'example_alus/stateless_alus/')
+    parser.add_argument('--grids', nargs='+', type=parse_grid,
+                        default=[(2, 2)],
+                        help='Grids of the form <stages>x<alus per stage>')
+    parser.add_argument('--constant-set', default='0,1,2,3',
+                        help='Comma-separated constant set')
+    parser.add_argument('--max-input-bit', type=int, default=10)
+    parser.add_argument('--solver-args', nargs=argparse.REMAINDER,
+                        default=[],
+                        help='Further arguments to iterative_solver, e.g., '
+                        '--hole-elimination')
+    parser.add_argument('--jobs', type=int, default=psutil.cpu_count() or 1,
+                        help='Number of runs at once. Defaults to the number '
+                        'of cores.')
+    parser.add_argument('--output-json', help='File to write results to')
+    parser.add_argument('--output-csv', help='File to write results to')
+    parser.add_argument('--baseline',
+                        help='Results of an earlier run to compare against')
+    parser.add_argument('--save-baseline',
+                        help='File to write results to as the new baseline')
+    parser.add_argument('--time-tolerance', type=float, default=0.2,
+                        help='Relative increase in wall time that counts as '
+                        'a regression')
+    parser.add_argument('--min-seconds', type=float, default=1.0,
+                        help='Increases in wall time below this are never '
+                        'regressions')
+    args = parser.parse_args()
+
+    runs = list(itertools.product(args.specs, args.stateful_alus,
+                                  args.stateless_alus, args.grids))
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(
+            lambda run: run_benchmark(args, *run), runs))
+
+    writer = csv.DictWriter(sys.stdout, FIELDS)
+    writer.writeheader()
+    writer.writerows(results)
+    if args.output_csv:
+        with open(args.output_csv, 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    for json_file_name in [args.output_json, args.save_baseline]:
+        if json_file_name:
+            with open(json_file_name, 'w') as json_file:
+                json.dump(results, json_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = get_regressions(results, json.load(baseline_file),
+                                          args.time_tolerance,
+                                          args.min_seconds)
+        for regression in regressions:
+            print('Regression:', regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""Time and peak memory of building z3 formulas from Sketch DAGs.
+
+Parses tests/data/sampling.dag and synthetic DAGs of --num-nodes nodes, both
+from a string as Compiler used to and streamed from the .dag file. Synthetic
+DAGs repeat some of their subterms, the way DAGs of pipelines with many
+identical ALUs do.
+
+With --encodings, also times building and checking formulas over z3.Int and
+over z3.BitVec, see --bit-vector-verify of iterative_solver. To compare the
+encodings on whole compilations of specs, run compilation_benchmark.py with
+--solver-args --bit-vector-verify.
+
+Example:
+    python benchmarks/dag_parser_benchmark.py --num-nodes 100000
+    python benchmarks/dag_parser_benchmark.py --encodings int bitvec bitvec32
+"""
+import argparse
+import random
+import tempfile
+import time
+import tracemalloc
+from os import path
+from pathlib import Path
+
+from chipc import z3_utils
+
+BASE_PATH = path.abspath(path.join(path.dirname(__file__), '..'))
+
+SAMPLING_DAG = path.join(BASE_PATH, 'tests/data/sampling.dag')
+
+
+def measure(fn):
+    # Time and memory are measured in separate runs, as tracemalloc slows
+    # down allocation heavy code a lot.
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (result, elapsed, peak)
+
+
+def generate_dag(num_nodes, num_sources, duplicate_ratio, seed):
+    """Returns the text of a random well-sorted DAG with num_nodes nodes."""
+    rng = random.Random(seed)
+    lines = ['dag main__WrapperNospec :']
+    int_nodes = []
+    bool_nodes = []
+    # Int nodes other than constants, which Sketch would have folded into
+    # an ARRASS.
+    int_terms = []
+    # Bodies of nodes that can be repeated, i.e., all but sources and asserts.
+    bodies = []
+    num_lines = 0
+
+    def add(body, is_bool):
+        nonlocal num_lines
+        lines.append(str(num_lines) + ' = ' + body)
+        (bool_nodes if is_bool else int_nodes).append(num_lines)
+        if not is_bool and not body.startswith('CONST'):
+            int_terms.append(num_lines)
+        if not body.startswith('S '):
+            bodies.append((body, is_bool))
+        num_lines += 1
+
+    # Mostly pick recent nodes, so the DAG gets deep.
+    def pick(nodes):
+        return str(nodes[-1 - min(int(rng.expovariate(0.1)),
+                                  len(nodes) - 1)])
+
+    for i in range(num_sources):
+        add('S INT src_' + str(i) + ' 2', False)
+    for value in range(4):
+        add('CONST INT ' + str(value), False)
+    add('CONST BOOL 1', True)
+
+    while num_lines < num_nodes:
+        if rng.random() < duplicate_ratio:
+            add(*rng.choice(bodies))
+            continue
+        kind = rng.randrange(6)
+        if kind == 0:
+            add('PLUS INT ' + pick(int_nodes) + ' ' + pick(int_nodes), False)
+        elif kind == 1:
+            add(rng.choice(['LT', 'EQ']) + ' BOOL ' + pick(int_nodes) + ' ' +
+                pick(int_nodes), True)
+        elif kind == 2:
+            add(rng.choice(['AND', 'OR']) + ' BOOL ' + pick(bool_nodes) +
+                ' ' + pick(bool_nodes), True)
+        elif kind == 3:
+            add('NOT BOOL ' + pick(bool_nodes), True)
+        elif kind == 4:
+            add('ARRACC INT ' + pick(bool_nodes) + ' 2 ' + pick(int_nodes) +
+                ' ' + pick(int_nodes), False)
+        else:
+            add('ARRASS INT ' + pick(int_terms) + ' == ' +
+                str(rng.randrange(4)) + ' ' + pick(int_nodes) + ' ' +
+                pick(int_nodes), False)
+        if rng.random() < 0.01:
+            lines.append(str(num_lines) + ' = ASSERT ' + pick(bool_nodes) +
+                         ' "Assert at synthetic.sk"')
+            num_lines += 1
+    return '\n'.join(lines) + '\n'
+
+
+def benchmark(name, dag_filename, input_bits):
+    dag = Path(dag_filename).read_text()
+    (_, string_time, string_peak) = measure(
+        lambda: z3_utils.get_z3_formula(dag, input_bits))
+    (_, file_time, file_peak) = measure(
+        lambda: z3_utils.get_z3_formula_from_dag_file(dag_filename,
+                                                      input_bits))
+    num_nodes = sum(1 for line in dag.splitlines() if '=' in line)
+    print('{},{},{:.3f},{},{:.3f},{}'.format(
+        name, num_nodes, string_time, string_peak, file_time, file_peak))
+
+
+def get_encoding(encoding):
+    """Returns bit_vector and bit_width arguments of get_z3_formula for int,
+    bitvec or bitvec<width>."""
+    if encoding == 'int':
+        return (False, None)
+    assert encoding.startswith('bitvec'), ('Unknown encoding', encoding)
+    return (True, int(encoding[len('bitvec'):]) if encoding != 'bitvec'
+            else None)
+
+
+def benchmark_encodings(name, dag_filename, input_bits, encodings):
+    for encoding in encodings:
+        (bit_vector, bit_width) = get_encoding(encoding)
+        start = time.perf_counter()
+        formula = z3_utils.get_z3_formula_from_dag_file(
+            dag_filename, input_bits, bit_vector, bit_width)
+        formula_time = time.perf_counter() - start
+        generator = z3_utils.CounterexampleGenerator()
+        counterexamples = generator.generate_all(formula, 1)
+        print('{},{},{:.3f},{:.3f},{}'.format(
+            name, encoding, formula_time, generator.total_check_time,
+            len(counterexamples)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--num-nodes', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--num-sources', type=int, default=16)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.3,
+                        help='Fraction of synthetic nodes that repeat an '
+                             'earlier node.')
+    parser.add_argument('--input-bits', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--encodings', nargs='+', default=[],
+                        help='Encodings of formulas to compare, int, bitvec '
+                             'or bitvec<width>, e.g., bitvec32.')
+    args = parser.parse_args()
+
+    print('dag,nodes,string_seconds,string_peak_bytes,file_seconds,'
+          'file_peak_bytes')
+    benchmark('sampling', SAMPLING_DAG, args.input_bits)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_nodes in args.num_nodes:
+            dag_filename = path.join(tmp_dir, str(num_nodes) + '.dag')
+            Path(dag_filename).write_text(generate_dag(
+                num_nodes, args.num_sources, args.duplicate_ratio,
+                args.seed))
+            benchmark('synthetic_' + str(num_nodes), dag_filename,
+                      args.input_bits)
+        if not args.encodings:
+            return
+        print('dag,encoding,formula_seconds,check_seconds,'
+              'counterexamples')
+        benchmark_encodings('sampling', SAMPLING_DAG, args.input_bits,
+                            args.encodings)
+        for num_nodes in args.num_nodes:
+            benchmark_encodings(
+                'synthetic_' + str(num_nodes),
+                path.join(tmp_dir, str(num_nodes) + '.dag'),
+                args.input_bits, args.encodings)
+
+
+if __name__ == '__main__':
+    main()
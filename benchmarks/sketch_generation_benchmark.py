@@ -0,0 +1,100 @@
+"""Time and peak memory of sketch generation as the grid grows.
+
+For every grid up to --max-stages x --max-alus-per-stage, this builds a
+Compiler and generates the CODEGEN sketch twice: once from scratch and once
+more with the same constant set, which hits the cached sketch.
+
+Example:
+    python benchmarks/sketch_generation_benchmark.py \\
+        --max-stages 20 --max-alus-per-stage 20
+"""
+import argparse
+import time
+import tracemalloc
+from os import path
+
+from ordered_set import OrderedSet
+
+from chipc.compiler import Compiler
+from chipc.mode import Mode
+
+BASE_PATH = path.abspath(path.join(path.dirname(__file__), '..'))
+
+STATELESS_ALU_DIR = path.join(BASE_PATH, 'example_alus/stateless_alus/')
+STATEFUL_ALU_DIR = path.join(BASE_PATH, 'example_alus/stateful_alus/')
+SPEC_DIR = path.join(BASE_PATH, 'example_specs/')
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (result, elapsed, peak)
+
+
+def benchmark_grid(args, num_pipeline_stages, num_alus_per_stage):
+    compiler = Compiler(
+        path.join(SPEC_DIR, args.spec),
+        path.join(STATEFUL_ALU_DIR, args.stateful_alu),
+        path.join(STATELESS_ALU_DIR, args.stateless_alu),
+        num_pipeline_stages, num_alus_per_stage,
+        'benchmark_' + str(num_pipeline_stages) + '_' +
+        str(num_alus_per_stage),
+        False, OrderedSet(args.constant_set.split(',')), 1,
+        args.synthesized_allocation)
+    generator = compiler.sketch_code_generator
+
+    def generate():
+        return generator.generate_sketch(
+            spec_filename=compiler.spec_filename, mode=Mode.CODEGEN,
+            synthesized_allocation=args.synthesized_allocation)
+
+    (sketch, cold_time, cold_peak) = measure(generate)
+    (_, warm_time, warm_peak) = measure(generate)
+    return (len(sketch), len(generator.hole_names_), cold_time, cold_peak,
+            warm_time, warm_peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark sketch generation over grid sizes.')
+    parser.add_argument('--spec', default='learn_filter_modified_for_test.sk',
+                        help='Spec file name under example_specs/')
+    parser.add_argument('--stateful-alu', default='raw.alu',
+                        help='ALU file name under example_alus/stateful_alus/')
+    parser.add_argument('--stateless-alu', default='stateless_alu.alu',
+                        help='ALU file name under '
+                        'example_alus/stateless_alus/')
+    parser.add_argument('--constant-set', default='0,1,2,3',
+                        help='Comma-separated constant set')
+    parser.add_argument('--min-stages', type=int, default=1)
+    parser.add_argument('--max-stages', type=int, default=20)
+    parser.add_argument('--min-alus-per-stage', type=int, default=2)
+    parser.add_argument('--max-alus-per-stage', type=int, default=20)
+    parser.add_argument('--step', type=int, default=1,
+                        help='Step of both grid dimensions')
+    parser.add_argument('--synthesized-allocation', action='store_true',
+                        help='Synthesize the allocation of state groups '
+                        'instead of using the canonical one')
+    args = parser.parse_args()
+
+    print('stages,alus_per_stage,sketch_chars,holes,'
+          'cold_seconds,cold_peak_bytes,warm_seconds,warm_peak_bytes')
+    for num_pipeline_stages in range(args.min_stages, args.max_stages + 1,
+                                     args.step):
+        for num_alus_per_stage in range(args.min_alus_per_stage,
+                                        args.max_alus_per_stage + 1,
+                                        args.step):
+            (sketch_chars, holes, cold_time, cold_peak, warm_time,
+             warm_peak) = benchmark_grid(args, num_pipeline_stages,
+                                         num_alus_per_stage)
+            print('%d,%d,%d,%d,%.4f,%d,%.4f,%d' % (
+                num_pipeline_stages, num_alus_per_stage, sketch_chars, holes,
+                cold_time, cold_peak, warm_time, warm_peak))
+
+
+if __name__ == '__main__':
+    main()
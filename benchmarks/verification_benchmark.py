@@ -0,0 +1,128 @@
+"""Latency of one verification, natively and through Sketch IRs.
+
+For every spec, this verifies random hole value assignments of the CODEGEN
+sketch with Compiler.verify, once with --native-verify and once more through
+the VERIFY sketch, its Sketch DAG and get_z3_formula. The latter needs sketch
+on the PATH and is skipped otherwise. Sketch runs bypass the Sketch cache.
+
+Stateful ALUs are picked per spec by the size of its state groups, pair.alu
+for pairs and --stateful-alu otherwise.
+
+Example:
+    python benchmarks/verification_benchmark.py --specs simple.sk rcp.sk
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from os import path
+from pathlib import Path
+
+from ordered_set import OrderedSet
+
+from chipc.compiler import Compiler
+from chipc.mode import Mode
+from chipc.utils import get_num_pkt_fields
+from chipc.utils import get_state_group_info
+
+BASE_PATH = path.abspath(path.join(path.dirname(__file__), '..'))
+
+STATELESS_ALU_DIR = path.join(BASE_PATH, 'example_alus/stateless_alus/')
+STATEFUL_ALU_DIR = path.join(BASE_PATH, 'example_alus/stateful_alus/')
+SPEC_DIR = path.join(BASE_PATH, 'example_specs/')
+
+
+def make_compiler(args, spec, native_verify):
+    program_content = Path(path.join(SPEC_DIR, spec)).read_text()
+    state_groups = get_state_group_info(program_content)
+    group_size = max(len(state_vars) for state_vars in state_groups.values())
+    stateful_alu = 'pair.alu' if group_size == 2 else args.stateful_alu
+    num_alus_per_stage = max(args.alus_per_stage,
+                             get_num_pkt_fields(program_content),
+                             len(state_groups))
+    compiler = Compiler(
+        path.join(SPEC_DIR, spec), path.join(STATEFUL_ALU_DIR, stateful_alu),
+        path.join(STATELESS_ALU_DIR, args.stateless_alu), args.stages,
+        num_alus_per_stage, 'benchmark', False,
+        OrderedSet(args.constant_set.split(',')), group_size,
+        native_verify=native_verify, use_sketch_cache=False)
+    # Holes are only known after a sketch has been generated.
+    compiler.sketch_code_generator.generate_sketch(
+        spec_filename=compiler.spec_filename, mode=Mode.CODEGEN,
+        synthesized_allocation=False)
+    return compiler
+
+
+def get_hole_assignments(compiler, rng):
+    hole_assignments = {}
+    for hole in compiler.sketch_code_generator.holes_:
+        max_value = hole.max
+        if 'const' in hole.name or 'immediate' in hole.name:
+            max_value = len(compiler.constant_set) - 1
+        hole_assignments[hole.name] = str(rng.randint(0, max_value))
+    return hole_assignments
+
+
+def time_verify(args, spec, native_verify):
+    """Returns the median seconds of verifying --trials random hole value
+    assignments."""
+    compiler = make_compiler(args, spec, native_verify)
+    rng = random.Random(args.seed)
+    times = []
+    for trial in range(args.trials):
+        hole_assignments = get_hole_assignments(compiler, rng)
+        start = time.perf_counter()
+        compiler.verify(hole_assignments, args.input_bits, trial)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark native verification against Sketch IRs.')
+    parser.add_argument('--specs', nargs='+',
+                        default=sorted(os.listdir(SPEC_DIR)),
+                        help='Spec file names under example_specs/')
+    parser.add_argument('--stateful-alu', default='if_else_raw.alu',
+                        help='ALU file name under example_alus/stateful_alus/'
+                        ' for specs with single state variable groups')
+    parser.add_argument('--stateless-alu',
+                        default='stateless_alu_arith_rel_cond_bool.alu',
+                        help='ALU file name under '
+                        'example_alus/stateless_alus/')
+    parser.add_argument('--stages', type=int, default=2)
+    parser.add_argument('--alus-per-stage', type=int, default=2,
+                        help='Raised to the packet fields or state groups '
+                        'of a spec if it has more')
+    parser.add_argument('--constant-set', default='0,1,2,3',
+                        help='Comma-separated constant set')
+    parser.add_argument('--input-bits', type=int, default=10)
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    has_sketch = shutil.which('sketch') is not None
+    print('spec,native_seconds,sketch_ir_seconds,speedup')
+    for spec in args.specs:
+        # Verification writes sketch and DAG files to the working directory.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                native_time = time_verify(args, spec, True)
+                ir_time = time_verify(args, spec, False) \
+                    if has_sketch else None
+            finally:
+                os.chdir(cwd)
+        if ir_time is None:
+            print('%s,%.4f,,' % (spec, native_time))
+        else:
+            print('%s,%.4f,%.4f,%.1f' % (spec, native_time, ir_time,
+                                         ir_time / native_time))
+
+
+if __name__ == '__main__':
+    main()
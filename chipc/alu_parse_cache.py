@@ -0,0 +1,61 @@
+"""Process-wide cache of ALU parse trees.
+
+Parsing an .alu file with the ANTLR Python runtime is slow, and the code
+generators used to re-parse the same file for every ALU slot on every CEGIS
+iteration. The parse trees are never mutated by the visitors, so one tree per
+file can safely be shared by all of them."""
+import os
+from hashlib import md5
+
+from antlr4 import CommonTokenStream
+from antlr4 import InputStream
+
+from chipc.aluLexer import aluLexer
+from chipc.aluParser import aluParser
+
+
+class AluParseCache:
+    def __init__(self):
+        self.trees_ = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_parse_tree(self, alu_filename):
+        """Returns the parse tree of alu_filename, parsing it only if the file
+        path, modification time or content changed since it was last parsed.
+        """
+        alu_path = os.path.abspath(alu_filename)
+        mtime = os.stat(alu_path).st_mtime_ns
+        with open(alu_path, encoding='utf-8') as f:
+            alu_text = f.read()
+        key = (alu_path, mtime, md5(alu_text.encode('utf-8')).hexdigest())
+
+        tree = self.trees_.get(key)
+        if tree is not None:
+            self.hits += 1
+            return tree
+
+        self.misses += 1
+        lexer = aluLexer(InputStream(alu_text))
+        parser = aluParser(CommonTokenStream(lexer))
+        tree = parser.alu()
+        # Drop stale entries for the same file, so that editing an .alu file
+        # in a long running process doesn't grow the cache.
+        for stale_key in [k for k in self.trees_ if k[0] == alu_path]:
+            del self.trees_[stale_key]
+        self.trees_[key] = tree
+        return tree
+
+    def clear(self):
+        self.trees_ = {}
+        self.hits = 0
+        self.misses = 0
+
+
+# Shared by SketchCodeGenerator and TofinoCodeGenerator. Worker processes
+# forked by Compiler.parallel_codegen inherit whatever is already parsed.
+ALU_PARSE_CACHE = AluParseCache()
+
+
+def get_alu_parse_tree(alu_filename):
+    return ALU_PARSE_CACHE.get_parse_tree(alu_filename)
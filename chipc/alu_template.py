@@ -0,0 +1,36 @@
+from collections import OrderedDict
+
+# Name the visitors are run with when producing an AluTemplate. It is replaced
+# with the actual ALU name, e.g., simple_raw_stateless_alu_2_2_stateful_alu_0_1,
+# when the template is instantiated for a specific slot.
+ALU_NAME_PLACEHOLDER = 'chipmunk_alu_name_placeholder'
+
+
+class AluTemplate:
+    """Sketch code and holes of an ALU, parametric in the ALU name.
+
+    An ALU file is visited once with ALU_NAME_PLACEHOLDER as its name, and
+    every (stage, ALU) slot in the grid is then stamped out by instantiate(),
+    instead of walking the parse tree again for each slot.
+    """
+
+    def __init__(self, code, holes, alu_args, num_packet_fields,
+                 num_state_vars=0):
+        # Helper functions followed by the main ALU function.
+        self.code = code
+        # Hole names to bit widths, in the order they are added to the
+        # sketch. Names include ALU_NAME_PLACEHOLDER.
+        self.holes = holes
+        # Sorted hole argument names local to the ALU function.
+        self.alu_args = alu_args
+        self.num_packet_fields = num_packet_fields
+        self.num_state_vars = num_state_vars
+
+    def instantiate(self, alu_name):
+        """Returns a tuple of sketch code for alu_name and an OrderedDict from
+        its hole names to bit widths."""
+        code = self.code.replace(ALU_NAME_PLACEHOLDER, alu_name)
+        holes = OrderedDict(
+            (hole.replace(ALU_NAME_PLACEHOLDER, alu_name), width)
+            for hole, width in self.holes.items())
+        return (code, holes)
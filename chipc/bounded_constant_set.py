@@ -0,0 +1,93 @@
+"""Constant set with a cap on its size.
+
+Every constant added to the constant set of a compilation, e.g., from
+counterexamples, widens the holes that index the constant vector, i.e.,
+immediate operands and C() of ALUs. A BoundedConstantSet keeps at most
+max_size constants. Once full, it evicts the oldest constant that is not
+pinned, as the initial constants are, not used by the latest candidate and
+not added since, i.e., in the current iteration. The set outgrows max_size
+if no constant can be evicted.
+
+Evicted constants may be ones that a solution needs, so that synthesis fails
+with a constant set it would have succeeded with. restore_evicted pins them
+again, to retry synthesis before deeming it infeasible.
+"""
+import re
+
+from ordered_set import OrderedSet
+
+# Holes whose values are indices into the constant vector.
+CONSTANT_HOLE_PATTERN = re.compile(r'_const_\d+(_global)?$|immediate_operand')
+
+
+def get_used_constants(hole_assignments, constant_set):
+    """Returns the set of constants in constant_set that the hole value
+    assignments of a candidate index."""
+    used_constants = set()
+    for (hole, value) in hole_assignments.items():
+        if CONSTANT_HOLE_PATTERN.search(hole) and \
+                int(value) < len(constant_set):
+            used_constants.add(constant_set[int(value)])
+    return used_constants
+
+
+class BoundedConstantSet(OrderedSet):
+    def __init__(self, initial=None, max_size=None):
+        assert max_size is None or max_size >= 1
+        self.max_size = None
+        self.used = set()
+        # Constants added since the last call of set_used.
+        self.added = set()
+        # Constants evicted since the last call of restore_evicted.
+        self.evicted = []
+        self.num_evicted = 0
+        self.num_restored = 0
+        super().__init__(initial)
+        self.max_size = max_size
+        # The initial constants are never evicted.
+        self.pinned = set(self)
+
+    def pin(self, constants):
+        """Adds constants that are never evicted."""
+        for constant in constants:
+            self.pinned.add(constant)
+            super().add(constant)
+        if self.max_size is not None:
+            self.evict()
+
+    def set_used(self, constants):
+        """Keeps constants used by the latest candidate, and constants added
+        from now on, from being evicted until the next call."""
+        self.used = set(constants)
+        self.added = set()
+
+    def restore_evicted(self):
+        """Adds the constants evicted since the last call back as pinned
+        constants, over max_size if need be, and returns them."""
+        restored = [constant for constant in self.evicted
+                    if constant not in self.pinned]
+        for constant in restored:
+            self.pinned.add(constant)
+            super().add(constant)
+        self.evicted = []
+        self.num_restored += len(restored)
+        return restored
+
+    def add(self, constant):
+        if constant not in self:
+            self.added.add(constant)
+        super().add(constant)
+        if self.max_size is not None:
+            self.evict()
+        return self.index(constant)
+
+    def evict(self):
+        evictable = [constant for constant in self
+                     if constant not in self.pinned and
+                     constant not in self.used and
+                     constant not in self.added]
+        for constant in evictable[:len(self) - self.max_size]:
+            print('Evicting constant', constant, 'from the constant set')
+            self.discard(constant)
+            self.evicted.append(constant)
+            self.num_evicted += 1
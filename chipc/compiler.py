@@ -1,41 +1,33 @@
+import asyncio
 import concurrent.futures as cf
 import itertools
 import os
-import signal
+from collections import deque
 from collections import OrderedDict
 from os import path
 from pathlib import Path
 
-import psutil
 from jinja2 import Environment
 from jinja2 import FileSystemLoader
 from jinja2 import StrictUndefined
 
 from chipc import sketch_utils
+from chipc import tracing
 from chipc import z3_utils
 from chipc.mode import Mode
+from chipc.sketch_cache import get_default_cache
 from chipc.sketch_code_generator import SketchCodeGenerator
+from chipc.sketch_pool import SketchPool
+from chipc.sketch_portfolio import get_configuration_name
+from chipc.sketch_portfolio import SketchPortfolio
+from chipc.state_group_analysis import is_assignment_allowed
+from chipc.state_group_analysis import StateGroupAnalysis
 from chipc.tofino_code_generator import TofinoCodeGenerator
 from chipc.utils import get_hole_bit_width
 from chipc.utils import get_hole_value_assignments
 from chipc.utils import get_num_pkt_fields
 from chipc.utils import get_state_group_info
-
-
-def kill_child_processes(parent_pid, sig=signal.SIGTERM):
-    try:
-        parent = psutil.Process(parent_pid)
-    except psutil.NoSuchProcess:
-        return
-    children = parent.children(recursive=True)
-    for process in children:
-        try:
-            process.send_signal(sig)
-            print('send_signal killed a child process', process)
-        except psutil.NoSuchProcess as e:
-            print("send_signal didn't have any effect because process didn't"
-                  'exist')
-            print(e)
+from chipc.z3_verifier import Z3Verifier
 
 
 class Compiler:
@@ -47,7 +39,16 @@ class Compiler:
                  output_packet_fields=[],
                  output_state_groups=[],
                  input_packet_fields=[],
-                 target_tofino=False):
+                 target_tofino=False,
+                 native_verify=False,
+                 use_sketch_cache=False,
+                 sketch_timeout=None,
+                 max_sketch_jobs=None,
+                 portfolio_size=1,
+                 job_queue=None,
+                 generalize_counterexamples=False,
+                 bit_vector_verify=False,
+                 bit_vector_width=None):
         self.spec_filename = spec_filename
         self.stateful_alu_filename = stateful_alu_filename
         self.stateless_alu_filename = stateless_alu_filename
@@ -58,8 +59,35 @@ class Compiler:
         self.constant_set = constant_set
         self.synthesized_allocation = synthesized_allocation
         self.target_tofino = target_tofino
+        self.native_verify = native_verify
+        # Verification formulas from Sketch DAGs are over z3.BitVec instead
+        # of z3.Int if set, see z3_utils.BitVecDagParser.
+        assert not (native_verify and bit_vector_verify), \
+            'Bit-vector verification is not supported with native verify.'
+        self.bit_vector_verify = bit_vector_verify
+        self.bit_vector_width = bit_vector_width
+        # Results of Sketch invocations are reused across runs if the cache
+        # is enabled here and not disabled in the environment. Keying the
+        # cache takes a run of sketch --version, so it is off by default.
+        self.sketch_cache = get_default_cache() if use_sketch_cache else None
+        # Seconds after which synthesis runs of sketch are killed.
+        self.sketch_timeout = sketch_timeout
+        # Bounds sketch runs of parallel_codegen by cores and free memory.
+        self.sketch_pool = SketchPool(max_sketch_jobs)
+        # If given, a JobQueue that runs sketch runs of parallel_codegen on
+        # workers instead, which bound the runs themselves.
+        self.job_queue = job_queue
+        # Dependencies and symmetries of state groups, to prune assignments
+        # of state groups to stages. Only computed for parallel_codegen.
+        self.stage_assignment_constraints = None
+        # Holes of the latest codegen sketch, to parse sketch output with.
+        self.codegen_hole_names = []
 
         program_content = Path(spec_filename).read_text()
+        # Configurations of sketch to race on each codegen sketch.
+        self.sketch_portfolio = SketchPortfolio(portfolio_size,
+                                                program_content,
+                                                parallel_sketch)
         self.num_fields_in_prog = get_num_pkt_fields(program_content)
         self.num_state_groups = len(get_state_group_info(program_content))
 
@@ -127,7 +155,15 @@ class Compiler:
             input_packet_fields=input_packet_fields,
             target_tofino=target_tofino)
 
+        # Builds z3 formulas for verification without going through Sketch.
+        self.z3_verifier = Z3Verifier(self.sketch_code_generator,
+                                      spec_filename)
+        # One z3 solver is reused to verify all candidate hole assignments.
+        self.counterexample_generator = z3_utils.CounterexampleGenerator(
+            generalize=generalize_counterexamples)
+
     def update_constants_for_synthesis(self, constant_set):
+        self.constant_set = constant_set
         # Join the values in constant_set to get constant_array in sketch.
         new_constant_set_str = '{' + ','.join(constant_set) + '}'
 
@@ -138,67 +174,118 @@ class Compiler:
         self.sketch_code_generator.constant_arr_size_ = get_hole_bit_width(
             len(constant_set))
 
-    def single_codegen_run(self, compiler_input):
+    def write_codegen_sketch(self, compiler_input):
         additional_constraints = compiler_input[0]
         additional_testcases = compiler_input[1]
         sketch_file_name = compiler_input[2]
 
         """Codegeneration"""
-        codegen_code = self.sketch_code_generator.generate_sketch(
-            spec_filename=self.spec_filename,
-            mode=Mode.CODEGEN,
-            synthesized_allocation=self.synthesized_allocation,
-            additional_constraints=additional_constraints,
-            additional_testcases=additional_testcases)
+        with tracing.span('codegen', sketch_file_name=sketch_file_name,
+                          num_constants=len(self.constant_set)) as \
+                attributes, self.sketch_code_generator.lock_:
+            codegen_code = self.sketch_code_generator.generate_sketch(
+                spec_filename=self.spec_filename,
+                mode=Mode.CODEGEN,
+                synthesized_allocation=self.synthesized_allocation,
+                additional_constraints=additional_constraints,
+                additional_testcases=additional_testcases)
+            # Verification may generate sketches on another thread before
+            # the output of this one is parsed. Cached hole lists are never
+            # changed, so holding on to them is enough.
+            self.codegen_hole_names = self.sketch_code_generator.hole_names_
+            total_hole_bits = self.sketch_code_generator.total_hole_bits_
+            attributes['sketch_bytes'] = len(codegen_code)
+            attributes['hole_bits'] = total_hole_bits
 
         # Create file and write sketch_harness into it.
-        with open(sketch_file_name, 'w') as sketch_file:
-            sketch_file.write(codegen_code)
+        with tracing.span('write sketch', sketch_file_name=sketch_file_name):
+            with open(sketch_file_name, 'w') as sketch_file:
+                sketch_file.write(codegen_code)
 
-        # Call sketch on it
-        print('Total number of hole bits is',
-              self.sketch_code_generator.total_hole_bits_)
+        print('Total number of hole bits is', total_hole_bits)
         print('Sketch file is', sketch_file_name)
-        assert (self.parallel_sketch in [True, False])
-        (ret_code, output) = sketch_utils.synthesize(
-            sketch_file_name,
-            bnd_inbits=2,
-            slv_seed=1,
-            slv_parallel=self.parallel_sketch)
+        return sketch_file_name
 
+    def get_codegen_output(self, sketch_file_name, ret_code, output):
         # Store sketch output
         with open(sketch_file_name[:sketch_file_name.find('.sk')] +
                   '_output.txt', 'w') as output_file:
             output_file.write(output)
         if (ret_code == 0):
             holes_to_values = get_hole_value_assignments(
-                self.sketch_code_generator.hole_names_, output)
+                self.codegen_hole_names, output)
         else:
             holes_to_values = OrderedDict()
         return (ret_code, output, holes_to_values)
 
+    def single_codegen_run(self, compiler_input):
+        sketch_file_name = self.write_codegen_sketch(compiler_input)
+
+        # Call sketch on it
+        assert (self.parallel_sketch in [True, False])
+        configuration = self.sketch_portfolio.get_configurations()[0]
+        (slv_seed, slv_parallel, options) = configuration
+        with tracing.span('synthesis', sketch_file_name=sketch_file_name,
+                          configuration=get_configuration_name(
+                              configuration)) as attributes:
+            (ret_code, output) = sketch_utils.synthesize(
+                sketch_file_name,
+                bnd_inbits=2,
+                slv_seed=slv_seed,
+                slv_parallel=slv_parallel,
+                cache=self.sketch_cache,
+                timeout=self.sketch_timeout,
+                options=options)
+            attributes['return_code'] = ret_code
+        return self.get_codegen_output(sketch_file_name, ret_code, output)
+
+    async def single_codegen_run_async(self, sketch_file_name,
+                                       configuration):
+        (slv_seed, slv_parallel, options) = configuration
+        with tracing.span('synthesis', sketch_file_name=sketch_file_name,
+                          configuration=get_configuration_name(
+                              configuration)) as attributes:
+            (ret_code, output) = await sketch_utils.synthesize_async(
+                sketch_file_name,
+                bnd_inbits=2,
+                slv_seed=slv_seed,
+                slv_parallel=slv_parallel,
+                cache=self.sketch_cache,
+                timeout=self.sketch_timeout,
+                options=options,
+                job_queue=self.job_queue)
+            attributes['return_code'] = ret_code
+        return self.get_codegen_output(sketch_file_name, ret_code, output)
+
     def serial_codegen(self, iter_cnt=1, additional_constraints=[],
                        additional_testcases=''):
-        return self.single_codegen_run((additional_constraints,
-                                        additional_testcases,
-                                        self.sketch_name +
-                                        '_codegen_iteration_' +
-                                        str(iter_cnt) + '.sk'))
+        compiler_input = (additional_constraints, additional_testcases,
+                          self.sketch_name + '_codegen_iteration_' +
+                          str(iter_cnt) + '.sk')
+        if len(self.sketch_portfolio.configurations) == 1 and \
+                self.job_queue is None:
+            return self.single_codegen_run(compiler_input)
+        (compiler_output, _) = asyncio.run(
+            self.parallel_codegen_async([compiler_input]))
+        return compiler_output
 
-    def parallel_codegen(self,
-                         additional_constraints=[],
-                         additional_testcases=''):
+    def get_parallel_codegen_inputs(self, additional_constraints,
+                                    additional_testcases):
         # For each state_group, pick a pipeline_stage exhaustively.
         # Note that some of these assignments might be infeasible, but that's
         # OK. Sketch will reject these anyway.
+        (dependencies, symmetry_classes) = \
+            self.get_stage_assignment_constraints()
         count = 0
-        compiler_output = None
         compiler_inputs = []
         for assignment in itertools.product(list(
             range(self.num_pipeline_stages)),
                 repeat=self.num_state_groups):
-            constraint_list = additional_constraints.copy()
             count = count + 1
+            if not is_assignment_allowed(assignment, dependencies,
+                                         symmetry_classes):
+                continue
+            constraint_list = additional_constraints.copy()
             print('Now in assignment # ', count, ' assignment is ', assignment)
             for state_group in range(self.num_state_groups):
                 assigned_stage = assignment[state_group]
@@ -215,61 +302,252 @@ class Compiler:
                         ]
             compiler_inputs += [
                 (constraint_list, additional_testcases,
-                 self.sketch_name + '_' + str(count) + '_codegen.sk')
+                 self.sketch_name + '_' + str(count) + '_codegen.sk',
+                 assignment)
             ]
+        print('Pruned {} of {} assignments of state groups to stages '
+              '({:.0%})'.format(count - len(compiler_inputs), count,
+                                1 - len(compiler_inputs) / count))
+        # Sorting is stable, so ties keep their order.
+        compiler_inputs.sort(
+            key=lambda compiler_input: self.get_assignment_priority(
+                compiler_input[3]))
+        return [compiler_input[:3] for compiler_input in compiler_inputs]
+
+    def get_stage_assignment_constraints(self):
+        """Returns a tuple of the dependencies and the symmetry classes of
+        state groups, see state_group_analysis."""
+        if self.stage_assignment_constraints is not None:
+            return self.stage_assignment_constraints
+        program_content = Path(self.spec_filename).read_text()
+        generator = self.sketch_code_generator
+        try:
+            analysis = StateGroupAnalysis(
+                program_content, self.num_fields_in_prog,
+                get_state_group_info(program_content))
+        except AssertionError as e:
+            print('Trying all assignments of state groups to stages, as the '
+                  'spec could not be analysed:', e)
+            self.stage_assignment_constraints = ([], [])
+            return self.stage_assignment_constraints
+
+        dependencies = analysis.get_dependencies(
+            generator.output_state_groups_)
+        # Swapping state groups only maps compilations to each other if the
+        # whole spec is compiled.
+        symmetry_classes = []
+        if list(generator.output_packet_fields_) == list(
+                range(self.num_fields_in_prog)) and \
+                list(generator.input_packet_fields_) == list(
+                    range(self.num_fields_in_prog)) and \
+                list(generator.output_state_groups_) == list(
+                    range(self.num_state_groups)):
+            symmetry_classes = analysis.get_symmetry_classes()
+        print('State groups depend on earlier ones as', dependencies,
+              'and are symmetric as', symmetry_classes)
+        self.stage_assignment_constraints = (dependencies, symmetry_classes)
+        return self.stage_assignment_constraints
+
+    def get_assignment_priority(self, assignment):
+        """Returns a key to order the stages assigned to state groups by, so
+        that sketch runs on the likeliest assignments start first when not
+        all of them can run at once.
+
+        Assignments closer to the middle stage come first, as they leave
+        stages for stateless ALUs both before stateful ALUs, e.g., to compute
+        their operands, and after them, e.g., to use their outputs."""
+        middle_stage = (self.num_pipeline_stages - 1) / 2
+        return sum(abs(stage - middle_stage) for stage in assignment)
 
-        with cf.ProcessPoolExecutor(max_workers=count) as executor:
-            futures = []
-            for compiler_input in compiler_inputs:
-                futures.append(
-                    executor.submit(self.single_codegen_run, compiler_input))
-
-            for f in cf.as_completed(futures):
-                compiler_output = f.result()
-                if (compiler_output[0] == 0):
-                    print('Success')
-                    # TODO: Figure out the right way to do this in the future.
-                    executor.shutdown(wait=False)
-                    kill_child_processes(os.getpid())
-                    return compiler_output
-                else:
-                    print('One run failed, waiting for others.')
+    def parallel_codegen(self,
+                         additional_constraints=[],
+                         additional_testcases=''):
+        """Runs sketch on all allocations of state groups to stages at the
+        same time, and returns the output of the first successful run, or of
+        the last run if none succeeds."""
+        compiler_inputs = self.get_parallel_codegen_inputs(
+            additional_constraints, additional_testcases)
+        (compiler_output, _) = asyncio.run(
+            self.parallel_codegen_async(compiler_inputs))
         return compiler_output
 
-    def verify(self, hole_assignments, input_bits, iter_cnt=1):
-        """Verify hole value assignments for the sketch with a specific input
-        bit lengths with z3.
-
-        Returns:
-            A tuple of two dicts from string to ints, where the first one
-            represents counterexamples for packet variables and the second for
-            state group variables.
-            If the hole value assignments work for the input_bits, returns
-            a tuple of two empty dicts.
-        """
+    def parallel_codegen_and_verify(self, verify,
+                                    additional_constraints=[],
+                                    additional_testcases=''):
+        """Like parallel_codegen, but also verifies successful candidates
+        with verify, a function from hole value assignments to a list of
+        counterexamples, while the other sketch runs go on.
+
+        Returns a tuple of the compiler output and its counterexamples. A
+        candidate without counterexamples is returned as soon as it is
+        verified. Otherwise, the first candidate is returned once all
+        verifications started before it finished are done."""
+        compiler_inputs = self.get_parallel_codegen_inputs(
+            additional_constraints, additional_testcases)
+        return asyncio.run(self.parallel_codegen_async(compiler_inputs,
+                                                       verify))
+
+    async def parallel_codegen_async(self, compiler_inputs, verify=None):
+        if not compiler_inputs:
+            return ((1, 'No assignment of state groups to stages meets the '
+                        'dependencies between state groups.\n',
+                     OrderedDict()), None)
+        loop = asyncio.get_running_loop()
+        # Verification reuses a single z3 solver, so it runs on one thread.
+        verify_executor = cf.ThreadPoolExecutor(max_workers=1)
+        # Every configuration of the portfolio runs on every input, with
+        # a sketch file of its own.
+        configurations = self.sketch_portfolio.get_configurations()
+        pending_inputs = deque(
+            (compiler_input if len(configurations) == 1 else
+             compiler_input[:2] + (compiler_input[2][:-len('.sk')] + '_' +
+                                   get_configuration_name(configuration) +
+                                   '.sk',),
+             configuration)
+            for compiler_input in compiler_inputs
+            for configuration in configurations)
+        codegen_tasks = set()
+        task_configurations = {}
+        has_winner = False
+        # Maps verification futures to the compiler outputs they verify.
+        verify_tasks = {}
+        compiler_output = None
+        failed_verification = None
+        try:
+            while pending_inputs or codegen_tasks or verify_tasks:
+                # Start as many runs in priority order as the pool allows.
+                # Sketch files are generated as their runs start, as there
+                # can be many more inputs than runs.
+                if failed_verification is None:
+                    num_free_slots = len(pending_inputs) if \
+                        self.job_queue is not None else \
+                        self.sketch_pool.get_num_free_slots(
+                            len(codegen_tasks))
+                    for _ in range(num_free_slots):
+                        if not pending_inputs:
+                            break
+                        (compiler_input, configuration) = \
+                            pending_inputs.popleft()
+                        sketch_file_name = self.write_codegen_sketch(
+                            compiler_input)
+                        task = asyncio.ensure_future(
+                            self.single_codegen_run_async(sketch_file_name,
+                                                          configuration))
+                        task_configurations[task] = configuration
+                        codegen_tasks.add(task)
+
+                (done, _) = await asyncio.wait(
+                    codegen_tasks | set(verify_tasks),
+                    return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task in verify_tasks:
+                        counterexamples = task.result()
+                        output = verify_tasks.pop(task)
+                        if len(counterexamples) == 0:
+                            return (output, counterexamples)
+                        if failed_verification is None:
+                            failed_verification = (output, counterexamples)
+                        continue
+
+                    codegen_tasks.remove(task)
+                    compiler_output = task.result()
+                    if (compiler_output[0] != 0):
+                        print('One run failed, waiting for others.')
+                        continue
+                    if not has_winner:
+                        # Later runs try the winning configuration first.
+                        has_winner = True
+                        self.sketch_portfolio.record_win(
+                            task_configurations[task])
+                    if verify is None:
+                        print('Success with', get_configuration_name(
+                            task_configurations[task]))
+                        return (compiler_output, None)
+                    if failed_verification is None:
+                        print('Success, verifying while other runs go on.')
+                        verify_tasks[loop.run_in_executor(
+                            verify_executor, verify,
+                            compiler_output[2])] = compiler_output
+                if failed_verification is not None and not verify_tasks:
+                    return failed_verification
+            return (compiler_output, None)
+        finally:
+            # Cancelled tasks terminate the process groups of their sketch
+            # runs, and nothing else.
+            for task in codegen_tasks:
+                task.cancel()
+            await asyncio.gather(*codegen_tasks, return_exceptions=True)
+            verify_executor.shutdown(wait=True)
+
+    def get_verification_formula(self, hole_assignments, input_bits,
+                                 iter_cnt=1):
+        """Returns a z3 formula that holds iff the hole value assignments work
+        for the specific input bit lengths."""
         # Check all holes have values.
-        for hole in self.sketch_code_generator.hole_names_:
+        for hole in self.codegen_hole_names:
             assert hole in hole_assignments
 
+        if self.native_verify:
+            # The native verifier reads the hole state of the generator.
+            with tracing.span('z3 formula', input_bits=input_bits), \
+                    self.sketch_code_generator.lock_:
+                return self.z3_verifier.get_z3_formula(
+                    hole_assignments, self.constant_set, input_bits)
+
         # Generate a sketch file to verify the hole value assignments with
         # the specified input bit lengths.
-        sketch_to_verify = self.sketch_code_generator.generate_sketch(
-            spec_filename=self.spec_filename,
-            mode=Mode.VERIFY,
-            synthesized_allocation=self.synthesized_allocation,
-            hole_assignments=hole_assignments
-        )
+        with tracing.span('verification codegen') as attributes:
+            sketch_to_verify = self.sketch_code_generator.generate_sketch(
+                spec_filename=self.spec_filename,
+                mode=Mode.VERIFY,
+                synthesized_allocation=self.synthesized_allocation,
+                hole_assignments=hole_assignments
+            )
+            attributes['sketch_bytes'] = len(sketch_to_verify)
 
         # Write sketch to a file.
         file_basename = self.sketch_name + '_verify_iter_' + str(iter_cnt)
         sketch_filename = file_basename + '.sk'
-        Path(sketch_filename).write_text(sketch_to_verify)
+        with tracing.span('write sketch', sketch_file_name=sketch_filename):
+            Path(sketch_filename).write_text(sketch_to_verify)
+
+        with tracing.span('dag generation', sketch_file_name=sketch_filename):
+            dag_filename = sketch_utils.generate_dag_file(sketch_filename,
+                                                          self.sketch_cache)
 
-        sketch_ir = sketch_utils.generate_ir(sketch_filename)
+        with tracing.span('z3 formula', input_bits=input_bits):
+            return z3_utils.get_z3_formula_from_dag_file(
+                dag_filename, input_bits, self.bit_vector_verify,
+                self.bit_vector_width)
 
-        z3_formula = z3_utils.get_z3_formula(sketch_ir, input_bits)
+    def verify(self, hole_assignments, input_bits, iter_cnt=1):
+        """Verify hole value assignments for the sketch with a specific input
+        bit lengths with z3.
 
-        return z3_utils.generate_counterexamples(z3_formula)
+        Returns:
+            A tuple of two dicts from string to ints, where the first one
+            represents counterexamples for packet variables and the second for
+            state group variables.
+            If the hole value assignments work for the input_bits, returns
+            a tuple of two empty dicts.
+        """
+        formula = self.get_verification_formula(hole_assignments, input_bits,
+                                                iter_cnt)
+        with tracing.span('z3 check'):
+            return self.counterexample_generator.generate(formula)
+
+    def verify_all(self, hole_assignments, input_bits, num_counterexamples,
+                   iter_cnt=1):
+        """Same as verify, but returns a list of up to num_counterexamples
+        distinct counterexamples, which is empty if the hole value assignments
+        work for the input_bits."""
+        formula = self.get_verification_formula(hole_assignments, input_bits,
+                                                iter_cnt)
+        with tracing.span('z3 check') as attributes:
+            counterexamples = self.counterexample_generator.generate_all(
+                formula, num_counterexamples)
+            attributes['num_counterexamples'] = len(counterexamples)
+        return counterexamples
 
     def compile_to_tofino(self, hole_assignments):
         hole_assignments = dict({
@@ -289,4 +567,5 @@ class Compiler:
             hole_assignments,
         )
 
-        tofino_code_generator.run()
+        with tracing.span('tofino codegen'):
+            tofino_code_generator.run()
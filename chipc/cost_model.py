@@ -0,0 +1,170 @@
+"""Predicts the time and memory of a compilation before it starts.
+
+The model is fitted on results of benchmarks/compilation_benchmark.py, which
+records the features of each run next to its wall time and peak memory. Both
+are assumed to grow exponentially with the features, so their logarithms are
+fitted linearly by least squares, with a small ridge penalty to cope with few
+runs and correlated features.
+
+Features are read off the first codegen sketch of a Compiler, which only
+takes its generation and no Sketch run. See iterative_solver --dry-run.
+"""
+import argparse
+import json
+import math
+import re
+import sys
+from pathlib import Path
+
+from chipc.mode import Mode
+from chipc.z3_spec import get_program_body
+
+FEATURES = ['initial_hole_bits', 'mux_hole_bits', 'num_state_groups',
+            'num_testcases', 'spec_tokens']
+
+# Control holes of muxes, whose widths are the logarithms of their arities.
+# Muxes in stateful ALUs are named after their arities, e.g., Mux3.
+MUX_HOLE_PATTERN = re.compile(r'mux_\w*ctrl$|Mux\d+_\d+_global$')
+
+RIDGE_PENALTY = 1e-3
+
+
+def get_features(compiler, num_testcases=0):
+    """Returns a dict of the features of compiling with compiler, starting
+    with num_testcases test cases."""
+    sketch_code_generator = compiler.sketch_code_generator
+    sketch_code_generator.generate_sketch(
+        spec_filename=compiler.spec_filename, mode=Mode.CODEGEN,
+        synthesized_allocation=compiler.synthesized_allocation)
+    mux_hole_bits = sum(hole.max.bit_length() for hole in
+                        sketch_code_generator.holes_
+                        if MUX_HOLE_PATTERN.search(hole.name))
+    program_content = Path(compiler.spec_filename).read_text()
+    return {
+        'initial_hole_bits': sketch_code_generator.total_hole_bits_,
+        'mux_hole_bits': mux_hole_bits,
+        'num_state_groups': compiler.num_state_groups,
+        'num_testcases': num_testcases,
+        'spec_tokens': len(get_program_body(program_content)[1])
+    }
+
+
+def solve_linear(matrix, vector):
+    """Solves matrix * x = vector by Gaussian elimination with partial
+    pivoting, for a small, non-singular matrix."""
+    size = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda i: abs(rows[i][column]))
+        (rows[column], rows[pivot]) = (rows[pivot], rows[column])
+        for i in range(column + 1, size):
+            factor = rows[i][column] / rows[column][column]
+            for j in range(column, size + 1):
+                rows[i][j] -= factor * rows[column][j]
+    solution = [0.0] * size
+    for i in reversed(range(size)):
+        solution[i] = (rows[i][size] - sum(
+            rows[i][j] * solution[j] for j in range(i + 1, size))) / \
+            rows[i][i]
+    return solution
+
+
+class CostModel:
+    def __init__(self, means, scales, seconds_weights, memory_weights):
+        # Features are standardized with means and scales before weighting.
+        self.means = means
+        self.scales = scales
+        # Weights of the intercept followed by those of FEATURES, for the
+        # logarithms of seconds and of peak bytes.
+        self.seconds_weights = seconds_weights
+        self.memory_weights = memory_weights
+
+    @staticmethod
+    def fit(records):
+        """Fits a CostModel on benchmark results, dicts with FEATURES,
+        wall_seconds and peak_rss_bytes."""
+        records = [record for record in records if all(
+            record.get(field) is not None for field in
+            FEATURES + ['wall_seconds', 'peak_rss_bytes'])]
+        assert records, 'No benchmark results with features to fit on.'
+        means = [sum(record[feature] for record in records) / len(records)
+                 for feature in FEATURES]
+        scales = [math.sqrt(sum((record[feature] - mean) ** 2
+                                for record in records) / len(records)) or 1.0
+                  for (feature, mean) in zip(FEATURES, means)]
+        model = CostModel(means, scales, None, None)
+        rows = [model.get_row(record) for record in records]
+        # Normal equations of ridge regression, without penalizing the
+        # intercept.
+        gram = [[sum(row[i] * row[j] for row in rows) +
+                 (RIDGE_PENALTY * len(rows) if i == j and i > 0 else 0)
+                 for j in range(len(rows[0]))] for i in range(len(rows[0]))]
+
+        def fit_target(values):
+            return solve_linear(gram, [
+                sum(row[i] * value for (row, value) in zip(rows, values))
+                for i in range(len(rows[0]))])
+
+        model.seconds_weights = fit_target(
+            [math.log(record['wall_seconds']) for record in records])
+        model.memory_weights = fit_target(
+            [math.log(record['peak_rss_bytes']) for record in records])
+        return model
+
+    def get_row(self, features):
+        return [1.0] + [(features[feature] - mean) / scale for
+                        (feature, mean, scale) in
+                        zip(FEATURES, self.means, self.scales)]
+
+    def predict(self, features):
+        """Returns predicted seconds and peak bytes of memory for a dict of
+        features."""
+        row = self.get_row(features)
+        return (math.exp(sum(w * x for (w, x) in
+                             zip(self.seconds_weights, row))),
+                math.exp(sum(w * x for (w, x) in
+                             zip(self.memory_weights, row))))
+
+    def save(self, file_name):
+        with open(file_name, 'w') as model_file:
+            json.dump({'features': FEATURES, 'means': self.means,
+                       'scales': self.scales,
+                       'seconds_weights': self.seconds_weights,
+                       'memory_weights': self.memory_weights},
+                      model_file, indent=1)
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name) as model_file:
+            fields = json.load(model_file)
+        assert fields['features'] == FEATURES, (
+            'Cost model was fitted on other features', fields['features'])
+        return CostModel(fields['means'], fields['scales'],
+                         fields['seconds_weights'], fields['memory_weights'])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Fit a cost model on benchmark results.')
+    parser.add_argument(
+        'results', nargs='+',
+        help='JSON results of benchmarks/compilation_benchmark.py')
+    parser.add_argument('--output', required=True,
+                        help='File to write the cost model to')
+    args = parser.parse_args(argv[1:])
+    records = []
+    for file_name in args.results:
+        with open(file_name) as results_file:
+            records += json.load(results_file)
+    model = CostModel.fit(records)
+    model.save(args.output)
+    print('Fitted cost model on', len(records), 'results to', args.output)
+    return 0
+
+
+def run_main():
+    sys.exit(main(sys.argv))
+
+
+if __name__ == '__main__':
+    run_main()
@@ -0,0 +1,118 @@
+"""Counterexamples that CEGIS added as test cases to the synthesis sketch.
+
+The store keeps each counterexample as values of packet fields and state
+variables, with the test case rendered for it, and only adds counterexamples
+whose values it doesn't have yet. It can be bounded to a number of test
+cases, in which case the oldest test case is dropped for a new one. Every
+candidate sketch returns satisfies all test cases, so old ones mostly hold
+for later candidates anyway. Should verification find a dropped
+counterexample again, it is added back for good, so that CEGIS still
+terminates.
+
+Counterexamples can be saved to a JSON file, to start later compilations of
+the same spec with them.
+"""
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+
+def get_key(pkt_fields, state_vars):
+    return (tuple(sorted(pkt_fields.items())),
+            tuple(sorted(state_vars.items())))
+
+
+class Counterexample:
+    def __init__(self, name, pkt_fields, state_vars, testcase):
+        self.name = name
+        self.pkt_fields = pkt_fields
+        self.state_vars = state_vars
+        # Definition and asserts of the test case in the sketch.
+        self.testcase = testcase
+
+
+class CounterexampleStore:
+    def __init__(self, render, file_name=None, max_testcases=None):
+        """render is a function from the packet fields, state variables and
+        name of a counterexample to its test case. If file_name is given, the
+        counterexamples are saved to it as they are added."""
+        assert max_testcases is None or max_testcases >= 1
+        self.render = render
+        self.file_name = file_name
+        self.max_testcases = max_testcases
+        # Maps keys of values to Counterexamples, oldest first.
+        self.counterexamples = OrderedDict()
+        # Keys of dropped counterexamples, and of ones never to drop again.
+        self.dropped = set()
+        self.pinned = set()
+        self.testcases = None
+
+    def __len__(self):
+        return len(self.counterexamples)
+
+    def add(self, pkt_fields, state_vars, name):
+        """Adds a counterexample, unless one with the same values is already
+        there, and returns whether it was added."""
+        key = get_key(pkt_fields, state_vars)
+        if key in self.counterexamples:
+            return False
+        if key in self.dropped:
+            self.pinned.add(key)
+        self.counterexamples[key] = Counterexample(
+            name, pkt_fields, state_vars,
+            self.render(pkt_fields, state_vars, name))
+        if self.testcases is not None:
+            self.testcases += self.counterexamples[key].testcase
+        if self.max_testcases is not None:
+            self.drop_oldest()
+        if self.file_name is not None:
+            self.save(self.file_name)
+        return True
+
+    def drop_oldest(self):
+        droppable = [key for key in self.counterexamples
+                     if key not in self.pinned]
+        for key in droppable[:len(self.counterexamples) - self.max_testcases]:
+            print('Dropping test case', self.counterexamples[key].name)
+            del self.counterexamples[key]
+            self.dropped.add(key)
+            self.testcases = None
+
+    def get_testcases(self):
+        """Returns the test cases of all counterexamples, to add to the
+        synthesis sketch."""
+        # Test cases are only joined again after some are dropped.
+        if self.testcases is None:
+            self.testcases = ''.join(
+                counterexample.testcase
+                for counterexample in self.counterexamples.values())
+        return self.testcases
+
+    def get_counterexamples(self):
+        """Returns a list of (pkt_fields, state_vars) tuples."""
+        return [(counterexample.pkt_fields, counterexample.state_vars)
+                for counterexample in self.counterexamples.values()]
+
+    def save(self, file_name):
+        path = Path(file_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Replace the file atomically, so that other compilations never read
+        # a partially written one.
+        (fd, tmp_path) = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump([{'pkt_fields': pkt_fields, 'state_vars': state_vars}
+                       for (pkt_fields, state_vars) in
+                       self.get_counterexamples()], tmp_file, indent=1)
+        os.replace(tmp_path, path)
+
+
+def load_counterexamples(file_name):
+    """Returns a list of (pkt_fields, state_vars) tuples saved to file_name,
+    or an empty list if there is no such file."""
+    try:
+        entries = json.loads(Path(file_name).read_text())
+    except FileNotFoundError:
+        return []
+    return [(entry['pkt_fields'], entry['state_vars']) for entry in entries]
@@ -1,15 +1,24 @@
 """Repeated Solver"""
 import argparse
+import json
 import sys
+import time
 from pathlib import Path
 
-from ordered_set import OrderedSet
-
+from chipc import cost_model
+from chipc import profiling
+from chipc import tracing
+from chipc.bounded_constant_set import BoundedConstantSet
+from chipc.bounded_constant_set import get_used_constants
 from chipc.compiler import Compiler
+from chipc.counterexample_store import CounterexampleStore
+from chipc.counterexample_store import load_counterexamples
+from chipc.job_queue import JobQueue
 from chipc.utils import compilation_failure
 from chipc.utils import compilation_success
 from chipc.utils import get_num_pkt_fields
 from chipc.utils import get_state_group_info
+from chipc.z3_spec import get_spec_constants
 
 
 def print_set(constant_set):
@@ -20,6 +29,14 @@ def print_set(constant_set):
     print(ret_str)
 
 
+def print_evictions(args, constant_set, num_iterations, seconds):
+    if args.max_constants is not None:
+        print('Evicted', constant_set.num_evicted, 'constants to keep at most',
+              args.max_constants, 'and restored',
+              constant_set.num_restored, 'of them, in', num_iterations,
+              'iterations and {:.3f} seconds'.format(seconds))
+
+
 def generate_hole_elimination_assert(hole_assignments):
     """Given hole value assignments, {'n_0: 'v_0', 'n_1': 'v_1', ... }, which
     failed to verify for larger input bit ranges, generates a single element
@@ -138,8 +155,11 @@ def generate_counterexample_asserts(pkt_fields, state_vars, num_fields_in_prog,
     return counterexample_defs + counterexample_asserts
 
 
-def main(argv):
-    parser = argparse.ArgumentParser(description='Iterative solver.')
+def get_argument_parser(description='Iterative solver.',
+                        grid_help=('Number of pipeline stages',
+                                   'Number of stateless/stateful ALUs per '
+                                   'stage')):
+    parser = argparse.ArgumentParser(description=description)
     parser.add_argument(
         'spec_filename', help='Program specification in .sk file')
     parser.add_argument('stateful_alu_filename',
@@ -147,11 +167,11 @@ def main(argv):
     parser.add_argument(
         'stateless_alu_filename', help='Stateless ALU file to use.')
     parser.add_argument(
-        'num_pipeline_stages', type=int, help='Number of pipeline stages')
+        'num_pipeline_stages', type=int, help=grid_help[0])
     parser.add_argument(
         'num_alus_per_stage',
         type=int,
-        help='Number of stateless/stateful ALUs per stage')
+        help=grid_help[1])
     parser.add_argument(
         'constant_set',
         type=str,
@@ -214,16 +234,230 @@ def main(argv):
         help='If set, use the push mode instead of pull mode to update PHVs\
               from stateful ALUs.'
     )
+    parser.add_argument(
+        '--native-verify',
+        action='store_true',
+        help='If set, build the z3 formula for verification directly from \
+              the ALUs and the spec instead of from the IR of a sketch.'
+    )
+    parser.add_argument(
+        '--bit-vector-verify',
+        action='store_true',
+        help='If set, verify with z3 bit-vectors instead of integers, which \
+              avoids nonlinear integer arithmetic for *, / and %%. Values \
+              never overflow unless --bit-vector-width is given.'
+    )
+    parser.add_argument(
+        '--bit-vector-width',
+        type=int,
+        help='With --bit-vector-verify, make all values this many bits \
+              wide and wrap around on overflow, e.g., 32 like registers of \
+              Tofino.'
+    )
+    parser.add_argument(
+        '--sketch-cache',
+        action='store_true',
+        help='If set, reuse results of earlier runs of the same sketch, \
+              cached on disk in ~/.cache/chipmunk/sketch unless \
+              CHIPMUNK_SKETCH_CACHE_DIR is set. CHIPMUNK_SKETCH_CACHE=0 turns \
+              the cache off even if set.'
+    )
+    parser.add_argument(
+        '--sketch-timeout',
+        type=float,
+        default=None,
+        help='Seconds after which a synthesis run of sketch is killed and \
+              counted as failed.'
+    )
+    parser.add_argument(
+        '--max-sketch-jobs',
+        type=int,
+        default=None,
+        help='Maximum number of sketch runs in flight with --parallel. \
+              Defaults to the number of cores, and fewer runs start if free \
+              memory runs low.'
+    )
+    parser.add_argument(
+        '--portfolio-size',
+        type=int,
+        default=1,
+        help='Number of sketch configurations, e.g., seeds, to race on each \
+              sketch. The first one to succeed wins, and is tried first for \
+              the spec next time.'
+    )
+    parser.add_argument(
+        '--job-queue',
+        help='SQLite database of a job queue to run sketch on instead, \
+              with workers started by codegen_worker <database>.'
+    )
+    parser.add_argument(
+        '--trace',
+        help='Write timing spans of the phases of compilation to \
+              <TRACE>.jsonl as JSON lines and to <TRACE>.json as a Chrome \
+              trace.'
+    )
+    parser.add_argument(
+        '--max-constants',
+        type=int,
+        help='Maximum number of constants in the constant set. Constants of \
+              counterexamples beyond it evict the oldest ones that are \
+              neither in constant_set nor used by the latest candidate. If \
+              synthesis fails after evictions, it is retried with the evicted \
+              constants before the grid is deemed infeasible.'
+    )
+    parser.add_argument(
+        '--spec-constants',
+        action='store_true',
+        help='Add the integer literals of the spec, their negations and the \
+              values one below and above them to constant_set, instead of \
+              finding them through counterexamples.'
+    )
+    parser.add_argument(
+        '--generalize-counterexamples',
+        action='store_true',
+        help='Shrink the values of counterexamples toward 0 while they still \
+              fail, so that test cases prune more candidates and add fewer \
+              constants.'
+    )
+    parser.add_argument(
+        '--counterexample-file',
+        help='JSON file to start with the counterexamples saved to, and to \
+              save counterexamples to as they are found.'
+    )
+    parser.add_argument(
+        '--max-testcases',
+        type=int,
+        help='Maximum number of counterexamples to keep as test cases in \
+              the synthesis sketch. The oldest ones are dropped first.'
+    )
+    parser.add_argument(
+        '--profile',
+        help='Profile compilation with cProfile, and write the profiles of \
+              phases to <PROFILE>_<phase>.pstats, all of them merged to \
+              <PROFILE>.pstats and a summary of hot functions to \
+              <PROFILE>.txt. From Python 3.12 on, a phase running on a \
+              thread, e.g., verification with --parallel, also gets the time \
+              of the other threads.'
+    )
+    parser.add_argument(
+        '--profile-top',
+        type=int,
+        default=20,
+        help='Number of hot functions in the summary of --profile.'
+    )
+    parser.add_argument(
+        '--profile-children',
+        action='store_true',
+        help='With --profile, also sample the CPU time of sketch and other \
+              child processes.'
+    )
+    parser.add_argument(
+        '--num-counterexamples',
+        type=int,
+        default=1,
+        help='Maximum number of counterexamples to add per iteration. \
+              Counterexamples that fail different outputs are preferred.'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Print the features of the compilation for the cost model as \
+              JSON, and with --cost-model its predicted time and memory, \
+              instead of running sketch.'
+    )
+    parser.add_argument(
+        '--cost-model',
+        help='Cost model fitted by fit_cost_model to predict time and memory \
+              of the compilation with --dry-run.'
+    )
+    return parser
+
+
+def get_group_size(state_group_info):
+    # Get how many members in each state group
+    # state_group_info is OrderedDict which stores the num of state group and
+    # the how many stateful vars in each state group
+    # state_group_info[item] specifies the
+    # num of stateful vars in each state group
+    # In our example, each state group has the same size, so we only pick up
+    # one of them to get the group size
+    # For example,
+    # if state_group_info = OrderedDict([('0', OrderedSet(['0', '1']))])
+    # state_group_info[item] = OrderedSet(['0', '1'])
+    # group_size = 2
+    for item in state_group_info:
+        return len(state_group_info[item])
 
-    args = parser.parse_args(argv[1:])
+
+def make_constant_set(args):
+    # Use OrderedSet here for deterministic compilation results. We can also
+    # use built-in dict() for Python versions 3.6 and later, as it's inherently
+    # ordered.
+    constant_set = BoundedConstantSet(args.constant_set.split(','),
+                                      args.max_constants)
+    if args.spec_constants:
+        spec_constants = get_spec_constants(
+            Path(args.spec_filename).read_text())
+        num_constants = len(constant_set)
+        # Like constant_set, constants of the spec are never evicted.
+        constant_set.pin(spec_constants)
+        print('Added', len(constant_set) - num_constants,
+              'constants of the spec to the constant set:',
+              ','.join(constant_set))
+    return constant_set
+
+
+def make_compiler(args, constant_set, num_pipeline_stages=None,
+                  num_alus_per_stage=None):
+    """Returns a Compiler for parsed command line arguments. The grid size
+    defaults to the one in args."""
+    if num_pipeline_stages is None:
+        num_pipeline_stages = args.num_pipeline_stages
+    if num_alus_per_stage is None:
+        num_alus_per_stage = args.num_alus_per_stage
+    program_content = Path(args.spec_filename).read_text()
+    # TODO: add the max_input_bit into sketch_name
+    sketch_name = args.spec_filename.split('/')[-1].split('.')[0] + \
+        '_' + args.stateful_alu_filename.split('/')[-1].split('.')[0] + \
+        '_' + args.stateless_alu_filename.split('/')[-1].split('.')[0] + \
+        '_' + str(num_pipeline_stages) + \
+        '_' + str(num_alus_per_stage)
+
+    return Compiler(args.spec_filename, args.stateful_alu_filename,
+                    args.stateless_alu_filename,
+                    num_pipeline_stages, num_alus_per_stage,
+                    sketch_name, args.parallel_sketch,
+                    constant_set,
+                    get_group_size(get_state_group_info(program_content)),
+                    args.synthesized_allocation,
+                    args.pkt_fields, args.state_groups,
+                    args.input_packet, args.target_tofino,
+                    args.native_verify,
+                    args.sketch_cache,
+                    args.sketch_timeout,
+                    args.max_sketch_jobs,
+                    args.portfolio_size,
+                    JobQueue(args.job_queue) if args.job_queue else None,
+                    args.generalize_counterexamples,
+                    args.bit_vector_verify,
+                    args.bit_vector_width)
+
+
+def solve(compiler, args, constant_set, initial_counterexamples=[]):
+    """Runs CEGIS with a compiler made by make_compiler, starting with test
+    cases for initial_counterexamples, e.g., ones found for the same spec on
+    other grids.
+
+    Returns a tuple of 0 if compilation succeeded or 1 otherwise, and the
+    list of counterexamples used, as (pkt_fields, state_vars) tuples."""
     # Use program_content to store the program file text rather than using it
     # twice
     program_content = Path(args.spec_filename).read_text()
     num_fields_in_prog = get_num_pkt_fields(program_content)
 
     # Get the state vars information
-    # TODO: add the max_input_bit into sketch_name
     state_group_info = get_state_group_info(program_content)
+    group_size = get_group_size(state_group_info)
 
     # record the number of state groups in the program
     # which is equal to the num of stateful ALU per stage
@@ -237,40 +471,54 @@ def main(argv):
     else:
         state_group_num = len(args.state_groups)
 
-    sketch_name = args.spec_filename.split('/')[-1].split('.')[0] + \
-        '_' + args.stateful_alu_filename.split('/')[-1].split('.')[0] + \
-        '_' + args.stateless_alu_filename.split('/')[-1].split('.')[0] + \
-        '_' + str(args.num_pipeline_stages) + \
-        '_' + str(args.num_alus_per_stage)
-
-    # Get how many members in each state group
-    # state_group_info is OrderedDict which stores the num of state group and
-    # the how many stateful vars in each state group
-    # state_group_info[item] specifies the
-    # num of stateful vars in each state group
-    # In our example, each state group has the same size, so we only pick up
-    # one of them to get the group size
-    # For example,
-    # if state_group_info = OrderedDict([('0', OrderedSet(['0', '1']))])
-    # state_group_info[item] = OrderedSet(['0', '1'])
-    # group_size = 2
-    for item in state_group_info:
-        group_size = len(state_group_info[item])
-        break
+    sketch_name = compiler.sketch_name
+    hole_elimination_assert = []
+    used_counterexamples = []
+
+    def render_counterexample(pkt_fields, state_vars, cex_name):
+        return generate_counterexample_asserts(
+            pkt_fields, state_vars, num_fields_in_prog,
+            state_group_info, cex_name, args.pkt_fields,
+            args.state_groups, group_size)
+
+    counterexample_store = CounterexampleStore(
+        render_counterexample, args.counterexample_file, args.max_testcases)
+
+    def add_counterexample(pkt_fields, state_vars, cex_name):
+        # compiler.constant_set will be in the form "0,1,2,3"
+
+        # Get the value of counterexample and add them into
+        # constant_set
+        for _, value in pkt_fields.items():
+            value_str = str(value)
+            constant_set.add(value_str)
+        for _, value in state_vars.items():
+            value_str = str(value)
+            constant_set.add(value_str)
+
+        pkt_fields, state_vars = set_default_values(
+            pkt_fields, state_vars, num_fields_in_prog,
+            state_group_info
+        )
+        # Test cases are added once per value.
+        if not counterexample_store.add(pkt_fields, state_vars, cex_name):
+            print('Skipping duplicate counterexample', pkt_fields,
+                  state_vars)
+            return
+        used_counterexamples.append((pkt_fields, state_vars))
+
+    if args.counterexample_file:
+        initial_counterexamples = load_counterexamples(
+            args.counterexample_file) + list(initial_counterexamples)
+    for cex_idx, (pkt_fields, state_vars) in enumerate(
+            initial_counterexamples):
+        add_counterexample(dict(pkt_fields), dict(state_vars),
+                           'initial_' + str(cex_idx))
+    if initial_counterexamples:
+        print('Starting with', len(initial_counterexamples),
+              'counterexamples, constant array', constant_set)
+        compiler.update_constants_for_synthesis(constant_set)
 
-    # Use OrderedSet here for deterministic compilation results. We can also
-    # use built-in dict() for Python versions 3.6 and later, as it's inherently
-    # ordered.
-    constant_set = OrderedSet(args.constant_set.split(','))
-
-    compiler = Compiler(args.spec_filename, args.stateful_alu_filename,
-                        args.stateless_alu_filename,
-                        args.num_pipeline_stages, args.num_alus_per_stage,
-                        sketch_name, args.parallel_sketch,
-                        constant_set, group_size,
-                        args.synthesized_allocation,
-                        args.pkt_fields, args.state_groups,
-                        args.input_packet, args.target_tofino)
     # Repeatedly run synthesis at 2 bits and verification using all valid ints
     # until either verification succeeds or synthesis fails at 2 bits. Note
     # that the verification with all ints, might not work because sketch only
@@ -278,42 +526,80 @@ def main(argv):
     # Synthesis is much faster at a smaller bit width, while verification needs
     # to run at a larger bit width for soundness.
     count = 1
-    hole_elimination_assert = []
-    additional_testcases = ''
     sol_verify_bit = args.max_input_bit
+    start_time = time.perf_counter()
     while 1:
         print('Iteration #' + str(count))
-        (synthesis_ret_code, output, hole_assignments) = \
-            compiler.parallel_codegen(
-                additional_constraints=hole_elimination_assert,
-                additional_testcases=additional_testcases) \
-            if args.parallel else \
-            compiler.serial_codegen(
-            iter_cnt=count,
-            additional_constraints=hole_elimination_assert,
-            additional_testcases=additional_testcases)
+
+        def verify(hole_assignments):
+            # Verification of parallel_codegen_and_verify runs on a thread.
+            with profiling.phase('verification'):
+                return compiler.verify_all(
+                    hole_assignments, sol_verify_bit,
+                    args.num_counterexamples, iter_cnt=count
+                )
+
+        additional_testcases = counterexample_store.get_testcases()
+        with tracing.span('synthesis phase', iteration=count,
+                          num_constants=len(constant_set)), \
+                profiling.phase('synthesis'):
+            if args.parallel:
+                # Candidates are verified while the other sketch runs go on.
+                ((synthesis_ret_code, output, hole_assignments),
+                 counterexamples) = compiler.parallel_codegen_and_verify(
+                    verify,
+                    additional_constraints=hole_elimination_assert,
+                    additional_testcases=additional_testcases)
+            else:
+                (synthesis_ret_code, output, hole_assignments) = \
+                    compiler.serial_codegen(
+                        iter_cnt=count,
+                        additional_constraints=hole_elimination_assert,
+                        additional_testcases=additional_testcases)
 
         if synthesis_ret_code != 0:
+            # Test cases are kept, but constants that a solution needs may
+            # have been evicted, so the grid is only infeasible if synthesis
+            # fails without evictions since the last failure.
+            restored = constant_set.restore_evicted()
+            if restored:
+                print('Synthesis failed, retrying with evicted constants',
+                      ','.join(restored))
+                compiler.update_constants_for_synthesis(constant_set)
+                count += 1
+                continue
             compilation_failure(sketch_name, output)
-            return 1
+            print_evictions(args, constant_set, count,
+                            time.perf_counter() - start_time)
+            return (1, used_counterexamples)
 
         print('Synthesis succeeded with 2 bits, proceeding to verification.')
-        pkt_fields, state_vars = compiler.verify(
-            hole_assignments, sol_verify_bit, iter_cnt=count
-        )
-
-        if len(pkt_fields) == 0 and len(state_vars) == 0:
+        # Constants of the latest candidate aren't evicted for new ones.
+        constant_set.set_used(get_used_constants(hole_assignments,
+                                                 constant_set))
+        if not args.parallel:
+            with tracing.span('verification phase', iteration=count):
+                counterexamples = verify(hole_assignments)
+        print('z3 took {:.3f} seconds to check the candidate, '
+              '{:.3f} seconds in total.'.format(
+                  compiler.counterexample_generator.check_times[-1],
+                  compiler.counterexample_generator.total_check_time))
+
+        if len(counterexamples) == 0:
             compilation_success(sketch_name, hole_assignments, output)
             if args.target_tofino:
                 compiler.compile_to_tofino(hole_assignments)
             print_set(constant_set)
-            print('Using', args.num_alus_per_stage, 'stateless ALUs per stage')
+            print_evictions(args, constant_set, count,
+                            time.perf_counter() - start_time)
+            print('Using', compiler.num_alus_per_stage,
+                  'stateless ALUs per stage')
             print('Using', state_group_num, 'stateful ALUs per stage')
-            print('Synthesis succeeded with ' + str(args.num_pipeline_stages) +
-                  ' stages and ' +
-                  str(state_group_num + args.num_alus_per_stage) +
+            print('Synthesis succeeded with ' +
+                  str(compiler.num_pipeline_stages) + ' stages and ' +
+                  str(state_group_num + compiler.num_alus_per_stage) +
                   ' ALUs per stage')
-            return 0
+            return (0, used_counterexamples)
 
         print('Verification failed.')
 
@@ -324,17 +610,14 @@ def main(argv):
             hole_elimination_assert += generate_hole_elimination_assert(
                 hole_assignments)
         else:
-            print('Use returned counterexamples', pkt_fields, state_vars)
-
-            # compiler.constant_set will be in the form "0,1,2,3"
-
-            # Get the value of counterexample and add them into constant_set
-            for _, value in pkt_fields.items():
-                value_str = str(value)
-                constant_set.add(value_str)
-            for _, value in state_vars.items():
-                value_str = str(value)
-                constant_set.add(value_str)
+            for cex_idx, (pkt_fields, state_vars) in enumerate(
+                    counterexamples):
+                print('Use returned counterexamples', pkt_fields, state_vars)
+                # Counterexamples after the first one in an iteration get a
+                # suffix, so their variable names in the sketch are unique.
+                cex_name = str(count) if cex_idx == 0 else \
+                    str(count) + '_' + str(cex_idx)
+                add_counterexample(pkt_fields, state_vars, cex_name)
 
             # Print the updated constant_array just for debugging
             print('updated constant array', constant_set)
@@ -342,15 +625,41 @@ def main(argv):
             # Add constant set to compiler for next synthesis.
             compiler.update_constants_for_synthesis(constant_set)
 
-            pkt_fields, state_vars = set_default_values(
-                pkt_fields, state_vars, num_fields_in_prog, state_group_info
-            )
+        count += 1
 
-            additional_testcases += generate_counterexample_asserts(
-                pkt_fields, state_vars, num_fields_in_prog, state_group_info,
-                count, args.pkt_fields, args.state_groups, group_size)
 
-        count += 1
+def dry_run(args, constant_set):
+    compiler = make_compiler(args, constant_set)
+    num_testcases = len(load_counterexamples(args.counterexample_file)) if \
+        args.counterexample_file else 0
+    if args.max_testcases is not None:
+        num_testcases = min(num_testcases, args.max_testcases)
+    prediction = cost_model.get_features(compiler, num_testcases)
+    if args.cost_model:
+        (prediction['predicted_seconds'],
+         prediction['predicted_peak_rss_bytes']) = \
+            cost_model.CostModel.load(args.cost_model).predict(prediction)
+    print(json.dumps(prediction))
+
+
+def main(argv):
+    args = get_argument_parser().parse_args(argv[1:])
+    constant_set = make_constant_set(args)
+    if args.dry_run:
+        dry_run(args, constant_set)
+        return 0
+    if args.profile:
+        profiling.start(args.profile_children)
+    try:
+        compiler = make_compiler(args, constant_set)
+        (ret_code, _) = solve(compiler, args, constant_set)
+    finally:
+        if args.trace:
+            tracing.get_tracer().write(args.trace)
+        if args.profile:
+            profiling.stop().write(args.profile, args.profile_top)
+            print('Profile summary is', args.profile + '.txt')
+    return ret_code
 
 
 def run_main():
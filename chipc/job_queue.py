@@ -0,0 +1,259 @@
+"""Queue of sketch runs in an SQLite database, for workers on other hosts.
+
+Compilers submit jobs, i.e., the text of a sketch and the arguments to run
+sketch with, and wait for their results. Worker daemons, started with
+codegen_worker on any host that can open the database, e.g., over a shared
+filesystem, claim jobs, run sketch and store the results. Cancelled jobs are
+never claimed, and workers kill sketch runs of jobs cancelled while running.
+
+Workers keep the jobs they run alive. Jobs of workers that stopped doing so,
+e.g., because their host went down, are claimed again by other workers, and
+only the worker that holds a job can finish it.
+
+Coroutines run the database calls, which may wait for locks of other hosts,
+on a thread of the JobQueue instead of the event loop.
+"""
+import argparse
+import asyncio
+import concurrent.futures as cf
+import json
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from chipc import sketch_utils
+from chipc.sketch_utils import SketchResult
+
+# Seconds between polls of the database by compilers and workers.
+DEFAULT_POLL_INTERVAL = 1
+
+# Seconds after which running jobs whose workers didn't keep them alive are
+# claimed again.
+DEFAULT_STALE_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    sketch_file_name TEXT NOT NULL,
+    sketch_text TEXT NOT NULL,
+    args TEXT NOT NULL,
+    timeout REAL,
+    worker TEXT,
+    alive_at REAL,
+    return_code INTEGER,
+    output TEXT,
+    wall_time REAL,
+    timed_out INTEGER,
+    error TEXT
+)
+"""
+
+
+class JobQueue:
+    def __init__(self, db_path, poll_interval=DEFAULT_POLL_INTERVAL,
+                 stale_seconds=DEFAULT_STALE_SECONDS):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        # Transactions are started explicitly, and wait for other hosts to
+        # release their locks.
+        self.connection = sqlite3.connect(db_path, timeout=60,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute(SCHEMA)
+        # One thread, so that database calls of coroutines run one at a time.
+        self.executor = cf.ThreadPoolExecutor(max_workers=1)
+
+    def run_in_executor(self, fn, *args):
+        """Returns a future of calling fn with args on the database thread.
+        """
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn,
+                                                          *args)
+
+    def submit(self, sketch_file_name, args, timeout=None):
+        """Adds a job to run sketch with args, a list of arguments that
+        includes sketch_file_name, and returns its id."""
+        cursor = self.connection.execute(
+            'INSERT INTO jobs (sketch_file_name, sketch_text, args, timeout) '
+            'VALUES (?, ?, ?, ?)',
+            (sketch_file_name, Path(sketch_file_name).read_text(),
+             json.dumps([str(arg) for arg in args]), timeout))
+        return cursor.lastrowid
+
+    def claim(self, worker):
+        """Returns a tuple of the id, sketch file name, sketch text, args and
+        timeout of the oldest job to run, or None if there isn't one."""
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute(
+                "SELECT id, sketch_file_name, sketch_text, args, timeout "
+                "FROM jobs WHERE state = 'pending' OR "
+                "(state = 'running' AND alive_at < ?) ORDER BY id LIMIT 1",
+                (time.time() - self.stale_seconds,)).fetchone()
+            if row is not None:
+                self.connection.execute(
+                    "UPDATE jobs SET state = 'running', worker = ?, "
+                    "alive_at = ? WHERE id = ?",
+                    (worker, time.time(), row[0]))
+        finally:
+            self.connection.execute('COMMIT')
+        if row is None:
+            return None
+        (job_id, sketch_file_name, sketch_text, args, timeout) = row
+        return (job_id, sketch_file_name, sketch_text, json.loads(args),
+                timeout)
+
+    def keep_alive(self, job_id, worker):
+        """Records that worker still runs a job, and returns whether it
+        should stop, i.e., the job was cancelled or claimed by another worker.
+        """
+        cursor = self.connection.execute(
+            "UPDATE jobs SET alive_at = ? "
+            "WHERE id = ? AND worker = ? AND state = 'running'",
+            (time.time(), job_id, worker))
+        return cursor.rowcount == 0
+
+    def finish(self, job_id, worker, result=None, error=None):
+        """Stores a SketchResult, or the message of an error that stopped
+        the job from producing one, unless worker no longer holds the job."""
+        if result is None:
+            result = SketchResult(None, None, None, None)
+        self.connection.execute(
+            "UPDATE jobs SET state = 'done', return_code = ?, output = ?, "
+            "wall_time = ?, timed_out = ?, error = ? "
+            "WHERE id = ? AND worker = ? AND state = 'running'",
+            (result.return_code, result.output, result.wall_time,
+             result.timed_out, error, job_id, worker))
+
+    def cancel(self, job_id):
+        self.connection.execute(
+            "UPDATE jobs SET state = 'cancelled' "
+            "WHERE id = ? AND state IN ('pending', 'running')", (job_id,))
+
+    def get_state(self, job_id):
+        return self.connection.execute(
+            'SELECT state FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+
+    def get_result(self, job_id):
+        """Returns the SketchResult of a done job, or None if it isn't done.
+        Errors of the job are raised."""
+        (state, return_code, output, wall_time, timed_out, error) = \
+            self.connection.execute(
+                'SELECT state, return_code, output, wall_time, timed_out, '
+                'error FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if state != 'done':
+            return None
+        if error is not None:
+            raise Exception(error)
+        return SketchResult(return_code, output, wall_time, None,
+                            bool(timed_out))
+
+    async def run_async(self, sketch_file_name, args, timeout=None):
+        """Like sketch_utils.run_sketch_async, but runs sketch on a worker.
+        Cancelling the awaiting task cancels the job."""
+        submitted = self.run_in_executor(self.submit, sketch_file_name, args,
+                                         timeout)
+        try:
+            # The job is submitted even if the task is cancelled meanwhile.
+            job_id = await asyncio.shield(submitted)
+            while True:
+                result = await self.run_in_executor(self.get_result, job_id)
+                if result is not None:
+                    return result
+                await asyncio.sleep(self.poll_interval)
+        except asyncio.CancelledError:
+            await self.run_in_executor(self.cancel, await submitted)
+            raise
+
+
+async def run_job(job, tmp_dir):
+    (job_id, sketch_file_name, sketch_text, args, timeout) = job
+    # Sketch may name its outputs after the sketch file, so the file keeps
+    # its name.
+    local_file_name = os.path.join(tmp_dir, str(job_id),
+                                   os.path.basename(sketch_file_name))
+    os.makedirs(os.path.dirname(local_file_name))
+    Path(local_file_name).write_text(sketch_text)
+    return await sketch_utils.run_sketch_async(
+        [local_file_name if arg == sketch_file_name else arg for arg in args],
+        timeout)
+
+
+async def run_worker(job_queue, max_jobs=1, worker=None, stop_when_idle=False):
+    """Runs up to max_jobs jobs of job_queue at a time until cancelled, or
+    until there are no jobs left if stop_when_idle."""
+    if worker is None:
+        worker = socket.gethostname() + ':' + str(os.getpid())
+    # Maps tasks to the ids of the jobs they run.
+    running = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            while True:
+                while len(running) < max_jobs:
+                    job = await job_queue.run_in_executor(job_queue.claim,
+                                                          worker)
+                    if job is None:
+                        break
+                    print('Running job', job[0], job[1])
+                    running[asyncio.ensure_future(
+                        run_job(job, tmp_dir))] = job[0]
+                if not running and stop_when_idle:
+                    return
+
+                if running:
+                    (done, _) = await asyncio.wait(
+                        running, timeout=job_queue.poll_interval)
+                else:
+                    done = set()
+                    await asyncio.sleep(job_queue.poll_interval)
+                for task in done:
+                    job_id = running.pop(task)
+                    try:
+                        (result, error) = (task.result(), None)
+                    except asyncio.CancelledError:
+                        continue
+                    except Exception as e:
+                        (result, error) = (None, str(e))
+                    await job_queue.run_in_executor(
+                        job_queue.finish, job_id, worker, result, error)
+                for (task, job_id) in list(running.items()):
+                    if await job_queue.run_in_executor(
+                            job_queue.keep_alive, job_id, worker) and \
+                            not task.done():
+                        print('Stopping job', job_id)
+                        task.cancel()
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Run sketch jobs of a job queue.')
+    parser.add_argument('db_path', help='SQLite database of the job queue')
+    parser.add_argument('--max-jobs', type=int, default=1,
+                        help='Maximum number of sketch runs at once')
+    parser.add_argument('--poll-interval', type=float,
+                        default=DEFAULT_POLL_INTERVAL,
+                        help='Seconds between polls of the job queue')
+    args = parser.parse_args(argv[1:])
+    job_queue = JobQueue(args.db_path, args.poll_interval)
+    try:
+        asyncio.run(run_worker(job_queue, args.max_jobs))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_main():
+    sys.exit(main(sys.argv))
+
+
+if __name__ == '__main__':
+    run_main()
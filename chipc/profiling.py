@@ -0,0 +1,210 @@
+"""cProfile profiles of compilation per phase, and CPU time of sketch runs.
+
+A Profiler keeps a profile per phase, e.g., synthesis and verification, and
+the code of a phase runs in profiling.phase(name), on whichever thread it
+runs. Code outside of phases goes to the 'other' phase. From Python 3.12 on,
+cProfile profiles all threads with one profile at a time, so the phase
+entered last on any thread gets the time of all threads until it ends, and
+then the phase of the main thread resumes. Sketch runs are
+processes of their own, so the profiles don't see them. Their CPU time can
+be sampled with psutil instead, per phase and process name.
+
+Profiles are written as .pstats files, which pstats, snakeviz and the like
+read, next to a summary of the hottest functions.
+"""
+import cProfile
+import contextlib
+import io
+import pstats
+import sys
+import threading
+from collections import defaultdict
+
+import psutil
+
+OTHER_PHASE = 'other'
+
+# Seconds between samples of the CPU time of child processes.
+SAMPLE_INTERVAL = 0.5
+
+# Python 3.12 and later profile all threads with the one active profile,
+# instead of a profile per thread.
+SINGLE_PROFILE = sys.version_info >= (3, 12)
+
+
+class ChildSampler:
+    """Samples the CPU time of child processes, e.g., sketch and the JVM it
+    starts, on a background thread. CPU time between samples is added to the
+    phase of the main thread at the time of the sample."""
+
+    def __init__(self, get_phase, interval=SAMPLE_INTERVAL):
+        self.get_phase = get_phase
+        self.interval = interval
+        # Maps (phase, process name) to CPU seconds.
+        self.cpu_times = defaultdict(float)
+        # Maps pids to the CPU seconds of their last sample.
+        self.last_cpu_times = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        phase = self.get_phase()
+        for child in psutil.Process().children(recursive=True):
+            try:
+                with child.oneshot():
+                    cpu_times = child.cpu_times()
+                    name = child.name()
+            except psutil.Error:
+                # The child exited meanwhile.
+                continue
+            cpu_time = cpu_times.user + cpu_times.system
+            self.cpu_times[(phase, name)] += \
+                cpu_time - self.last_cpu_times.get(child.pid, 0)
+            self.last_cpu_times[child.pid] = cpu_time
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class Profiler:
+    def __init__(self, sample_children=False):
+        # Maps phases to profiles.
+        self.profiles = defaultdict(cProfile.Profile)
+        self.local = threading.local()
+        self.main_thread = threading.main_thread()
+        self.lock = threading.Lock()
+        self.child_sampler = ChildSampler(self.get_main_phase) if \
+            sample_children else None
+        self.main_phase = OTHER_PHASE
+        # The phase whose profile is enabled, with SINGLE_PROFILE.
+        self.active_phase = None
+
+    def get_main_phase(self):
+        return self.main_phase
+
+    def switch(self, from_phase, to_phase):
+        """Stops profiling from_phase and starts profiling to_phase on the
+        current thread, where None is no phase."""
+        with self.lock:
+            is_main_thread = threading.current_thread() is self.main_thread
+            if is_main_thread:
+                self.main_phase = to_phase or OTHER_PHASE
+            if SINGLE_PROFILE:
+                # Whichever phase is active goes, and the main thread's
+                # resumes when the phase of another thread ends.
+                if to_phase is None and not is_main_thread:
+                    to_phase = self.main_phase
+                (from_phase, self.active_phase) = (self.active_phase,
+                                                   to_phase)
+            if from_phase is not None:
+                self.profiles[from_phase].disable()
+            if to_phase is not None:
+                self.profiles[to_phase].enable()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Profiles the body of a with statement as the phase name on the
+        current thread, instead of the phase it runs in."""
+        current = getattr(self.local, 'phase', None)
+        if current == name:
+            yield
+            return
+        self.switch(current, name)
+        self.local.phase = name
+        try:
+            yield
+        finally:
+            self.local.phase = current
+            self.switch(name, current)
+
+    def start(self):
+        if self.child_sampler is not None:
+            self.child_sampler.start()
+        self.switch(None, OTHER_PHASE)
+        self.local.phase = OTHER_PHASE
+
+    def stop(self):
+        self.switch(self.local.phase, None)
+        self.local.phase = None
+        if self.child_sampler is not None:
+            self.child_sampler.stop()
+
+    def get_stats(self):
+        """Returns a dict from phases to pstats.Stats."""
+        return {phase: pstats.Stats(profile)
+                for (phase, profile) in self.profiles.items()
+                if profile.getstats()}
+
+    def write(self, prefix, num_functions=20):
+        """Writes the profile of each phase to prefix_<phase>.pstats, all
+        phases merged to prefix.pstats, and a summary of the num_functions
+        hottest functions and of the CPU time of child processes to
+        prefix.txt."""
+        stats = self.get_stats()
+        for (phase, phase_stats) in stats.items():
+            phase_stats.dump_stats(prefix + '_' + phase + '.pstats')
+        write_merged_stats(prefix, [prefix + '_' + phase + '.pstats'
+                                    for phase in stats], num_functions,
+                           self.child_sampler)
+
+
+def write_merged_stats(prefix, pstats_file_names, num_functions,
+                       child_sampler=None):
+    """Merges the profiles in pstats_file_names, e.g., of phases or of
+    processes, to prefix.pstats and writes a summary to prefix.txt."""
+    summary = io.StringIO()
+    merged = None
+    for pstats_file_name in pstats_file_names:
+        phase_stats = pstats.Stats(pstats_file_name, stream=summary)
+        print('Hottest functions in', pstats_file_name, file=summary)
+        phase_stats.sort_stats('cumulative').print_stats(num_functions)
+        if merged is None:
+            merged = pstats.Stats(pstats_file_name, stream=summary)
+        else:
+            merged.add(pstats_file_name)
+    if merged is not None:
+        merged.dump_stats(prefix + '.pstats')
+        print('Hottest functions in all profiles', file=summary)
+        merged.sort_stats('tottime').print_stats(num_functions)
+    if child_sampler is not None:
+        print('CPU seconds of child processes by phase and name',
+              file=summary)
+        for ((phase, name), cpu_time) in sorted(
+                child_sampler.cpu_times.items()):
+            print('{} {} {:.2f}'.format(phase, name, cpu_time), file=summary)
+    with open(prefix + '.txt', 'w') as summary_file:
+        summary_file.write(summary.getvalue())
+
+
+_profiler = None
+
+
+def start(sample_children=False):
+    global _profiler
+    _profiler = Profiler(sample_children)
+    _profiler.start()
+    return _profiler
+
+
+def stop():
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    profiler.stop()
+    return profiler
+
+
+def phase(name):
+    """Runs the body of a with statement as the phase name of the active
+    profiler, if there is one."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.phase(name)
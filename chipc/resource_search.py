@@ -0,0 +1,196 @@
+"""Searches for the fewest pipeline stages and ALUs per stage that a spec
+compiles to.
+
+Compilation is monotone in both dimensions: a pipeline with more stages or
+more ALUs per stage can do whatever a smaller one can. So a success on a grid
+implies successes on all larger grids, and a failure implies failures on all
+smaller ones. The search runs the cheapest grids it can't infer a result for
+in parallel, and passes the counterexamples every run found to the runs that
+start later, as they are counterexamples to the same spec on any grid.
+"""
+import contextlib
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+
+import psutil
+from ordered_set import OrderedSet
+
+from chipc import iterative_solver
+from chipc import profiling
+from chipc import tracing
+
+
+def get_cost(grid):
+    (num_pipeline_stages, num_alus_per_stage) = grid
+    return num_pipeline_stages * num_alus_per_stage
+
+
+def is_smaller_or_equal(grid, other_grid):
+    return grid[0] <= other_grid[0] and grid[1] <= other_grid[1]
+
+
+class GridSearch:
+    def __init__(self, max_pipeline_stages, max_alus_per_stage):
+        self.grids = [(num_pipeline_stages, num_alus_per_stage)
+                      for num_pipeline_stages in range(
+                          1, max_pipeline_stages + 1)
+                      for num_alus_per_stage in range(
+                          1, max_alus_per_stage + 1)]
+        # Maps grids that were run to whether compilation succeeded.
+        self.results = {}
+
+    def record(self, grid, succeeded):
+        self.results[grid] = succeeded
+
+    def infer(self, grid):
+        """Returns whether compilation succeeds on grid as far as the results
+        so far tell, or None if they don't."""
+        for (other_grid, succeeded) in self.results.items():
+            if succeeded and is_smaller_or_equal(other_grid, grid):
+                return True
+            if not succeeded and is_smaller_or_equal(grid, other_grid):
+                return False
+        return None
+
+    def get_unknown_grids(self):
+        """Returns the grids to run next, cheapest first."""
+        return sorted([grid for grid in self.grids
+                       if self.infer(grid) is None],
+                      key=lambda grid: (get_cost(grid), grid))
+
+    def get_frontier(self):
+        """Returns the successful grids that no other successful grid is
+        smaller than or equal to, i.e., the Pareto frontier."""
+        succeeded = [grid for (grid, result) in self.results.items()
+                     if result]
+        return sorted(grid for grid in succeeded
+                      if not any(other_grid != grid and
+                                 is_smaller_or_equal(other_grid, grid)
+                                 for other_grid in succeeded))
+
+
+def solve_grid(args, num_pipeline_stages, num_alus_per_stage,
+               counterexamples):
+    """Runs the iterative solver on one grid, writing its output to a log file
+    named after the sketch. Returns a tuple of the grid, whether compilation
+    succeeded, the counterexamples used and the profile of the run, if any.
+    """
+    constant_set = iterative_solver.make_constant_set(args)
+    grid = (num_pipeline_stages, num_alus_per_stage)
+    try:
+        compiler = iterative_solver.make_compiler(
+            args, constant_set, num_pipeline_stages, num_alus_per_stage)
+    except AssertionError as error:
+        # The grid has too few ALUs to hold the packet fields.
+        print('Skipping', grid, error)
+        return (grid, False, [], None)
+
+    # Pool processes run one grid after another.
+    tracing.get_tracer().clear()
+    if args.profile:
+        profiling.start(args.profile_children)
+    with open(compiler.sketch_name + '_search.log', 'w') as log_file, \
+            contextlib.redirect_stdout(log_file):
+        (ret_code, used_counterexamples) = iterative_solver.solve(
+            compiler, args, constant_set, counterexamples)
+    if args.trace:
+        tracing.get_tracer().write(args.trace + '_' + compiler.sketch_name)
+    profile_prefix = None
+    if args.profile:
+        profile_prefix = args.profile + '_' + compiler.sketch_name
+        profiling.stop().write(profile_prefix, args.profile_top)
+    # Counterexamples are sent between processes as tuples of items.
+    return (grid, ret_code == 0,
+            [(tuple(pkt_fields.items()), tuple(state_vars.items()))
+             for (pkt_fields, state_vars) in used_counterexamples],
+            profile_prefix)
+
+
+def search(args, executor):
+    """Returns a tuple of the Pareto frontier and the prefixes of profiles
+    of the runs."""
+    grid_search = GridSearch(args.num_pipeline_stages,
+                             args.num_alus_per_stage)
+    # Use OrderedSet to drop counterexamples that several runs found.
+    counterexamples = OrderedSet()
+    running = {}
+    profile_prefixes = []
+
+    while True:
+        # Start the cheapest unknown grids that aren't running yet. Runs of
+        # grids whose result became known in the meantime are left to finish,
+        # as processes in a pool can't be cancelled.
+        for grid in grid_search.get_unknown_grids():
+            if len(running) >= args.search_jobs:
+                break
+            if grid in running.values():
+                continue
+            print('Trying', grid[0], 'stages and', grid[1],
+                  'ALUs per stage with', len(counterexamples),
+                  'counterexamples')
+            future = executor.submit(solve_grid, args, grid[0], grid[1],
+                                     list(counterexamples))
+            running[future] = grid
+        if not running:
+            break
+
+        (done, _) = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            del running[future]
+            (grid, succeeded, used_counterexamples, profile_prefix) = \
+                future.result()
+            print(grid[0], 'stages and', grid[1], 'ALUs per stage',
+                  'succeeded' if succeeded else 'failed')
+            grid_search.record(grid, succeeded)
+            counterexamples.update(used_counterexamples)
+            if profile_prefix is not None:
+                profile_prefixes.append(profile_prefix)
+
+    return (grid_search.get_frontier(), profile_prefixes)
+
+
+def main(argv):
+    parser = iterative_solver.get_argument_parser(
+        description='Search for the fewest pipeline stages and ALUs per '
+                    'stage a spec compiles to.',
+        grid_help=('Maximum number of pipeline stages',
+                   'Maximum number of stateless ALUs per stage'))
+    parser.add_argument(
+        '--search-jobs',
+        type=int,
+        default=psutil.cpu_count() or 1,
+        help='Maximum number of grids to run at once. Defaults to the number '
+             'of cores.')
+    args = parser.parse_args(argv[1:])
+
+    with ProcessPoolExecutor(max_workers=args.search_jobs) as executor:
+        (frontier, profile_prefixes) = search(args, executor)
+    if profile_prefixes:
+        # Merge the profiles of all pool processes.
+        profiling.write_merged_stats(
+            args.profile, [profile_prefix + '.pstats' for profile_prefix in
+                           profile_prefixes if
+                           os.path.exists(profile_prefix + '.pstats')],
+            args.profile_top)
+        print('Profile summary is', args.profile + '.txt')
+
+    if not frontier:
+        print('Compilation failed on all grids up to',
+              args.num_pipeline_stages, 'stages and', args.num_alus_per_stage,
+              'ALUs per stage')
+        return 1
+    print('Pareto frontier of (stages, ALUs per stage):')
+    for (num_pipeline_stages, num_alus_per_stage) in frontier:
+        print(num_pipeline_stages, num_alus_per_stage)
+    return 0
+
+
+def run_main():
+    sys.exit(main(sys.argv))
+
+
+if __name__ == '__main__':
+    run_main()
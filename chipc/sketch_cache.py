@@ -0,0 +1,127 @@
+"""Content-addressed on-disk cache of Sketch invocations.
+
+Entries are keyed by a hash of the sketch text, the Sketch flags and the
+Sketch version, and hold what the invocation produced, e.g., the return code
+and the output of synthesis, or the DAG of a sketch. The cache is shared by
+all compilations that enable it, see --sketch-cache of iterative_solver,
+and bounded in size by evicting least recently used entries.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'chipmunk', 'sketch')
+
+# 1 GiB
+DEFAULT_MAX_BYTES = 1 << 30
+
+# Environment variables to override the defaults above. Setting
+# CHIPMUNK_SKETCH_CACHE to 0 bypasses the cache.
+CACHE_ENV = 'CHIPMUNK_SKETCH_CACHE'
+CACHE_DIR_ENV = 'CHIPMUNK_SKETCH_CACHE_DIR'
+MAX_BYTES_ENV = 'CHIPMUNK_SKETCH_CACHE_MAX_BYTES'
+
+
+class SketchCache:
+    def __init__(self, cache_dir=None, max_bytes=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Bytes of all entries as of the last scan of cache_dir, plus those
+        # written since. None until the first put scans cache_dir.
+        self.total_bytes = None
+
+    @staticmethod
+    def get_key(sketch_text, flags, sketch_version):
+        """Returns the key of a Sketch invocation on sketch_text with a list
+        of flags, which includes everything that affects its result."""
+        digest = hashlib.sha256()
+        for part in [sketch_version] + [str(flag) for flag in flags]:
+            digest.update(part.encode())
+            # Separate parts so that, e.g., flags ['a', 'b'] and ['ab'] don't
+            # collide.
+            digest.update(b'\0')
+        digest.update(sketch_text.encode())
+        return digest.hexdigest()
+
+    def get_entry_path(self, key):
+        return self.cache_dir / key[:2] / (key + '.json')
+
+    def get(self, key):
+        """Returns the dict stored for the key, or None if there isn't one."""
+        entry_path = self.get_entry_path(key)
+        try:
+            entry = json.loads(entry_path.read_text())
+            # Modification times order entries for eviction.
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """Stores a JSON serializable dict for the key, and evicts least
+        recently used entries if the cache grows over max_bytes."""
+        entry_path = self.get_entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that concurrent compilations
+        # never read a partially written entry.
+        (fd, tmp_path) = tempfile.mkstemp(dir=entry_path.parent,
+                                          suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(entry, tmp_file)
+        size = os.path.getsize(tmp_path)
+        try:
+            # Overwritten entries don't add to the total.
+            size -= entry_path.stat().st_size
+        except OSError:
+            pass
+        os.replace(tmp_path, entry_path)
+        # Only scan cache_dir when it may have grown over max_bytes. Entries
+        # written by other processes are counted by the next scan.
+        if self.total_bytes is not None:
+            self.total_bytes += size
+        if self.total_bytes is None or self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Scans cache_dir and deletes least recently used entries until
+        it is at most max_bytes."""
+        entries = []
+        total_bytes = 0
+        for entry_path in self.cache_dir.glob('*/*.json'):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                # Evicted by another process.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+            total_bytes += stat.st_size
+
+        for (_, size, entry_path) in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                entry_path.unlink()
+            except OSError:
+                pass
+            total_bytes -= size
+        self.total_bytes = total_bytes
+
+
+def get_default_cache():
+    """Returns a SketchCache configured from the environment, or None if the
+    cache is bypassed."""
+    if os.environ.get(CACHE_ENV, '1') == '0':
+        return None
+    return SketchCache()
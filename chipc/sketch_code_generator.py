@@ -1,17 +1,33 @@
+import re
+import threading
 from collections import OrderedDict
 from pathlib import Path
 
-from antlr4 import CommonTokenStream
-from antlr4 import FileStream
-
-from chipc.aluLexer import aluLexer
-from chipc.aluParser import aluParser
+from chipc.alu_parse_cache import get_alu_parse_tree
+from chipc.alu_template import ALU_NAME_PLACEHOLDER
 from chipc.mode import Mode
 from chipc.sketch_stateful_alu_visitor import SketchStatefulAluVisitor
 from chipc.sketch_stateless_alu_visitor import SketchStatelessAluVisitor
 from chipc.utils import get_hole_bit_width
 
 
+# Markers for the parts of a rendered sketch that change between CEGIS
+# iterations. See SketchCodeGenerator.generate_sketch.
+CONSTANT_ARRAY_MARKER = '@@chipmunk_constant_array@@'
+HOLE_ASSIGNMENTS_MARKER = '@@chipmunk_hole_assignments@@'
+ADDITIONAL_CONSTRAINTS_MARKER = '@@chipmunk_additional_constraints@@'
+ADDITIONAL_TESTCASES_MARKER = '@@chipmunk_additional_testcases@@'
+
+# Attributes set while generating a sketch, which are restored when a cached
+# sketch is reused.
+HOLE_STATE_ATTRIBUTES = [
+    'total_hole_bits_', 'hole_names_', 'hole_definitions_', 'hole_arguments_',
+    'holes_', 'constraints_', 'stateless_alu_hole_arguments_',
+    'num_stateless_muxes_', 'stateful_alu_hole_arguments_',
+    'num_operands_to_stateful_alu_', 'num_state_slots_'
+]
+
+
 class Hole:
     def __init__(self, hole_name, max_value):
         self.name = hole_name
@@ -33,10 +49,9 @@ class SketchCodeGenerator:
         self.sketch_name_ = sketch_name
         self.total_hole_bits_ = 0
         self.hole_names_ = []
-        self.hole_preamble_ = ''
+        self.hole_definitions_ = []
         self.hole_arguments_ = []
         self.holes_ = []
-        self.asserts_ = ''
         self.constraints_ = []
         self.num_phv_containers_ = num_phv_containers
         self.num_pipeline_stages_ = num_pipeline_stages
@@ -65,25 +80,42 @@ class SketchCodeGenerator:
         self.synthesized_allocation_ = synthesized_allocation
         self.input_packet_fields_ = input_packet_fields
         self.target_tofino_ = target_tofino
+        self.stateless_alu_templates_ = {}
+        self.stateful_alu_templates_ = {}
+        self.sketch_cache_ = {}
+        # Generating a sketch resets and rebuilds the hole state, which
+        # Compiler verifies on another thread while codegen goes on. Holders
+        # of the lock see the hole state of one whole generation.
+        self.lock_ = threading.RLock()
 
     def reset_holes_and_asserts(self):
         self.total_hole_bits_ = 0
         self.hole_names_ = []
-        self.hole_preamble_ = ''
+        self.hole_definitions_ = []
         self.hole_arguments_ = []
         self.holes_ = []
-        self.asserts_ = ''
         self.constraints_ = []
 
-    # Write all holes to a single hole string for ease of debugging
+    # All holes written to a single hole string for ease of debugging. Hole
+    # definitions are kept in a list and only joined here, as growing a string
+    # one hole at a time is quadratic in the number of holes.
+    @property
+    def hole_preamble_(self):
+        return ''.join(self.hole_definitions_)
+
+    @property
+    def asserts_(self):
+        return ''.join(['assert(' + assert_predicate + ');\n'
+                        for assert_predicate in self.constraints_])
+
     def add_hole(self, hole_name, hole_bit_width):
         assert (hole_bit_width >= 0)
-        self.hole_names_ += [hole_name]
-        self.hole_preamble_ += 'int ' + hole_name + '= ??(' + str(
-            hole_bit_width) + ');\n'
+        self.hole_names_.append(hole_name)
+        self.hole_definitions_.append(
+            'int ' + hole_name + '= ??(' + str(hole_bit_width) + ');\n')
         self.total_hole_bits_ += hole_bit_width
-        self.hole_arguments_ += ['int ' + hole_name]
-        self.holes_ += [Hole(hole_name, 2**hole_bit_width - 1)]
+        self.hole_arguments_.append('int ' + hole_name)
+        self.holes_.append(Hole(hole_name, 2**hole_bit_width - 1))
 
     # Write several holes from a dictionary (new_holes) into self.holes_
     def add_holes(self, new_holes):
@@ -91,59 +123,61 @@ class SketchCodeGenerator:
             self.add_hole(hole, new_holes[hole])
 
     def add_assert(self, assert_predicate):
-        self.asserts_ += 'assert(' + assert_predicate + ');\n'
-        self.constraints_ += [assert_predicate]
+        self.constraints_.append(assert_predicate)
+
+    # ALU templates only depend on the ALU file, the operands and the width
+    # of constant holes, so they are cached across ALU slots and iterations.
+    def get_stateless_alu_template(self, potential_operands):
+        key = (self.constant_arr_size_, tuple(potential_operands))
+        if key not in self.stateless_alu_templates_:
+            tree = get_alu_parse_tree(self.stateless_alu_filename_)
+            sketch_stateless_alu_visitor = \
+                SketchStatelessAluVisitor(
+                    self.stateless_alu_filename_, ALU_NAME_PLACEHOLDER,
+                    potential_operands, self.generate_mux_code,
+                    self.constant_arr_size_)
+            sketch_stateless_alu_visitor.visit(tree)
+            self.stateless_alu_templates_[key] = \
+                sketch_stateless_alu_visitor.get_alu_template()
+        return self.stateless_alu_templates_[key]
+
+    def get_stateful_alu_template(self):
+        key = self.constant_arr_size_
+        if key not in self.stateful_alu_templates_:
+            tree = get_alu_parse_tree(self.stateful_alu_filename_)
+            sketch_stateful_alu_visitor = SketchStatefulAluVisitor(
+                ALU_NAME_PLACEHOLDER, self.constant_arr_size_)
+            sketch_stateful_alu_visitor.visit(tree)
+            self.stateful_alu_templates_[key] = \
+                sketch_stateful_alu_visitor.get_alu_template()
+        return self.stateful_alu_templates_[key]
 
     # Generate Sketch code for a simple stateless alu (+,-,*,/)
     def generate_stateless_alu(self, alu_name, potential_operands):
-        # Grab the stateless alu file name by using
-        input_stream = FileStream(self.stateless_alu_filename_)
-        lexer = aluLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        parser = aluParser(stream)
-        tree = parser.alu()
-
-        sketch_stateless_alu_visitor = \
-            SketchStatelessAluVisitor(
-                self.stateless_alu_filename_, self.sketch_name_ + '_' +
-                alu_name, potential_operands, self.generate_mux,
-                self.constant_arr_size_)
-        sketch_stateless_alu_visitor.visit(tree)
-        self.add_holes(sketch_stateless_alu_visitor.global_holes)
-        self.stateless_alu_hole_arguments_ = [
-            x for x in sorted(
-                sketch_stateless_alu_visitor.stateless_alu_args
-            )]
-
-        self.num_stateless_muxes_ = \
-            len(sketch_stateless_alu_visitor.packet_fields)
-
-        return (sketch_stateless_alu_visitor.helper_function_strings +
-                sketch_stateless_alu_visitor.main_function)
+        alu_template = self.get_stateless_alu_template(potential_operands)
+        (alu_code, alu_holes) = alu_template.instantiate(
+            self.sketch_name_ + '_' + alu_name)
+        for hole, hole_bit_width in alu_holes.items():
+            self.add_hole(hole, hole_bit_width)
+        self.stateless_alu_hole_arguments_ = alu_template.alu_args
+        self.num_stateless_muxes_ = alu_template.num_packet_fields
+
+        return alu_code
 
     # Generate Sketch code for a simple stateful alu (+,-,*,/)
     # Takes one state and one packet operand (or immediate operand) as inputs
     # Updates the state in place and returns the old value of the state
     def generate_stateful_alu(self, alu_name):
-        input_stream = FileStream(self.stateful_alu_filename_)
-        lexer = aluLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        parser = aluParser(stream)
-        tree = parser.alu()
-        sketch_stateful_alu_visitor = SketchStatefulAluVisitor(
-            self.sketch_name_ + '_' + alu_name,
-            self.constant_arr_size_)
-        sketch_stateful_alu_visitor.visit(tree)
-        self.add_holes(sketch_stateful_alu_visitor.global_holes)
-        self.stateful_alu_hole_arguments_ = [
-            x for x in sorted(sketch_stateful_alu_visitor.alu_args)
-        ]
-        self.num_operands_to_stateful_alu_ = len(
-            sketch_stateful_alu_visitor.packet_fields)
-        self.num_state_slots_ = len(sketch_stateful_alu_visitor.state_vars)
-
-        return (sketch_stateful_alu_visitor.helper_function_strings +
-                sketch_stateful_alu_visitor.main_function)
+        alu_template = self.get_stateful_alu_template()
+        (alu_code, alu_holes) = alu_template.instantiate(
+            self.sketch_name_ + '_' + alu_name)
+        for hole, hole_bit_width in alu_holes.items():
+            self.add_hole(hole, hole_bit_width)
+        self.stateful_alu_hole_arguments_ = alu_template.alu_args
+        self.num_operands_to_stateful_alu_ = alu_template.num_packet_fields
+        self.num_state_slots_ = alu_template.num_state_vars
+
+        return alu_code
 
     # This allocator is only used for synthesized allocation
     # for stateless_vars
@@ -156,20 +190,14 @@ class SketchCodeGenerator:
         # add assert for phv_config
         # assert sum(field) phv_config_{field}_{container} <= 1
         for j in range(self.num_phv_containers_):
-            assert_predicate = '('
-            for k in self.input_packet_fields_:
-                assert_predicate += ' phv_config_' + \
-                    str(k) + '_' + str(j) + '+'
-            assert_predicate += '0) <= 1'
-            self.add_assert(assert_predicate)
+            self.add_assert('(' + ''.join([
+                ' phv_config_' + str(k) + '_' + str(j) + '+'
+                for k in self.input_packet_fields_]) + '0) <= 1')
         # assert sum(container) phv_config_{field}_{container} == 1
         for k in self.input_packet_fields_:
-            assert_predicate = '('
-            for j in range(self.num_phv_containers_):
-                assert_predicate += ' phv_config_' + \
-                    str(k) + '_' + str(j) + '+'
-            assert_predicate += '0) == 1'
-            self.add_assert(assert_predicate)
+            self.add_assert('(' + ''.join([
+                ' phv_config_' + str(k) + '_' + str(j) + '+'
+                for j in range(self.num_phv_containers_)]) + '0) == 1')
 
     # This allocator is only used for synthesized allocation
     # for stateful_vars
@@ -177,99 +205,90 @@ class SketchCodeGenerator:
         # stateful_var_allocation_group_1_0_2 means
         # group 1 has been allocate to stateful_alu No.2
         # in stage 0
+        salu_config = [[[self.sketch_name_ + '_' + 'salu_config_' + str(i) +
+                         '_' + str(j) + '_' + str(k)
+                         for k in range(self.num_phv_containers_)]
+                        for j in range(self.num_pipeline_stages_)]
+                       for i in range(self.num_state_groups_)]
         for i in range(self.num_state_groups_):
             for j in range(self.num_pipeline_stages_):
                 for k in range(self.num_phv_containers_):
                     # Add hole_def for stateful_var_allocation_group_
-                    self.add_hole(
-                        self.sketch_name_ + '_' + 'salu_config_' + str(i) +
-                        '_' + str(j) + '_' + str(k), 1)
+                    self.add_hole(salu_config[i][j][k], 1)
 
         # add assert for stateful_var_allocation_group_
         # any particular group can only be allocated to at most one
         # stateful_alu
         for i in range(self.num_state_groups_):
-            assert_predicate = '('
-            for j in range(self.num_pipeline_stages_):
-                for k in range(self.num_phv_containers_):
-                    assert_predicate += self.sketch_name_ + '_' + \
-                        'salu_config_' + str(i) + '_' + str(j) + '_' + \
-                        str(k) + '+'
-            assert_predicate += '0) <= 1'
-            self.add_assert(assert_predicate)
+            self.add_assert('(' + ''.join([
+                salu_config[i][j][k] + '+'
+                for j in range(self.num_pipeline_stages_)
+                for k in range(self.num_phv_containers_)]) + '0) <= 1')
 
         # any stateful_alu can only be used by at most one stateful_group
         for j in range(self.num_pipeline_stages_):
             for k in range(self.num_phv_containers_):
-                assert_predicate = '('
-                for i in range(self.num_state_groups_):
-                    assert_predicate += self.sketch_name_ + '_' + \
-                        'salu_config_' + str(i) + '_' + str(j) + '_' + \
-                        str(k) + '+'
-                assert_predicate += '0) <= 1'
-                self.add_assert(assert_predicate)
+                self.add_assert('(' + ''.join([
+                    salu_config[i][j][k] + '+'
+                    for i in range(self.num_state_groups_)]) + '0) <= 1')
 
     def generate_state_allocator_canonicalized(self):
+        salu_config = [[self.sketch_name_ + '_' + 'salu_config_' + str(i) +
+                        '_' + str(l)
+                        for l in range(self.num_state_groups_)]
+                       for i in range(self.num_pipeline_stages_)]
         for i in range(self.num_pipeline_stages_):
             for l in range(self.num_state_groups_):
-                self.add_hole(
-                    self.sketch_name_ + '_' + 'salu_config_' + str(i) + '_' +
-                    str(l), 1)
+                self.add_hole(salu_config[i][l], 1)
 
         for i in range(self.num_pipeline_stages_):
-            assert_predicate = '('
-            for l in range(self.num_state_groups_):
-                assert_predicate += self.sketch_name_ + '_' + \
-                    'salu_config_' + str(i) + '_' + str(l) + ' + '
-            assert_predicate += '0) <= ' + str(self.num_alus_per_stage_)
-            self.add_assert(assert_predicate)
+            self.add_assert('(' + ''.join([
+                salu_config[i][l] + ' + '
+                for l in range(self.num_state_groups_)]) + '0) <= ' +
+                str(self.num_alus_per_stage_))
 
         for l in range(self.num_state_groups_):
-            assert_predicate = '('
-            for i in range(self.num_pipeline_stages_):
-                assert_predicate += self.sketch_name_ + '_' + \
-                    'salu_config_' + str(i) + '_' + str(l) + ' + '
-            assert_predicate += '0) <= 1'
-            self.add_assert(assert_predicate)
+            self.add_assert('(' + ''.join([
+                salu_config[i][l] + ' + '
+                for i in range(self.num_pipeline_stages_)]) + '0) <= 1')
 
-    # Sketch code for an n-to-1 mux
-    def generate_mux(self, n, mux_name):
+    # Sketch code for an n-to-1 mux, without adding its control hole
+    def generate_mux_code(self, n, mux_name):
         assert (n >= 1)
-        num_bits = get_hole_bit_width(n)
         operand_mux_template = self.jinja2_env_.get_template('mux.j2')
-        mux_code = operand_mux_template.render(
+        return operand_mux_template.render(
             mux_name=mux_name,
             operand_list=['input' + str(i) for i in range(0, n)],
             arg_list=['int input' + str(i) for i in range(0, n)],
             num_operands=n)
-        self.add_hole(mux_name + '_ctrl', num_bits)
+
+    # Sketch code for an n-to-1 mux
+    def generate_mux(self, n, mux_name):
+        mux_code = self.generate_mux_code(n, mux_name)
+        self.add_hole(mux_name + '_ctrl', get_hole_bit_width(n))
         return mux_code
 
     # Stateful operand muxes, stateless ones are part of generate_stateless_alu
     def generate_stateful_operand_muxes(self):
-        ret = ''
+        muxes = []
         # Generate one mux for inputs: num_phv_containers+1 to 1. The +1 is to
         # support constant/immediate operands.
         assert (self.num_operands_to_stateful_alu_ > 0)
+        # synthesized_allocation we give num_phv_containers stateful alus per
+        # stage, otherwise one per state group.
+        if self.synthesized_allocation_:
+            num_stateful_alus = self.num_phv_containers_
+        else:
+            num_stateful_alus = self.num_state_groups_
         for i in range(self.num_pipeline_stages_):
-            # TODO: merge these two into a function later
-            if self.synthesized_allocation_:
-                for l in range(self.num_phv_containers_):
-                    for k in range(self.num_operands_to_stateful_alu_):
-                        ret += self.generate_mux(
-                            self.num_phv_containers_,
-                            self.sketch_name_ + '_stateful_alu_' + str(i) +
-                            '_' + str(l) + '_' + 'operand_mux_' +
-                            str(k)) + '\n'
-            else:
-                for l in range(self.num_state_groups_):
-                    for k in range(self.num_operands_to_stateful_alu_):
-                        ret += self.generate_mux(
-                            self.num_phv_containers_,
-                            self.sketch_name_ + '_stateful_alu_' + str(i) +
-                            '_' + str(l) + '_' + 'operand_mux_' + str(k)) +\
-                            '\n'
-        return ret
+            for l in range(num_stateful_alus):
+                for k in range(self.num_operands_to_stateful_alu_):
+                    muxes.append(self.generate_mux(
+                        self.num_phv_containers_,
+                        self.sketch_name_ + '_stateful_alu_' + str(i) +
+                        '_' + str(l) + '_' + 'operand_mux_' + str(k)))
+                    muxes.append('\n')
+        return ''.join(muxes)
 
     # Output muxes to pick between stateful ALUs and stateless ALU
     def generate_output_muxes(self):
@@ -282,7 +301,7 @@ class SketchCodeGenerator:
         # It also doesn't affect the correctness of modeling the output mux
         # because the virtual output mux setting can be translated into the
         # physical output mux setting during post processing.
-        ret = ''
+        muxes = []
         if self.target_tofino_:
             for i in range(self.num_pipeline_stages_):
                 for k in range(self.num_phv_containers_):
@@ -308,68 +327,69 @@ class SketchCodeGenerator:
                 for j in range(self.num_phv_containers_):
                     # TODO: maybe we need to specially
                     # consider the case j=self.num_phv_containers_ - 1
-                    assert_predicate = '(('
-                    assert_predicate += '(' + self.sketch_name_ + \
-                                        '_stateless_alu_' + str(i) +\
-                                        '_' + str(j) + '_demux_ctrl' + \
-                                        ' == 1 ) +'
-                    for k in range(self.num_state_groups_):
-                        assert_predicate += '((' + self.sketch_name_ + \
-                                            '_stateful_alu_' + \
-                                            str(i) + \
-                                            '_' + str(k) + '_demux_ctrl' + \
-                                            ' == ' + str(j) + ')  && (' + \
-                                            self.sketch_name_ + '_' + \
-                                            'salu_config_' + \
-                                            str(i) + '_' + \
-                            str(k) + '== 1)) + '
-                    assert_predicate += ' 0) == 1)'
-                    self.add_assert(assert_predicate)
+                    self.add_assert(
+                        '((' + '(' + self.sketch_name_ + '_stateless_alu_' +
+                        str(i) + '_' + str(j) + '_demux_ctrl' + ' == 1 ) +' +
+                        ''.join([
+                            '((' + self.sketch_name_ + '_stateful_alu_' +
+                            str(i) + '_' + str(k) + '_demux_ctrl' + ' == ' +
+                            str(j) + ')  && (' + self.sketch_name_ + '_' +
+                            'salu_config_' + str(i) + '_' + str(k) +
+                            '== 1)) + '
+                            for k in range(self.num_state_groups_)]) +
+                        ' 0) == 1)')
         else:
+            # synthesized_allocation we give num_phv_containers virtual
+            # stateful alus per stage
+            if self.synthesized_allocation_:
+                num_mux_inputs = \
+                    self.num_phv_containers_ * self.num_state_slots_ + 1
+            else:
+                num_mux_inputs = \
+                    self.num_state_groups_ * self.num_state_slots_ + 1
             for i in range(self.num_pipeline_stages_):
                 for k in range(self.num_phv_containers_):
-                    # synthesized_allocation we give num_phv_containers virtual
-                    # stateful alus per stage
-                    if self.synthesized_allocation_:
-                        ret += self.generate_mux(
-                            self.num_phv_containers_ * self.num_state_slots_
-                            + 1,
-                            self.sketch_name_ + '_output_mux_phv_' +
-                            str(i) + '_' + str(k)) + '\n'
-                    else:
-                        ret += self.generate_mux(
-                            self.num_state_groups_ * self.num_state_slots_ + 1,
-                            self.sketch_name_ + '_output_mux_phv_' +
-                            str(i) + '_' + str(k)) + '\n'
-        return ret
+                    muxes.append(self.generate_mux(
+                        num_mux_inputs,
+                        self.sketch_name_ + '_output_mux_phv_' +
+                        str(i) + '_' + str(k)))
+                    muxes.append('\n')
+        return ''.join(muxes)
 
     def generate_alus(self):
         # Generate sketch code for alus and immediate operands in each stage
-        ret = ''
+        alus = []
+        potential_operands = [
+            'input' + str(k) for k in range(0, self.num_phv_containers_)]
+        if self.synthesized_allocation_:
+            num_stateful_alus = self.num_phv_containers_
+        else:
+            num_stateful_alus = self.num_state_groups_
         for i in range(self.num_pipeline_stages_):
             for j in range(self.num_alus_per_stage_):
-                ret += self.generate_stateless_alu(
-                    'stateless_alu_' + str(i) + '_' + str(j), [
-                        'input' + str(k)
-                        for k in range(0, self.num_phv_containers_)
-                    ]) + '\n'
-            if self.synthesized_allocation_:
-                for l in range(self.num_phv_containers_):
-                    ret += self.generate_stateful_alu('stateful_alu_' +
-                                                      str(i) +
-                                                      '_' + str(l)) + '\n'
-            else:
-                for l in range(self.num_state_groups_):
-                    ret += self.generate_stateful_alu('stateful_alu_' + str(i)
-                                                      + '_' + str(l)) + '\n'
-        return ret
-
-    def generate_sketch(self, spec_filename, mode, synthesized_allocation,
-                        additional_constraints=[],
-                        hole_assignments=OrderedDict(),
-                        additional_testcases=''):
+                alus.append(self.generate_stateless_alu(
+                    'stateless_alu_' + str(i) + '_' + str(j),
+                    potential_operands))
+                alus.append('\n')
+            for l in range(num_stateful_alus):
+                alus.append(self.generate_stateful_alu(
+                    'stateful_alu_' + str(i) + '_' + str(l)))
+                alus.append('\n')
+        return ''.join(alus)
+
+    def get_hole_state(self):
+        return {attr: getattr(self, attr) for attr in HOLE_STATE_ATTRIBUTES}
+
+    def set_hole_state(self, hole_state):
+        for attr, value in hole_state.items():
+            setattr(self, attr, value)
+
+    # Render the sketch with markers in place of the segments that change
+    # between CEGIS iterations, and split it at those markers. Every odd
+    # element of the returned list is the name of a marker.
+    def generate_sketch_segments(self, spec_filename, mode,
+                                 synthesized_allocation):
         self.reset_holes_and_asserts()
-        assert(mode in [Mode.CODEGEN, Mode.VERIFY])
         template = self.jinja2_env_.get_template('code_generator.j2')
 
         # Create stateless and stateful ALUs, operand muxes for stateful ALUs,
@@ -387,7 +407,7 @@ class SketchCodeGenerator:
         else:
             self.generate_state_allocator_canonicalized()
 
-        return template.render(
+        sketch = template.render(
             mode=mode,
             synthesized_allocation=synthesized_allocation,
             target_tofino=self.target_tofino_,
@@ -397,7 +417,7 @@ class SketchCodeGenerator:
             num_alus_per_stage=self.num_alus_per_stage_,
             num_phv_containers=self.num_phv_containers_,
             # Add constant_arr_def to hole_definitions
-            hole_definitions=self.constant_arr_def_ + self.hole_preamble_,
+            hole_definitions=CONSTANT_ARRAY_MARKER + self.hole_preamble_,
             stateful_operand_mux_definitions=stateful_operand_mux_definitions,
             num_stateless_muxes=self.num_stateless_muxes_,
             output_mux_definitions=output_mux_definitions,
@@ -412,12 +432,47 @@ class SketchCodeGenerator:
             stateful_alu_hole_arguments=self.stateful_alu_hole_arguments_,
             num_operands_to_stateful_alu=self.num_operands_to_stateful_alu_,
             num_state_slots=self.num_state_slots_,
-            additional_constraints='\n'.join(
-                ['assert(' + str(x) + ');' for x in additional_constraints]),
+            additional_constraints=ADDITIONAL_CONSTRAINTS_MARKER,
             # Add constant_arr_def to hole_assignments
-            hole_assignments=self.constant_arr_def_ + '\n'.join(
-                ['int ' + str(hole) + ' = ' + str(value) + ';'
-                    for hole, value in hole_assignments.items()]),
-            additional_testcases=additional_testcases,
+            hole_assignments=CONSTANT_ARRAY_MARKER + HOLE_ASSIGNMENTS_MARKER,
+            additional_testcases=ADDITIONAL_TESTCASES_MARKER,
             input_packet_fields=self.input_packet_fields_,
             group_size=self.group_size_)
+
+        return re.split('(' + '|'.join([CONSTANT_ARRAY_MARKER,
+                                        HOLE_ASSIGNMENTS_MARKER,
+                                        ADDITIONAL_CONSTRAINTS_MARKER,
+                                        ADDITIONAL_TESTCASES_MARKER]) + ')',
+                        sketch)
+
+    def generate_sketch(self, spec_filename, mode, synthesized_allocation,
+                        additional_constraints=[],
+                        hole_assignments=OrderedDict(),
+                        additional_testcases=''):
+        assert(mode in [Mode.CODEGEN, Mode.VERIFY])
+        # Holes, ALUs, muxes and allocators only change with the width of
+        # constant holes, so the rendered sketch is cached and only the
+        # constant array, hole assignments, additional constraints and test
+        # cases are spliced in on each CEGIS iteration.
+        with self.lock_:
+            key = (spec_filename, mode, synthesized_allocation,
+                   self.constant_arr_size_)
+            if key in self.sketch_cache_:
+                (segments, hole_state) = self.sketch_cache_[key]
+                self.set_hole_state(hole_state)
+            else:
+                segments = self.generate_sketch_segments(
+                    spec_filename, mode, synthesized_allocation)
+                self.sketch_cache_[key] = (segments, self.get_hole_state())
+
+        spliced_segments = {
+            CONSTANT_ARRAY_MARKER: self.constant_arr_def_,
+            HOLE_ASSIGNMENTS_MARKER: '\n'.join(
+                ['int ' + str(hole) + ' = ' + str(value) + ';'
+                    for hole, value in hole_assignments.items()]),
+            ADDITIONAL_CONSTRAINTS_MARKER: '\n'.join(
+                ['assert(' + str(x) + ');' for x in additional_constraints]),
+            ADDITIONAL_TESTCASES_MARKER: additional_testcases
+        }
+        return ''.join([spliced_segments[segment] if i % 2 else segment
+                        for i, segment in enumerate(segments)])
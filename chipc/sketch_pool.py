@@ -0,0 +1,34 @@
+import psutil
+
+# Memory a sketch run is assumed to need, mostly for its JVM.
+DEFAULT_JOB_MEMORY_BYTES = 2 << 30
+
+
+class SketchPool:
+    """Bounds the number of sketch runs in flight by the number of cores and
+    the memory available.
+
+    The pool doesn't run anything itself. Callers ask it how many more runs
+    they may start, so that the same pool can be used by one iteration after
+    another."""
+
+    def __init__(self, max_jobs=None, job_memory_bytes=None):
+        if max_jobs is None:
+            max_jobs = psutil.cpu_count() or 1
+        if job_memory_bytes is None:
+            job_memory_bytes = DEFAULT_JOB_MEMORY_BYTES
+        assert max_jobs >= 1
+        self.max_jobs = max_jobs
+        self.job_memory_bytes = job_memory_bytes
+
+    def get_num_free_slots(self, num_running):
+        """Returns how many runs can start next to num_running ones. At least
+        one run is allowed if none is running, so that callers always make
+        progress."""
+        # Available memory already accounts for runs in flight.
+        num_by_memory = psutil.virtual_memory().available // \
+            self.job_memory_bytes
+        num_free_slots = min(self.max_jobs - num_running, num_by_memory)
+        if num_running == 0:
+            return max(num_free_slots, 1)
+        return max(num_free_slots, 0)
@@ -0,0 +1,94 @@
+"""Configurations of sketch to race against each other on the same sketch.
+
+Sketch's running time varies by orders of magnitude with its random seed and
+solver options, so running a few configurations at once and taking the first
+success often beats any single one. Wins are recorded per spec on disk, so
+that the configurations that won before start first next time. Concurrent
+compilations, e.g., of resource_search, record their wins under a lock.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+DEFAULT_HISTORY_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'chipmunk', 'portfolio.json')
+
+# Tuples of the seed, whether to use --slv-parallel and other options. The
+# first configuration is the one used without a portfolio.
+CONFIGURATIONS = [
+    (1, False, ()),
+    (2, False, ()),
+    (1, True, ()),
+    (3, False, ('--slv-lightverif',)),
+]
+
+
+def get_configuration_name(configuration):
+    (slv_seed, slv_parallel, options) = configuration
+    return '_'.join(['seed' + str(slv_seed)] +
+                    (['parallel'] if slv_parallel else []) +
+                    [option.strip('-').replace('-', '_')
+                     for option in options])
+
+
+class SketchPortfolio:
+    def __init__(self, size, spec_text, slv_parallel=False,
+                 history_file=None):
+        """Races size configurations on sketches of spec_text. Configurations
+        beyond the ones in CONFIGURATIONS use further seeds. slv_parallel
+        turns on --slv-parallel for all of them."""
+        assert size >= 1
+        self.configurations = [
+            CONFIGURATIONS[i] if i < len(CONFIGURATIONS) else (i, False, ())
+            for i in range(size)]
+        if slv_parallel:
+            # Drop configurations that become duplicates.
+            self.configurations = list(dict.fromkeys(
+                (slv_seed, True, options) for (slv_seed, _, options) in
+                self.configurations))
+        self.spec_key = hashlib.sha256(spec_text.encode()).hexdigest()
+        self.history_file = Path(history_file or DEFAULT_HISTORY_FILE)
+        # Wins of all specs as of the last read, to order configurations by.
+        self.history = self.read_history() if \
+            len(self.configurations) > 1 else {}
+
+    def read_history(self):
+        try:
+            return json.loads(self.history_file.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def get_configurations(self):
+        """Returns the configurations, ones that won more often for the spec
+        first."""
+        wins = self.history.get(self.spec_key, {})
+        # Sorting is stable, so configurations that never won keep their
+        # order.
+        return sorted(self.configurations,
+                      key=lambda configuration: -wins.get(
+                          get_configuration_name(configuration), 0))
+
+    def record_win(self, configuration):
+        if len(self.configurations) == 1:
+            return
+        self.history_file.parent.mkdir(parents=True, exist_ok=True)
+        lock_file_name = str(self.history_file) + '.lock'
+        with open(lock_file_name, 'w') as lock_file:
+            # Other compilations may have recorded wins since the last read,
+            # so the history is read again and written under the lock.
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            history = self.read_history()
+            wins = history.setdefault(self.spec_key, {})
+            name = get_configuration_name(configuration)
+            wins[name] = wins.get(name, 0) + 1
+            # Replace the file atomically, as readers don't take the lock.
+            (fd, tmp_path) = tempfile.mkstemp(dir=self.history_file.parent,
+                                              suffix='.tmp')
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(history, tmp_file)
+            os.replace(tmp_path, self.history_file)
+        self.history = history
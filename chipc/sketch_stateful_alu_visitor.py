@@ -3,6 +3,7 @@ from textwrap import dedent
 
 from overrides import overrides
 
+from chipc.alu_template import AluTemplate
 from chipc.aluParser import aluParser
 from chipc.aluVisitor import aluVisitor
 
@@ -36,6 +37,16 @@ class SketchStatefulAluVisitor(aluVisitor):
         assert (hole_name not in self.alu_args)
         self.alu_args[hole_name] = hole_width
 
+    # Call after visiting with alu_name set to ALU_NAME_PLACEHOLDER.
+    def get_alu_template(self):
+        return AluTemplate(
+            self.helper_function_strings + self.main_function,
+            OrderedDict((hole, self.global_holes[hole])
+                        for hole in sorted(self.global_holes)),
+            sorted(self.alu_args),
+            len(self.packet_fields),
+            len(self.state_vars))
+
     @overrides
     def visitAlu(self, ctx):
         self.main_function += ('int ' + self.alu_name +
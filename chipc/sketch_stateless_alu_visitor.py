@@ -3,6 +3,7 @@ from collections import OrderedDict
 
 from overrides import overrides
 
+from chipc.alu_template import AluTemplate
 from chipc.aluParser import aluParser
 from chipc.aluVisitor import aluVisitor
 from chipc.utils import get_hole_bit_width
@@ -25,6 +26,7 @@ class SketchStatelessAluVisitor (aluVisitor):
         self.constant_arr_size = constant_arr_size
         self.helper_function_strings = '\n\n\n'
         self.global_holes = OrderedDict()
+        self.mux_holes = OrderedDict()
         self.stateless_alu_args = OrderedDict()
         self.main_function = ''
         self.packet_fields = []
@@ -47,6 +49,18 @@ class SketchStatelessAluVisitor (aluVisitor):
         assert (hole_name not in self.stateless_alu_args)
         self.stateless_alu_args[hole_name+'_hole_local'] = hole_width
 
+    # Call after visiting with alu_name set to ALU_NAME_PLACEHOLDER. Mux
+    # control holes come first, followed by the ALU's own holes.
+    def get_alu_template(self):
+        holes = OrderedDict(self.mux_holes)
+        for hole in sorted(self.global_holes):
+            holes[hole] = self.global_holes[hole]
+        return AluTemplate(
+            self.helper_function_strings + self.main_function,
+            holes,
+            sorted(self.stateless_alu_args),
+            len(self.packet_fields))
+
     # Calculates number of bits to set opcode hole to
     def find_opcode_bits(self):
         with open(self.alu_filename) as f:
@@ -94,6 +108,8 @@ class SketchStatelessAluVisitor (aluVisitor):
             self.helper_function_strings += \
                 self.generate_stateless_mux(
                     len(self.potential_operands), full_name)
+            self.mux_holes[full_name + '_ctrl'] = get_hole_bit_width(
+                len(self.potential_operands))
 
             mux_index += 1
 
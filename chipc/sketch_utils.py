@@ -1,65 +1,290 @@
+import asyncio
+import functools
+import os
 import re
+import resource
+import shutil
+import signal
 import subprocess
+import time
 from pathlib import Path
 
 SLV_TIMEOUT_MINS = 0.1
 
 
+def get_sketch_artifacts(sketch_path):
+    """Returns the files that make up the sketch on sketch_path: the
+    sketch-frontend wrapper script, its jars, and the cegis backend binary
+    under its runtime directory or SKETCH_HOME."""
+    sketch_path = Path(sketch_path).resolve()
+    frontend_dir = sketch_path.parent
+    artifacts = [sketch_path]
+    # Jars are next to the wrapper, or in target/ of a frontend build.
+    artifacts += sorted(frontend_dir.glob('*.jar'))
+    artifacts += sorted(frontend_dir.glob('*/*.jar'))
+    runtime_dirs = [frontend_dir / 'runtime']
+    if 'SKETCH_HOME' in os.environ:
+        runtime_dirs.insert(0, Path(os.environ['SKETCH_HOME']))
+    for runtime_dir in runtime_dirs:
+        backend_path = runtime_dir / 'bin' / 'cegis'
+        if backend_path.exists():
+            # The runtime usually links to the binary of the backend build.
+            artifacts.append(backend_path.resolve())
+            break
+    return artifacts
+
+
+@functools.lru_cache(maxsize=None)
+def get_sketch_version():
+    """Returns a string identifying the sketch on the PATH, for keys of
+    cached Sketch results."""
+    sketch_path = shutil.which('sketch')
+    if sketch_path is None:
+        return 'none'
+    output = run_sketch(['--version']).output
+    # Sketch may be rebuilt without changing its version, and the wrapper
+    # script doesn't change then, so the key also has the size and
+    # modification time of the jars and the backend binary.
+    fingerprints = []
+    for artifact in get_sketch_artifacts(sketch_path):
+        stat = artifact.stat()
+        fingerprints.append('{} {} {}'.format(artifact, stat.st_size,
+                                              stat.st_mtime_ns))
+    return '\n'.join([output.strip()] + fingerprints)
+
+
+# Return codes of sketch runs that are worth caching. Others, e.g., from
+# runs killed by a signal, could be different the next time.
+def is_cacheable(return_code):
+    return 0 <= return_code < 128
+
+
+class SketchResult:
+    """Return code, combined stdout and stderr, and wall and CPU seconds of a
+    sketch run."""
+
+    def __init__(self, return_code, output, wall_time, cpu_time,
+                 timed_out=False):
+        self.return_code = return_code
+        self.output = output
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.timed_out = timed_out
+
+
+def kill_process_group(process, sig=signal.SIGKILL):
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def check_parse_error(args, output):
+    if output.rfind('Program Parse Error:') != -1:
+        raise Exception(
+            ' '.join(str(arg) for arg in args) + ' contains a syntax error. ' +
+            'Output pasted below:\n\n' + output)
+
+
+def run_sketch(args, timeout=None):
+    """Runs sketch once with a list of arguments and returns a SketchResult.
+
+    Raises an exception if sketch reports a parse error, so that no separate
+    run is needed to check the syntax. If the run takes longer than timeout
+    seconds, sketch and the JVM it started are killed, and the return code is
+    negative."""
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    # Start sketch in a new session, so that the JVM started by its wrapper
+    # script can be killed along with it.
+    process = subprocess.Popen(['sketch'] + [str(arg) for arg in args],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT,
+                               universal_newlines=True,
+                               start_new_session=True)
+    timed_out = False
+    try:
+        (output, _) = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        kill_process_group(process)
+        (output, _) = process.communicate()
+    wall_time = time.perf_counter() - start
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # Includes other children that finished meanwhile, if there are any.
+    cpu_time = (children_after.ru_utime - children_before.ru_utime +
+                children_after.ru_stime - children_before.ru_stime)
+
+    check_parse_error(args, output)
+    return SketchResult(process.returncode, output, wall_time, cpu_time,
+                        timed_out)
+
+
+async def run_sketch_async(args, timeout=None, on_output=None):
+    """Like run_sketch, but runs sketch as an asyncio subprocess, so that
+    many runs can be in flight from one Python process.
+
+    Lines of the output are passed to on_output as they arrive, if given.
+    Cancelling the awaiting task terminates sketch and the JVM it started.
+    The CPU time of the result is None, as it can't be told apart from the
+    CPU time of other runs in flight."""
+    start = time.perf_counter()
+    create = asyncio.ensure_future(asyncio.create_subprocess_exec(
+        'sketch', *[str(arg) for arg in args],
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True,
+        # sketch prints long lines with -V 12.
+        limit=1 << 24))
+    try:
+        process = await asyncio.shield(create)
+    except asyncio.CancelledError:
+        # Sketch may start even though the task got cancelled meanwhile.
+        process = await create
+        kill_process_group(process)
+        await process.wait()
+        raise
+    lines = []
+
+    async def read_output():
+        async for line in process.stdout:
+            line = line.decode(errors='replace')
+            lines.append(line)
+            if on_output is not None:
+                on_output(line)
+        return await process.wait()
+
+    timed_out = False
+    try:
+        return_code = await asyncio.wait_for(read_output(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        kill_process_group(process)
+        return_code = await process.wait()
+    except asyncio.CancelledError:
+        # Give sketch a chance to exit cleanly before killing it.
+        kill_process_group(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), 1)
+        except asyncio.TimeoutError:
+            kill_process_group(process)
+            await process.wait()
+        raise
+
+    output = ''.join(lines)
+    check_parse_error(args, output)
+    return SketchResult(return_code, output, time.perf_counter() - start,
+                        None, timed_out)
+
+
 def check_syntax(sketch_file_name):
     # Check syntax of given sketch file.
-    (return_code, output) = subprocess.getstatusoutput(
-        'sketch ' + sketch_file_name + ' --slv-timeout=0.001')
-    if (return_code == 0):
+    if run_sketch([sketch_file_name, '--slv-timeout=0.001']).return_code == 0:
         print(sketch_file_name + ' passed syntax check. ')
-        assert(output.rfind('Program Parse Error:') == -1)
-    else:
-        if (output.rfind('Program Parse Error:') != -1):
-            raise Exception(
-                sketch_file_name + ' contains a syntax error.' +
-                'Output pasted below:\n\n' + output)
 
 
-def synthesize(sketch_file_name, bnd_inbits, slv_seed, slv_parallel=False):
+def get_synthesis_args(sketch_file_name, bnd_inbits, slv_seed, slv_parallel,
+                       options):
     assert(slv_parallel in [True, False])
-    check_syntax(sketch_file_name)
-    par_string = ' --slv-parallel' if slv_parallel else ''
-    # Consider switching to subprocess.run as subprocess.getstatusoutput is
-    # considered legacy.
-    # https://docs.python.org/3.5/library/subprocess.html#legacy-shell-invocation-functions
-    (return_code, output) = subprocess.getstatusoutput('time sketch -V 12 ' +
-                                                       '--slv-nativeints ' +
-                                                       sketch_file_name +
-                                                       ' --bnd-inbits=' +
-                                                       str(bnd_inbits) +
-                                                       ' --slv-seed=' +
-                                                       str(slv_seed) +
-                                                       par_string)
-    assert(output.rfind('Program Parse Error:') == -1)
-    return (return_code, output)
+    args = ['-V', '12', '--slv-nativeints', sketch_file_name,
+            '--bnd-inbits=' + str(bnd_inbits), '--slv-seed=' + str(slv_seed)]
+    if slv_parallel:
+        args.append('--slv-parallel')
+    return args + list(options)
+
+
+def get_synthesis_key(cache, sketch_file_name, bnd_inbits, slv_seed,
+                      slv_parallel, options):
+    return cache.get_key(Path(sketch_file_name).read_text(),
+                         ['synthesize', bnd_inbits, slv_seed, slv_parallel] +
+                         list(options),
+                         get_sketch_version())
+
+
+def print_synthesis_time(result):
+    cpu_string = '' if result.cpu_time is None else \
+        ', {:.2f}s CPU time'.format(result.cpu_time)
+    print('sketch took {:.2f}s wall time{}{}'.format(
+        result.wall_time, cpu_string,
+        ', and timed out' if result.timed_out else ''))
+
+
+def synthesize(sketch_file_name, bnd_inbits, slv_seed, slv_parallel=False,
+               cache=None, timeout=None, options=()):
+    """Runs sketch on a file and returns a tuple of its return code and
+    output. options are further arguments to sketch. If cache, a
+    SketchCache, is given, a cached result for the same sketch and flags is
+    returned instead if there is one. Runs killed after timeout seconds
+    return a negative return code."""
+    args = get_synthesis_args(sketch_file_name, bnd_inbits, slv_seed,
+                              slv_parallel, options)
+    if cache is not None:
+        key = get_synthesis_key(cache, sketch_file_name, bnd_inbits, slv_seed,
+                                slv_parallel, options)
+        entry = cache.get(key)
+        if entry is not None:
+            print('Using cached sketch output for', sketch_file_name)
+            return (entry['return_code'], entry['output'])
+
+    result = run_sketch(args, timeout)
+    print_synthesis_time(result)
+    if cache is not None and is_cacheable(result.return_code):
+        cache.put(key, {'return_code': result.return_code,
+                        'output': result.output})
+    return (result.return_code, result.output)
+
+
+async def synthesize_async(sketch_file_name, bnd_inbits, slv_seed,
+                           slv_parallel=False, cache=None, timeout=None,
+                           on_output=None, options=(), job_queue=None):
+    """Like synthesize, but runs sketch with run_sketch_async, or on a worker
+    of job_queue, a JobQueue, if given. on_output isn't called for runs on
+    workers."""
+    args = get_synthesis_args(sketch_file_name, bnd_inbits, slv_seed,
+                              slv_parallel, options)
+    if cache is not None:
+        key = get_synthesis_key(cache, sketch_file_name, bnd_inbits, slv_seed,
+                                slv_parallel, options)
+        entry = cache.get(key)
+        if entry is not None:
+            print('Using cached sketch output for', sketch_file_name)
+            return (entry['return_code'], entry['output'])
+
+    if job_queue is not None:
+        result = await job_queue.run_async(sketch_file_name, args, timeout)
+    else:
+        result = await run_sketch_async(args, timeout, on_output)
+    print_synthesis_time(result)
+    if cache is not None and is_cacheable(result.return_code):
+        cache.put(key, {'return_code': result.return_code,
+                        'output': result.output})
+    return (result.return_code, result.output)
 
 
 def generate_smt2_formula(sketch_file_name, smt_file_name, bit_range):
-    check_syntax(sketch_file_name)
-    (return_code, output) = subprocess.getstatusoutput('sketch ' +
-                                                       sketch_file_name +
-                                                       ' --bnd-inbits=' +
-                                                       str(bit_range) +
-                                                       ' --slv-timeout=' +
-                                                       str(SLV_TIMEOUT_MINS) +
-                                                       ' --beopt:writeSMT ' +
-                                                       smt_file_name)
-
-
-def generate_ir(sketch_file_name):
-    """Given a sketch file, returns its IR (intermediate representation).
+    run_sketch([sketch_file_name,
+                '--bnd-inbits=' + str(bit_range),
+                '--slv-timeout=' + str(SLV_TIMEOUT_MINS),
+                '--beopt:writeSMT', smt_file_name])
 
-    This function calls sketch and generates a .dag file having IR for the
-    sketch file. Then reads the .dag file and returns its content."""
-    check_syntax(sketch_file_name)
+
+def generate_dag_file(sketch_file_name, cache=None):
+    """Given a sketch file, calls sketch to generate a .dag file having its IR
+    (intermediate representation) and returns the name of the .dag file. If
+    cache, a SketchCache, is given, a cached DAG is written instead if there
+    is one."""
     # Generate the dag filename by replacing sk extension with dag.
     dag_file_name = re.sub('sk$', 'dag', sketch_file_name)
-    subprocess.run([
-        'sketch',
+    if cache is not None:
+        key = cache.get_key(Path(sketch_file_name).read_text(),
+                            ['generate_ir', SLV_TIMEOUT_MINS],
+                            get_sketch_version())
+        entry = cache.get(key)
+        if entry is not None:
+            Path(dag_file_name).write_text(entry['dag'])
+            return dag_file_name
+
+    result = run_sketch([
         '-V', '3',
         sketch_file_name,
         '--debug-output-dag', dag_file_name,
@@ -67,9 +292,18 @@ def generate_ir(sketch_file_name):
         # return from it using --slv-timeout.
         '--slv-seed', '1',
         '--slv-timeout', str(SLV_TIMEOUT_MINS)
-    ],
-        # Pipe stdout and stderr to /dev/null as we don't need them.
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL)
+    ])
+
+    # sketch returns non-zero as it times out, so check for the DAG instead.
+    if cache is not None and is_cacheable(result.return_code) and \
+            Path(dag_file_name).exists():
+        cache.put(key, {'dag': Path(dag_file_name).read_text()})
+    return dag_file_name
 
-    return Path(dag_file_name).read_text()
+
+def generate_ir(sketch_file_name, cache=None):
+    """Given a sketch file, returns its IR (intermediate representation).
+
+    This function calls sketch and generates a .dag file having IR for the
+    sketch file. Then reads the .dag file and returns its content."""
+    return Path(generate_dag_file(sketch_file_name, cache)).read_text()
@@ -0,0 +1,129 @@
+"""Analyses a spec to prune assignments of state groups to pipeline stages.
+
+Two facts about a spec rule out assignments before any sketch runs:
+
+- If the new value of state group a depends on the value of state group b,
+  the stateful ALU of b has to pass it on through the PHV, so a has to sit in
+  a later stage than b.
+- If swapping state groups a and b maps the spec to itself, an assignment
+  and the one with the stages of a and b swapped are equally good, so only
+  the one with a in a stage no later than b needs to be tried.
+
+Both are checked semantically with z3, not syntactically, and anything z3
+can't decide is left unpruned.
+"""
+import z3
+
+from chipc.z3_spec import Z3Spec
+
+# Milliseconds z3 may spend on each check.
+CHECK_TIMEOUT = 10000
+
+
+def get_state_group_fields(state_group_info, state_group):
+    return ['state_group_' + str(state_group) + '_state_' + str(state)
+            for state in state_group_info[str(state_group)]]
+
+
+def get_fields(num_pkt_fields, state_group_info):
+    fields = ['pkt_' + str(i) for i in range(num_pkt_fields)]
+    for state_group in state_group_info:
+        fields += get_state_group_fields(state_group_info, state_group)
+    return fields
+
+
+def is_valid(formula):
+    """Returns True iff z3 proves formula."""
+    solver = z3.Solver()
+    solver.set('timeout', CHECK_TIMEOUT)
+    solver.add(z3.Not(formula))
+    return solver.check() == z3.unsat
+
+
+def is_satisfiable(formula):
+    """Returns True iff z3 finds a model of formula."""
+    solver = z3.Solver()
+    solver.set('timeout', CHECK_TIMEOUT)
+    solver.add(formula)
+    return solver.check() == z3.sat
+
+
+class StateGroupAnalysis:
+    def __init__(self, program_content, num_pkt_fields, state_group_info):
+        self.state_group_info = state_group_info
+        self.inputs = {field: z3.Int(field) for field in
+                       get_fields(num_pkt_fields, state_group_info)}
+        self.outputs = Z3Spec(program_content).evaluate(self.inputs)
+        # Fields the spec assigns constants to are Python ints.
+        for (field, value) in self.outputs.items():
+            if not z3.is_expr(value):
+                self.outputs[field] = z3.IntVal(value)
+
+    def depends_on(self, state_group, other_state_group):
+        """Returns True if z3 finds two runs of the spec that only differ in
+        the state of other_state_group, and end with different states of
+        state_group."""
+        substitutions = [
+            (self.inputs[field], z3.Int(field + '_other')) for field in
+            get_state_group_fields(self.state_group_info, other_state_group)]
+        return is_satisfiable(z3.Or([
+            self.outputs[field] != z3.substitute(self.outputs[field],
+                                                 *substitutions)
+            for field in get_state_group_fields(self.state_group_info,
+                                                state_group)]))
+
+    def is_symmetric(self, state_group, other_state_group):
+        """Returns True if z3 proves that swapping the two state groups in
+        the inputs of the spec swaps them in its outputs."""
+        fields = get_state_group_fields(self.state_group_info, state_group)
+        other_fields = get_state_group_fields(self.state_group_info,
+                                              other_state_group)
+        if len(fields) != len(other_fields):
+            return False
+        swap = dict(zip(fields, other_fields))
+        swap.update(zip(other_fields, fields))
+        substitutions = [(self.inputs[field], self.inputs[swap[field]])
+                         for field in swap]
+        return is_valid(z3.And([
+            z3.substitute(self.outputs[field], *substitutions) ==
+            self.outputs[swap.get(field, field)]
+            for field in self.outputs]))
+
+    def get_dependencies(self, state_groups):
+        """Returns a list of pairs (a, b) of state groups, where a has to be in
+        a later stage than b. Only state groups in state_groups, i.e., the
+        ones checked for correctness, get dependencies."""
+        return [(int(state_group), int(other_state_group))
+                for state_group in state_groups
+                for other_state_group in self.state_group_info
+                if int(state_group) != int(other_state_group) and
+                self.depends_on(state_group, other_state_group)]
+
+    def get_symmetry_classes(self):
+        """Returns a list of sorted lists of state groups, where any two state
+        groups in a list can be swapped."""
+        classes = []
+        for state_group in map(int, self.state_group_info):
+            for symmetry_class in classes:
+                # Swaps compose, so checking one member of a class is enough.
+                if self.is_symmetric(symmetry_class[0], state_group):
+                    symmetry_class.append(state_group)
+                    break
+            else:
+                classes.append([state_group])
+        return [symmetry_class for symmetry_class in classes
+                if len(symmetry_class) > 1]
+
+
+def is_assignment_allowed(assignment, dependencies, symmetry_classes):
+    """Returns whether an assignment, a tuple of stages indexed by state
+    group, meets the dependencies and is the canonical one among assignments
+    that only differ by swapping symmetric state groups."""
+    for (state_group, other_state_group) in dependencies:
+        if assignment[state_group] <= assignment[other_state_group]:
+            return False
+    for symmetry_class in symmetry_classes:
+        stages = [assignment[state_group] for state_group in symmetry_class]
+        if stages != sorted(stages):
+            return False
+    return True
@@ -2,14 +2,11 @@ from hashlib import md5
 from os import path
 from pathlib import Path
 
-from antlr4 import CommonTokenStream
-from antlr4 import FileStream
 from jinja2 import Environment
 from jinja2 import FileSystemLoader
 from jinja2 import StrictUndefined
 
-from chipc.aluLexer import aluLexer
-from chipc.aluParser import aluParser
+from chipc.alu_parse_cache import get_alu_parse_tree
 from chipc.tofino_stateful_alu_visitor import TofinoStatefulAluVisitor
 
 
@@ -74,11 +71,7 @@ class TofinoCodeGenerator:
         return stateful_alus
 
     def generate_stateful_alu(self, alu_name):
-        input_stream = FileStream(self.stateful_alu_filename_)
-        lexer = aluLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        parser = aluParser(stream)
-        tree = parser.alu()
+        tree = get_alu_parse_tree(self.stateful_alu_filename_)
 
         operand0 = 'ipv4.pkt_' + str(self.hole_assignments_.pop(
                    self.sketch_name_ + '_' + alu_name +
@@ -0,0 +1,99 @@
+"""Spans timing the phases of a compilation.
+
+Phases of Compiler and iterative_solver run in spans of the tracer of the
+process, which record when they started, how long they took and attributes
+such as the size of the sketch. Spans of concurrent asyncio tasks and threads
+go to tracks of their own, so that parallel sketch runs and verifications
+show up side by side.
+
+The spans can be written as JSON lines, one span per line, and in the trace
+event format of Chrome, which chrome://tracing and Perfetto display.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+def get_track_key():
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        # Not in an event loop.
+        task = None
+    if task is not None:
+        return ('task', id(task))
+    return ('thread', threading.get_ident())
+
+
+class Tracer:
+    def __init__(self):
+        self.spans = []
+        # Maps keys of tasks and threads to small track numbers.
+        self.tracks = {}
+        # Verification runs on other threads.
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+            self.tracks = {}
+
+    def get_track(self):
+        with self.lock:
+            return self.tracks.setdefault(get_track_key(), len(self.tracks))
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """Records a span around the body of a with statement. The dict of
+        attributes it yields can be updated in the body, e.g., with sizes of
+        outputs."""
+        track = self.get_track()
+        # Start times are wall clock times, so that spans of different
+        # processes line up.
+        start = time.time()
+        start_counter = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            span = {'name': name, 'start': start,
+                    'duration': time.perf_counter() - start_counter,
+                    'pid': os.getpid(), 'track': track,
+                    'attributes': attributes}
+            with self.lock:
+                self.spans.append(span)
+
+    def write_json_lines(self, file_name):
+        with open(file_name, 'w') as json_file:
+            for span in self.spans:
+                json_file.write(json.dumps(span, default=str) + '\n')
+
+    def write_chrome_trace(self, file_name):
+        events = [{'name': span['name'], 'cat': 'chipmunk', 'ph': 'X',
+                   'ts': span['start'] * 1e6, 'dur': span['duration'] * 1e6,
+                   'pid': span['pid'], 'tid': span['track'],
+                   'args': span['attributes']}
+                  for span in self.spans]
+        with open(file_name, 'w') as json_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                      json_file, default=str)
+
+    def write(self, prefix):
+        """Writes the spans to prefix.jsonl and, as a Chrome trace, to
+        prefix.json."""
+        self.write_json_lines(prefix + '.jsonl')
+        self.write_chrome_trace(prefix + '.json')
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, **attributes):
+    """Records a span with the tracer of the process, see Tracer.span."""
+    return _tracer.span(name, **attributes)
@@ -0,0 +1,419 @@
+from overrides import overrides
+
+from chipc.aluParser import aluParser
+from chipc.aluVisitor import aluVisitor
+from chipc.z3_spec import evaluate_expression
+from chipc.z3_spec import parse_expression_tokens
+from chipc.z3_utils import arith
+from chipc.z3_utils import compare
+from chipc.z3_utils import is_concrete
+from chipc.z3_utils import ite
+from chipc.z3_utils import logical_and
+from chipc.z3_utils import logical_not
+from chipc.z3_utils import logical_or
+from chipc.z3_utils import select
+from chipc.z3_utils import to_bool
+from chipc.z3_utils import to_int
+
+
+class Z3AluVisitor(aluVisitor):
+    """Evaluates an ALU into z3 expressions, following the semantics of the
+    sketch code that the Sketch*AluVisitor classes generate for it.
+
+    Statements are executed under a path condition, so both sides of an if
+    are visited in order. This keeps the numbering of muxes, constants, etc.
+    the same as in the generated sketch, which the hole names depend on.
+    """
+
+    def __init__(self, alu_name, hole_assignments, constant_vector):
+        self.alu_name = alu_name
+        self.hole_assignments = hole_assignments
+        self.constant_vector = constant_vector
+        self.mux5_count = 0
+        self.mux4_count = 0
+        self.mux3_count = 0
+        self.mux2_count = 0
+        self.rel_op_count = 0
+        self.arith_op_count = 0
+        self.opt_count = 0
+        self.constant_count = 0
+        self.compute_alu_count = 0
+        self.bool_op_count = 0
+        # Mux3 helper index to the constant it returns for the third operand.
+        self.mux3_nums = {}
+        self.state_vars = []
+        self.hole_vars = []
+        self.packet_fields = []
+        self.variables = {}
+        # Temporary variables declared as bit.
+        self.bit_vars = set()
+        self.path_condition = True
+        self.returned = False
+        # Functions in sketch return 0 if they don't reach a return statement.
+        self.return_value = 0
+        # Predicates that must hold, e.g., for assert(false) in the ALU.
+        self.asserts = []
+
+    def get_hole_value(self, hole_name):
+        raise NotImplementedError
+
+    def write_back_state(self, condition):
+        pass
+
+    def guard(self):
+        return logical_and(self.path_condition, logical_not(self.returned))
+
+    def assign(self, variable, value):
+        self.variables[variable] = ite(self.guard(), value,
+                                       self.variables.get(variable, 0))
+
+    # Picks the alternative for an opcode. Only the picked alternative is
+    # evaluated when the opcode is known.
+    def choose(self, opcode, alternatives):
+        if is_concrete(opcode):
+            return select(opcode, alternatives)()
+        return select(opcode, [alternative() for alternative in
+                               alternatives])
+
+    def constant_at(self, index):
+        if is_concrete(index):
+            if 0 <= index < len(self.constant_vector):
+                return self.constant_vector[index]
+            # Sketch fails an assertion on out of bounds array accesses.
+            self.asserts.append(logical_not(self.guard()))
+            return 0
+        self.asserts.append(logical_or(
+            logical_not(self.guard()),
+            logical_and(compare('>=', index, 0),
+                        compare('<', index, len(self.constant_vector)))))
+        return select(index, self.constant_vector)
+
+    @overrides
+    def visitState_var(self, ctx):
+        self.state_vars.append(ctx.getText())
+
+    @overrides
+    def visitHole_var(self, ctx):
+        self.hole_vars.append(ctx.getText())
+
+    @overrides
+    def visitPacket_field(self, ctx):
+        self.packet_fields.append(ctx.getText())
+
+    # Operators the Sketch*AluVisitor classes write out as they are, without
+    # parentheses. Sketch parses them with C precedence, which differs from
+    # alu.g4, e.g., !a && b is !(a && b) in the parse tree.
+    OPERATOR_CONTEXTS = (aluParser.ExprWithOpContext,
+                         aluParser.EqualsContext,
+                         aluParser.GreaterContext,
+                         aluParser.GreaterEqualContext,
+                         aluParser.LessContext,
+                         aluParser.LessEqualContext,
+                         aluParser.NotEqualContext,
+                         aluParser.AndContext,
+                         aluParser.OrContext)
+
+    # Expressions the corresponding Sketch*AluVisitor doesn't write out
+    # correctly.
+    UNSUPPORTED_CONTEXTS = ()
+
+    def visit_expression(self, ctx):
+        """Evaluates an expression the way Sketch parses the code generated
+        for it."""
+        tokens = []
+        self.flatten_expression(ctx, tokens)
+        return evaluate_expression(parse_expression_tokens(tokens), {})
+
+    def flatten_expression(self, ctx, tokens):
+        assert not isinstance(ctx, self.UNSUPPORTED_CONTEXTS), (
+            'Unsupported expression in ' + self.alu_name + ': ' +
+            ctx.getText())
+        if isinstance(ctx, self.OPERATOR_CONTEXTS):
+            self.flatten_expression(ctx.getChild(0, aluParser.ExprContext),
+                                    tokens)
+            tokens.append(ctx.getChild(1).getText())
+            self.flatten_expression(ctx.getChild(1, aluParser.ExprContext),
+                                    tokens)
+        elif isinstance(ctx, aluParser.NOTContext):
+            tokens.append('!')
+            self.flatten_expression(ctx.getChild(0, aluParser.ExprContext),
+                                    tokens)
+        elif isinstance(ctx, aluParser.TernaryContext):
+            self.flatten_expression(ctx.getChild(0, aluParser.ExprContext),
+                                    tokens)
+            tokens.append('?')
+            self.flatten_expression(ctx.getChild(1, aluParser.ExprContext),
+                                    tokens)
+            tokens.append(':')
+            self.flatten_expression(ctx.getChild(2, aluParser.ExprContext),
+                                    tokens)
+        elif isinstance(ctx, (aluParser.RelOpContext,
+                              aluParser.BoolOpContext)):
+            # Calls to rel_op and bool_op are followed by == 1.
+            tokens += [self.visit(ctx), '==', 1]
+        else:
+            tokens.append(self.visit(ctx))
+
+    @overrides
+    def visitStmtUpdateExpr(self, ctx):
+        variable = ctx.getChild(0, aluParser.VariableContext).getText()
+        value = self.visit_expression(ctx.getChild(0, aluParser.ExprContext))
+        if variable in self.bit_vars:
+            self.assign(variable, to_bool(value))
+        else:
+            self.assign(variable, to_int(value))
+
+    @overrides
+    def visitStmtUpdateTempInt(self, ctx):
+        variable = ctx.getChild(0, aluParser.Temp_varContext).getText()
+        self.assign(variable, to_int(self.visit_expression(
+            ctx.getChild(0, aluParser.ExprContext))))
+
+    @overrides
+    def visitStmtUpdateTempBit(self, ctx):
+        variable = ctx.getChild(0, aluParser.Temp_varContext).getText()
+        self.bit_vars.add(variable)
+        self.assign(variable, to_bool(self.visit_expression(
+            ctx.getChild(0, aluParser.ExprContext))))
+
+    @overrides
+    def visitReturn_statement(self, ctx):
+        value = to_int(self.visit_expression(ctx.getChild(1)))
+        guard = self.guard()
+        self.write_back_state(guard)
+        self.return_value = ite(guard, value, self.return_value)
+        self.returned = logical_or(self.returned, guard)
+
+    @overrides
+    def visitStmtIfElseIfElse(self, ctx):
+        outer_condition = self.path_condition
+        taken = False
+        for block in ctx.condition_block():
+            self.path_condition = logical_and(outer_condition,
+                                              logical_not(taken))
+            condition = to_bool(self.visit_expression(block.expr()))
+            self.path_condition = logical_and(self.path_condition, condition)
+            self.visit(block.alu_body())
+            taken = logical_or(taken, condition)
+
+        if ctx.else_body is not None:
+            self.path_condition = logical_and(outer_condition,
+                                              logical_not(taken))
+            self.visit(ctx.else_body)
+        self.path_condition = outer_condition
+
+    @overrides
+    def visitAssertFalse(self, ctx):
+        self.asserts.append(logical_not(self.guard()))
+
+    @overrides
+    def visitVar(self, ctx):
+        return self.variables[ctx.getText()]
+
+    @overrides
+    def visitNum(self, ctx):
+        return int(ctx.getText())
+
+    @overrides
+    def visitTrue(self, ctx):
+        return True
+
+    @overrides
+    def visitExprWithParen(self, ctx):
+        return self.visit_expression(ctx.getChild(0, aluParser.ExprContext))
+
+    def visit_operands(self, ctx, num_operands):
+        return [to_int(self.visit_expression(
+                    ctx.getChild(i, aluParser.ExprContext)))
+                for i in range(num_operands)]
+
+    # As in the generated sketch, the hole passed to a helper function is
+    # numbered before its operands are visited, and the count is only bumped
+    # afterwards.
+    @overrides
+    def visitMux5(self, ctx):
+        opcode = self.get_hole_value('Mux5_' + str(self.mux5_count))
+        operands = self.visit_operands(ctx, 5)
+        self.mux5_count += 1
+        return select(opcode, operands)
+
+    @overrides
+    def visitMux4(self, ctx):
+        opcode = self.get_hole_value('Mux4_' + str(self.mux4_count))
+        operands = self.visit_operands(ctx, 4)
+        self.mux4_count += 1
+        return select(opcode, operands)
+
+    @overrides
+    def visitMux3(self, ctx):
+        mux3_index = self.mux3_count
+        choice = self.get_hole_value('Mux3_' + str(mux3_index))
+        operands = self.visit_operands(ctx, 3)
+        self.mux3_count += 1
+        return select(choice, operands)
+
+    @overrides
+    def visitMux3WithNum(self, ctx):
+        mux3_index = self.mux3_count
+        choice = self.get_hole_value('Mux3_' + str(mux3_index))
+        operands = self.visit_operands(ctx, 2)
+        # The call refers to the helper function generated with the index
+        # this call started with, see SketchStatefulAluVisitor.visitMux3.
+        self.mux3_nums[self.mux3_count] = int(ctx.getChild(6).getText())
+        self.mux3_count += 1
+        return select(choice, operands + [self.mux3_nums[mux3_index]])
+
+    @overrides
+    def visitMux2(self, ctx):
+        choice = self.get_hole_value('Mux2_' + str(self.mux2_count))
+        operands = self.visit_operands(ctx, 2)
+        self.mux2_count += 1
+        return select(choice, operands)
+
+    @overrides
+    def visitOpt(self, ctx):
+        enable = self.get_hole_value('Opt_' + str(self.opt_count))
+        (op1,) = self.visit_operands(ctx, 1)
+        self.opt_count += 1
+        return ite(compare('!=', enable, 0), 0, op1)
+
+    @overrides
+    def visitConstant(self, ctx):
+        index = self.get_hole_value('const_' + str(self.constant_count))
+        self.constant_count += 1
+        return self.constant_at(index)
+
+    @overrides
+    def visitRelOp(self, ctx):
+        opcode = self.get_hole_value('rel_op_' + str(self.rel_op_count))
+        (op1, op2) = self.visit_operands(ctx, 2)
+        self.rel_op_count += 1
+        return to_int(self.choose(opcode, [
+            lambda: compare('!=', op1, op2),
+            lambda: compare('<', op1, op2),
+            lambda: compare('>', op1, op2),
+            lambda: compare('==', op1, op2)]))
+
+    @overrides
+    def visitBoolOp(self, ctx):
+        opcode = self.get_hole_value('bool_op_' + str(self.bool_op_count))
+        op1 = to_bool(self.visit_expression(
+            ctx.getChild(0, aluParser.ExprContext)))
+        op2 = to_bool(self.visit_expression(
+            ctx.getChild(1, aluParser.ExprContext)))
+        self.bool_op_count += 1
+        return self.choose(opcode, [
+            lambda: False,
+            lambda: logical_not(logical_or(op1, op2)),
+            lambda: logical_and(logical_not(op1), op2),
+            lambda: logical_not(op1),
+            lambda: logical_and(op1, logical_not(op2)),
+            lambda: logical_not(op2),
+            lambda: logical_and(op1, op2),
+            lambda: logical_not(logical_and(op1, op2)),
+            lambda: logical_and(op1, op2),
+            lambda: logical_not(logical_and(op1, op2)),
+            lambda: op2,
+            lambda: logical_or(logical_not(op1), op2),
+            lambda: op1,
+            lambda: logical_or(op1, logical_not(op2)),
+            lambda: logical_or(op1, op2),
+            lambda: True])
+
+    @overrides
+    def visitArithOp(self, ctx):
+        opcode = self.get_hole_value('arith_op_' + str(self.arith_op_count))
+        (op1, op2) = self.visit_operands(ctx, 2)
+        self.arith_op_count += 1
+        return self.choose(opcode, [
+            lambda: arith('+', op1, op2),
+            lambda: arith('-', op1, op2)])
+
+    @overrides
+    def visitComputeAlu(self, ctx):
+        opcode = self.get_hole_value(
+            'compute_alu_' + str(self.compute_alu_count))
+        (op1, op2) = self.visit_operands(ctx, 2)
+        self.compute_alu_count += 1
+        return self.choose(opcode, [
+            lambda: arith('+', op1, op2),
+            lambda: arith('-', op1, op2),
+            lambda: arith('-', op2, op1),
+            lambda: op2,
+            lambda: op1,
+            lambda: 0,
+            lambda: 1])
+
+
+class Z3StatelessAluVisitor(Z3AluVisitor):
+    # SketchStatelessAluVisitor drops the ! of a negation.
+    UNSUPPORTED_CONTEXTS = (aluParser.NOTContext,)
+
+    def __init__(self, alu_name, potential_operands, hole_assignments,
+                 constant_vector):
+        super().__init__(alu_name, hole_assignments, constant_vector)
+        self.potential_operands = potential_operands
+
+    @overrides
+    def get_hole_value(self, hole_name):
+        return self.hole_assignments[self.alu_name + '_' + hole_name]
+
+    @overrides
+    def visitAlu(self, ctx):
+        self.visit(ctx.getChild(0, aluParser.Hole_defContext))
+        self.visit(ctx.getChild(0, aluParser.Packet_field_defContext))
+        for hole_var in self.hole_vars:
+            value = self.get_hole_value(hole_var)
+            if 'immediate_operand' in hole_var:
+                value = self.constant_at(value)
+            self.variables[hole_var] = value
+        for mux_index, packet_field in enumerate(self.packet_fields):
+            self.variables[packet_field] = select(
+                self.get_hole_value(
+                    'operand_mux_' + str(mux_index) + '_ctrl'),
+                self.potential_operands)
+        self.visit(ctx.getChild(0, aluParser.Alu_bodyContext))
+
+
+class Z3StatefulAluVisitor(Z3AluVisitor):
+    # SketchStatefulAluVisitor drops the operators of these, use rel_op and
+    # Mux* instead.
+    UNSUPPORTED_CONTEXTS = (aluParser.EqualsContext,
+                            aluParser.GreaterContext,
+                            aluParser.GreaterEqualContext,
+                            aluParser.LessContext,
+                            aluParser.LessEqualContext,
+                            aluParser.NotEqualContext,
+                            aluParser.TernaryContext,
+                            aluParser.TrueContext)
+
+    def __init__(self, alu_name, state_group, packet_operands,
+                 hole_assignments, constant_vector):
+        super().__init__(alu_name, hole_assignments, constant_vector)
+        # Values of the state group slots, updated on return as the state
+        # group is passed by reference in the sketch.
+        self.state_group = list(state_group)
+        self.packet_operands = packet_operands
+
+    @overrides
+    def get_hole_value(self, hole_name):
+        return self.hole_assignments[
+            self.alu_name + '_' + hole_name + '_global']
+
+    @overrides
+    def write_back_state(self, condition):
+        for idx, state_var in enumerate(self.state_vars):
+            self.state_group[idx] = ite(condition, self.variables[state_var],
+                                        self.state_group[idx])
+
+    @overrides
+    def visitAlu(self, ctx):
+        self.visit(ctx.getChild(0, aluParser.State_var_defContext))
+        self.visit(ctx.getChild(0, aluParser.Packet_field_defContext))
+        assert len(self.state_vars) > 0
+        for (packet_field, value) in zip(self.packet_fields,
+                                         self.packet_operands):
+            self.variables[packet_field] = value
+        for idx, state_var in enumerate(self.state_vars):
+            self.variables[state_var] = self.state_group[idx]
+        self.visit(ctx.getChild(0, aluParser.Alu_bodyContext))
@@ -0,0 +1,285 @@
+"""Parses the program() function of a spec, and the predicates asserted on
+holes, so they can be evaluated into z3 expressions without Sketch.
+
+Only the subset of sketch that specs in example_specs/ are written in is
+supported: int locals, assignments to state_and_packet fields, if/else and C
+expressions.
+"""
+import re
+
+from chipc.z3_utils import arith
+from chipc.z3_utils import compare
+from chipc.z3_utils import ite
+from chipc.z3_utils import logical_and
+from chipc.z3_utils import logical_not
+from chipc.z3_utils import logical_or
+from chipc.z3_utils import to_bool
+from chipc.z3_utils import to_int
+
+TOKEN_REGEX = re.compile(
+    r'\s*(?:(\d+)|([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?)|'
+    r'(\+=|-=|\*=|==|!=|<=|>=|&&|\|\||[-+*/%<>=!?:;(){}|]))')
+
+# Binary operators from lowest to highest precedence.
+BINARY_OPERATORS = [['||'], ['&&'], ['==', '!='], ['<', '>', '<=', '>='],
+                    ['+', '-'], ['*', '/', '%']]
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_REGEX.match(text, position)
+        assert match, ('Unexpected input in spec:', text[position:])
+        tokens.append(match.group(match.lastindex))
+        position = match.end()
+    return tokens
+
+
+def strip_comments(text):
+    return re.sub(r'//[^\n]*|/\*.*?\*/', ' ', text, flags=re.DOTALL)
+
+
+class Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self):
+        token = self.peek()
+        assert token is not None, 'Unexpected end of spec.'
+        self.position += 1
+        return token
+
+    # Tokens other than strings are values, see parse_expression_tokens.
+    def peek_operator(self):
+        token = self.peek()
+        return token if isinstance(token, str) else None
+
+    def expect(self, expected):
+        token = self.next()
+        assert token == expected, ('Expected', expected, 'but got', token)
+
+    def at_end(self):
+        return self.position == len(self.tokens)
+
+    def parse_expression(self):
+        condition = self.parse_binary(0)
+        if self.peek_operator() == '?':
+            self.next()
+            then_expr = self.parse_expression()
+            self.expect(':')
+            return ('ternary', condition, then_expr, self.parse_expression())
+        return condition
+
+    def parse_binary(self, level):
+        if level == len(BINARY_OPERATORS):
+            return self.parse_unary()
+        lhs = self.parse_binary(level + 1)
+        while self.peek_operator() in BINARY_OPERATORS[level]:
+            op = self.next()
+            lhs = ('binary', op, lhs, self.parse_binary(level + 1))
+        return lhs
+
+    def parse_unary(self):
+        token = self.next()
+        if not isinstance(token, str):
+            return ('value', token)
+        if token in ['!', '-']:
+            return ('unary', token, self.parse_unary())
+        if token == '(':
+            expr = self.parse_expression()
+            self.expect(')')
+            return expr
+        if token.isdigit():
+            return ('num', int(token))
+        if token in ['true', 'false']:
+            return ('bool', token == 'true')
+        assert re.match(r'[A-Za-z_]', token), ('Unexpected token', token)
+        return ('var', token)
+
+    def parse_statement(self):
+        token = self.peek()
+        if token == ';':
+            self.next()
+            return ('block', [])
+        if token == '{':
+            self.next()
+            statements = []
+            while self.peek() != '}':
+                statements.append(self.parse_statement())
+            self.next()
+            return ('block', statements)
+        if token == 'if':
+            self.next()
+            self.expect('(')
+            condition = self.parse_expression()
+            self.expect(')')
+            then_statement = self.parse_statement()
+            else_statement = ('block', [])
+            if self.peek() == 'else':
+                self.next()
+                else_statement = self.parse_statement()
+            return ('if', condition, then_statement, else_statement)
+        if token == 'return':
+            self.next()
+            expr = self.parse_expression()
+            self.expect(';')
+            return ('return', expr)
+        if token == 'int':
+            self.next()
+            variable = self.next()
+            self.expect('=')
+            expr = self.parse_expression()
+            self.expect(';')
+            return ('assign', variable, expr)
+        variable = self.next()
+        op = self.next()
+        assert op in ['=', '+=', '-=', '*='], ('Unexpected token', op)
+        expr = self.parse_expression()
+        self.expect(';')
+        if op != '=':
+            expr = ('binary', op[0], ('var', variable), expr)
+        return ('assign', variable, expr)
+
+
+def parse_expression_tokens(tokens):
+    """Parses an expression from a list of tokens, where tokens other than
+    strings are Python or z3 values."""
+    parser = Parser(tokens)
+    expr = parser.parse_expression()
+    assert parser.at_end(), ('Unexpected trailing input', tokens)
+    return expr
+
+
+def parse_expression(text):
+    return parse_expression_tokens(tokenize(text))
+
+
+def evaluate_expression(expr, variables):
+    """Evaluates a parsed expression, where variables maps variable names to
+    Python or z3 values."""
+    kind = expr[0]
+    if kind in ['num', 'bool', 'value']:
+        return expr[1]
+    if kind == 'var':
+        assert expr[1] in variables, ('Unknown variable', expr[1])
+        return variables[expr[1]]
+    if kind == 'unary':
+        operand = evaluate_expression(expr[2], variables)
+        if expr[1] == '!':
+            return logical_not(operand)
+        return arith('-', 0, operand)
+    if kind == 'ternary':
+        return ite(evaluate_expression(expr[1], variables),
+                   evaluate_expression(expr[2], variables),
+                   evaluate_expression(expr[3], variables))
+    assert kind == 'binary', ('Unexpected expression', expr)
+    (op, lhs, rhs) = expr[1:]
+    lhs = evaluate_expression(lhs, variables)
+    rhs = evaluate_expression(rhs, variables)
+    if op == '&&':
+        return logical_and(lhs, rhs)
+    if op == '||':
+        return logical_or(lhs, rhs)
+    if op in ['+', '-', '*', '/', '%']:
+        return arith(op, lhs, rhs)
+    return compare(op, lhs, rhs)
+
+
+def get_program_body(program_content):
+    """Returns the name of the argument of program() in a spec, and the
+    tokens of its body."""
+    program_content = strip_comments(program_content)
+    match = re.search(
+        r'\bprogram\s*\(\s*\|\s*StateAndPacket\s*\|\s*(\w+)\s*\)\s*\{',
+        program_content)
+    assert match, 'Could not find program() in spec.'
+    # Only tokenize the body, up to the matching closing brace.
+    start = match.end() - 1
+    depth = 0
+    for end in range(start, len(program_content)):
+        if program_content[end] == '{':
+            depth += 1
+        elif program_content[end] == '}':
+            depth -= 1
+            if depth == 0:
+                break
+    return (match.group(1), tokenize(program_content[start:end + 1]))
+
+
+def get_spec_constants(program_content):
+    """Returns the integer literals of program() in a spec, as strings in
+    the order they appear, followed by their negations and the values one
+    below and above them. Synthesis needs these constants more often than
+    not, e.g., 10 for += 10 and 1 or 2 for < 2."""
+    literals = []
+    for token in get_program_body(program_content)[1]:
+        if token.isdigit() and int(token) not in literals:
+            literals.append(int(token))
+    constants = list(literals)
+    for literal in literals:
+        for value in [-literal, literal - 1, literal + 1]:
+            if value not in constants:
+                constants.append(value)
+    return [str(constant) for constant in constants]
+
+
+class Z3Spec:
+    def __init__(self, program_content):
+        # Name of the function argument, state_and_packet in our specs.
+        (self.argument, tokens) = get_program_body(program_content)
+        parser = Parser(tokens)
+        self.body = parser.parse_statement()
+        assert parser.at_end()
+
+    def evaluate(self, state_and_packet):
+        """Runs program() on state_and_packet, a dict from field names to
+        Python or z3 values. Returns a new dict with the fields after the
+        program runs."""
+        self.variables = {self.argument + '.' + field: value
+                          for field, value in state_and_packet.items()}
+        self.path_condition = True
+        self.returned = False
+        self.execute(self.body)
+        prefix = self.argument + '.'
+        return {field: self.variables[prefix + field]
+                for field in state_and_packet}
+
+    def execute(self, statement):
+        kind = statement[0]
+        if kind == 'block':
+            for child in statement[1]:
+                self.execute(child)
+        elif kind == 'if':
+            outer_condition = self.path_condition
+            condition = to_bool(
+                evaluate_expression(statement[1], self.variables))
+            self.path_condition = logical_and(outer_condition, condition)
+            self.execute(statement[2])
+            self.path_condition = logical_and(outer_condition,
+                                              logical_not(condition))
+            self.execute(statement[3])
+            self.path_condition = outer_condition
+        elif kind == 'return':
+            assert statement[1] == ('var', self.argument), \
+                'program() must return ' + self.argument
+            self.returned = logical_or(self.returned, self.path_condition)
+        else:
+            assert kind == 'assign'
+            variable = statement[1]
+            if variable.startswith(self.argument + '.'):
+                assert variable in self.variables, (
+                    'Unknown field', variable)
+            guard = logical_and(self.path_condition,
+                                logical_not(self.returned))
+            self.variables[variable] = ite(
+                guard,
+                to_int(evaluate_expression(statement[2], self.variables)),
+                self.variables.get(variable, 0))
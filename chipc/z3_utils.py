@@ -1,5 +1,6 @@
 import collections
 import re
+import time
 
 import z3
 
@@ -23,8 +24,15 @@ def parse_smt2_file(smt2_filename):
     return formulas[0]
 
 
+def get_bound_variables(formula):
+    """Returns constants of the same names and sorts as the variables bound
+    by a z3.QuantifierRef formula, e.g., z3.Int or z3.BitVec ones."""
+    return [z3.Const(formula.var_name(i), formula.var_sort(i))
+            for i in range(formula.num_vars())]
+
+
 def negated_body(formula):
-    """Given a z3.QuantiferRef formula with z3.Int variables,
+    """Given a z3.QuantiferRef formula with z3.Int or z3.BitVec variables,
     return negation of the body.
 
     Returns:
@@ -32,8 +40,7 @@ def negated_body(formula):
     """
     assert z3.is_quantifier(formula), ('Formula is not a quantifier:\n',
                                        formula)
-    var_names = [formula.var_name(i) for i in range(formula.num_vars())]
-    vs = [z3.Int(n) for n in var_names]
+    vs = get_bound_variables(formula)
 
     # Here simply doing z3.Not(formula.body()) doesn't work. formula.body()
     # returns an expression without any bounded variable, i.e., it refers
@@ -44,39 +51,37 @@ def negated_body(formula):
     return z3.Not(z3.substitute_vars(formula.body(), *reversed(vs)))
 
 
-def generate_counterexamples(formula):
-    """Given a z3 formula generated from a sketch, returns counterexample
-    values for the formula.
-
-    Returns:
-        A tuple of two dicts from string to ints, where the first one
-        represents counterexamples for packet variables and the second for
-        state group variables.
-    """
-    # We negate the body of formula, and check whether the new formula is
-    # satisfiable. If so, we extract the input values and they are
-    # counterexamples for the original formula. Otherwise, the original formula
-    # is satisfiable and there is no counterexample.
-    new_formula = negated_body(formula)
-
-    z3_slv = z3.Solver()
-    # To get counterexamples we need to set proof and unsat_core. Random seed
-    # is set for determinism.
-    z3_slv.set(proof=True, unsat_core=True, random_seed=1)
-    z3_slv.add(new_formula)
-
+def get_conjuncts(formula):
+    """Given a z3.QuantifierRef formula of the form ForAll(vs, Implies(range,
+    And(...))), as built by get_z3_formula, returns the asserts in the And
+    with the variables bound to constants. Returns an empty list for
+    formulas of other shapes."""
+    assert z3.is_quantifier(formula), ('Formula is not a quantifier:\n',
+                                       formula)
+    vs = get_bound_variables(formula)
+    # See negated_body for why variables are substituted in reverse.
+    body = z3.substitute_vars(formula.body(), *reversed(vs))
+    if not z3.is_app_of(body, z3.Z3_OP_IMPLIES):
+        return []
+
+    conjuncts = []
+    # And of nested Ands, e.g., from get_z3_formula, are flattened.
+    pending = [body.arg(1)]
+    while pending:
+        predicate = pending.pop()
+        if z3.is_and(predicate):
+            pending += reversed(predicate.children())
+        elif not z3.is_true(predicate):
+            conjuncts.append(predicate)
+    return conjuncts
+
+
+def _model_to_counterexample(model):
     # Use OrderedDict here for deterministic compilation results. We can also
     # use built-in dict() for Python versions 3.6 and later, as it's inherently
     # ordered.
     pkt_fields = collections.OrderedDict()
     state_vars = collections.OrderedDict()
-
-    result = z3_slv.check()
-    if result != z3.sat:
-        print('Failed to generate counterexamples, z3 returned', result)
-        return (pkt_fields, state_vars)
-
-    model = z3_slv.model()
     for var in model.decls():
         value = model.get_interp(var).as_long()
         match_object = re.match(r'pkt_\d+', var.name())
@@ -89,10 +94,169 @@ def generate_counterexamples(formula):
         if match_object:
             var_name = match_object.group(0)
             state_vars[var_name] = value
-
     return (pkt_fields, state_vars)
 
 
+class CounterexampleGenerator:
+    """Generates counterexamples for z3 formulas with one solver, which is
+    kept across calls, e.g., for all verification iterations of a
+    compilation. Each formula is checked in its own push/pop scope.
+
+    Proofs and unsat cores aren't needed to get a model, so they are only
+    tracked if asked for. Time spent on each formula is kept in check_times.
+
+    If generalize is set, counterexamples are shrunk toward 0 while they
+    still fail, see generalize_model.
+    """
+
+    def __init__(self, proof=False, unsat_core=False, random_seed=1,
+                 generalize=False):
+        self.generalize = generalize
+        self.solver = z3.Solver()
+        # Random seed is set for determinism.
+        self.solver.set(random_seed=random_seed)
+        if proof:
+            self.solver.set(proof=True)
+        if unsat_core:
+            self.solver.set(unsat_core=True)
+        # Seconds spent in solver.check() for each formula.
+        self.check_times = []
+
+    @property
+    def total_check_time(self):
+        return sum(self.check_times)
+
+    def check(self):
+        start = time.perf_counter()
+        result = self.solver.check()
+        self.check_times[-1] += time.perf_counter() - start
+        return result
+
+    def generalize_model(self, variables, model):
+        """Returns a model of the formula in the solver, i.e., a
+        counterexample, where each variable in turn is as close to 0 as it
+        can be with the others fixed.
+
+        Values that can be 0 play no part in the failure, and values of test
+        cases go to the constant set, so small values keep both the test
+        cases and the constant set small."""
+        values = [model.eval(var, model_completion=True).as_long()
+                  for var in variables]
+        for (i, var) in enumerate(variables):
+            others = [other == value for (j, (other, value)) in
+                      enumerate(zip(variables, values)) if j != i]
+            # Bounds 0, 1, 3, 7, ... take a check per bit of the value.
+            bound = 0
+            while bound < abs(values[i]):
+                self.solver.push()
+                self.solver.add(others + [var >= -bound, var <= bound])
+                value = None
+                if self.check() == z3.sat:
+                    value = self.solver.model().eval(
+                        var, model_completion=True).as_long()
+                self.solver.pop()
+                if value is not None:
+                    values[i] = value
+                    break
+                bound = 2 * bound + 1
+
+        self.solver.push()
+        self.solver.add([var == value
+                         for (var, value) in zip(variables, values)])
+        result = self.check()
+        assert result == z3.sat, result
+        model = self.solver.model()
+        self.solver.pop()
+        return model
+
+    def get_model(self, variables):
+        """Returns the model of the last check, generalized if asked for.
+        Generalization keeps to the constraints in the solver, so it has to
+        run in the same scope as the check."""
+        model = self.solver.model()
+        if self.generalize:
+            model = self.generalize_model(variables, model)
+        return model
+
+    def generate(self, formula):
+        """Given a z3 formula generated from a sketch, returns counterexample
+        values for the formula.
+
+        Returns:
+            A tuple of two dicts from string to ints, where the first one
+            represents counterexamples for packet variables and the second
+            for state group variables.
+        """
+        counterexamples = self.generate_all(formula, 1)
+        if not counterexamples:
+            return (collections.OrderedDict(), collections.OrderedDict())
+        return counterexamples[0]
+
+    def generate_all(self, formula, num_counterexamples):
+        """Same as generate, but returns a list of up to num_counterexamples
+        distinct counterexamples, which is empty if there is none.
+
+        Each next counterexample is asked to fail an assert of the formula,
+        e.g., on an output field, that none of the previous ones failed, if
+        there's any such counterexample.
+        """
+        # We negate the body of formula, and check whether the new formula
+        # is satisfiable. If so, we extract the input values and they are
+        # counterexamples for the original formula. Otherwise, the original
+        # formula is satisfiable and there is no counterexample.
+        new_formula = negated_body(formula)
+        variables = get_bound_variables(formula)
+        unbroken_asserts = get_conjuncts(formula) \
+            if num_counterexamples > 1 else []
+
+        counterexamples = []
+        self.check_times.append(0)
+        self.solver.push()
+        try:
+            self.solver.add(new_formula)
+            while len(counterexamples) < num_counterexamples:
+                model = None
+                if counterexamples and unbroken_asserts:
+                    self.solver.push()
+                    self.solver.add(z3.Or([z3.Not(predicate) for predicate
+                                           in unbroken_asserts]))
+                    if self.check() == z3.sat:
+                        model = self.get_model(variables)
+                    self.solver.pop()
+                if model is None:
+                    result = self.check()
+                    if result != z3.sat:
+                        if not counterexamples:
+                            print('Failed to generate counterexamples, z3 '
+                                  'returned', result)
+                        break
+                    model = self.get_model(variables)
+
+                counterexamples.append(_model_to_counterexample(model))
+                values = [model.eval(var, model_completion=True)
+                          for var in variables]
+                # Block the same, possibly generalized, inputs from coming
+                # back.
+                self.solver.add(z3.Or([z3.BoolVal(False)] + [
+                    var != value for (var, value) in zip(variables, values)]))
+                unbroken_asserts = [
+                    predicate for predicate in unbroken_asserts
+                    if not z3.is_false(model.eval(predicate,
+                                                  model_completion=True))]
+        finally:
+            self.solver.pop()
+
+        return counterexamples
+
+
+def generate_counterexamples(formula, proof=False, unsat_core=False):
+    """Given a z3 formula generated from a sketch, returns counterexample
+    values for the formula with a new solver. See
+    CounterexampleGenerator.generate.
+    """
+    return CounterexampleGenerator(proof, unsat_core).generate(formula)
+
+
 def check_sort(z3_var):
     assert (z3.is_bool(z3_var) or z3.is_int(z3_var)),\
         str(z3_var) + ' has unsupported type ' + str(type(z3_var))
@@ -114,134 +278,513 @@ def make_bool(z3_var):
         return z3_var
 
 
-def get_z3_formula(sketch_ir: str, input_bits: int) -> z3.QuantifierRef:
-    """Given an intermediate representation of a sketch file and returns a z3
-    formula corresponding to that IR with the specified input bits for source
-    variables."""
+# Helpers below build z3 expressions from values that are either Python
+# ints/bools or z3 expressions. Operations on Python values are folded right
+# away, so that hole values known ahead of time don't end up in the formula.
+def is_concrete(value):
+    return not z3.is_expr(value)
+
+
+def to_int(value):
+    if isinstance(value, bool):
+        return int(value)
+    if is_concrete(value):
+        return value
+    check_sort(value)
+    return make_int(value)
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if is_concrete(value):
+        # Same conversion as make_bool.
+        return value > 0
+    check_sort(value)
+    return make_bool(value)
+
+
+def to_z3(value):
+    if isinstance(value, bool):
+        return z3.BoolVal(value)
+    if is_concrete(value):
+        return z3.IntVal(value)
+    return value
+
+
+def is_bool_value(value):
+    return isinstance(value, bool) or z3.is_bool(value)
+
+
+def ite(condition, then_value, else_value):
+    condition = to_bool(condition)
+    if is_concrete(condition):
+        return then_value if condition else else_value
+    if is_concrete(then_value) and is_concrete(else_value):
+        if is_bool_value(then_value) == is_bool_value(else_value) and \
+                then_value == else_value:
+            return then_value
+    elif not is_concrete(then_value) and not is_concrete(else_value):
+        if then_value.eq(else_value):
+            return then_value
+    if not (is_bool_value(then_value) and is_bool_value(else_value)):
+        then_value = to_int(then_value)
+        else_value = to_int(else_value)
+    return z3.If(condition, to_z3(then_value), to_z3(else_value))
+
+
+def logical_not(value):
+    value = to_bool(value)
+    if is_concrete(value):
+        return not value
+    return z3.Not(value)
+
+
+def logical_and(lhs, rhs):
+    lhs = to_bool(lhs)
+    rhs = to_bool(rhs)
+    if is_concrete(lhs):
+        return rhs if lhs else False
+    if is_concrete(rhs):
+        return lhs if rhs else False
+    return z3.And(lhs, rhs)
+
+
+def logical_or(lhs, rhs):
+    lhs = to_bool(lhs)
+    rhs = to_bool(rhs)
+    if is_concrete(lhs):
+        return True if lhs else rhs
+    if is_concrete(rhs):
+        return True if rhs else lhs
+    return z3.Or(lhs, rhs)
+
+
+def arith(op, lhs, rhs):
+    lhs = to_int(lhs)
+    rhs = to_int(rhs)
+    if op == '+':
+        return lhs + rhs
+    if op == '-':
+        return lhs - rhs
+    if op == '*':
+        return lhs * rhs
+    # Division and modulo follow z3's semantics for integers, same as DIV and
+    # MOD nodes in get_z3_formula.
+    assert op in ['/', '%'], ('Unsupported operator', op)
+    if op == '/':
+        result = z3.simplify(to_z3(lhs) / to_z3(rhs))
+    else:
+        result = z3.simplify(to_z3(lhs) % to_z3(rhs))
+    if z3.is_int_value(result):
+        return result.as_long()
+    return result
+
+
+def compare(op, lhs, rhs):
+    if op in ['==', '!='] and is_bool_value(lhs) and is_bool_value(rhs):
+        if is_concrete(lhs) and is_concrete(rhs):
+            return (lhs == rhs) == (op == '==')
+        if op == '==':
+            return to_z3(lhs) == to_z3(rhs)
+        return to_z3(lhs) != to_z3(rhs)
+    lhs = to_int(lhs)
+    rhs = to_int(rhs)
+    if op == '==':
+        result = lhs == rhs
+    elif op == '!=':
+        result = lhs != rhs
+    elif op == '<':
+        result = lhs < rhs
+    elif op == '>':
+        result = lhs > rhs
+    elif op == '<=':
+        result = lhs <= rhs
+    else:
+        assert op == '>=', ('Unsupported operator', op)
+        result = lhs >= rhs
+    return result
+
+
+def select(ctrl, values):
+    """Returns values[ctrl], or the last value if ctrl is out of range, the
+    same way muxes pick operands in the generated sketch."""
+    if is_concrete(ctrl):
+        return values[ctrl] if 0 <= ctrl < len(values) else values[-1]
+    result = values[-1]
+    for i in reversed(range(len(values) - 1)):
+        result = ite(compare('==', ctrl, i), values[i], result)
+    return result
+
+
+# Handlers below return the z3 expression of a node from records of its line,
+# together with whether the expression is a bool, otherwise it's an int.
+# Operands are built with the z3 C API, as sorts of all nodes are already
+# known and the checks and coercions of the Python API take most of the time
+# for large DAGs.
+def _dag_source(parser, records):
+    var_type = records[3]
+    source_name = records[4]
+    assert var_type == 'INT', ('Unexpected variable type found in sketch IR:',
+                               records)
+    parser.sources.append(z3.Int(source_name))
+    return (parser.sources[-1], False)
+
+
+def _dag_const(parser, records):
+    var_type = records[3]
+    if var_type == 'INT':
+        return (z3.IntVal(int(records[4])), False)
+    assert var_type == 'BOOL', ('Constant type', var_type, 'not supported')
+    assert records[4] in ['0', '1']
+    return (z3.BoolVal(records[4] == '1'), True)
+
+
+# One can consider ARRACC and ARRASS as array access and assignment. For more
+# details please refer this sketchusers mailing list thread.
+# https://lists.csail.mit.edu/pipermail/sketchusers/2019-August/000104.html
+def _dag_arracc(parser, records):
+    return parser.make_if(parser.bool_operand(records[4]), records[7],
+                          records[6])
+
+
+def _dag_arrass(parser, records):
+    variable = parser.operand(records[4])
+    if parser.is_bool[int(records[4])]:
+        assert records[6] in ['0', '1']
+        cmp_constant = z3.BoolVal(records[6] == '1')
+    else:
+        cmp_constant = z3.IntVal(int(records[6]))
+    predicate = parser.make(z3.Z3_mk_eq, True, variable, cmp_constant)
+    return parser.make_if(predicate, records[8], records[7])
+
+
+def _dag_op(make_ast, bool_operands, bool_result, num_operands=2):
+    def handler(parser, records):
+        get_operand = (parser.bool_operand if bool_operands else
+                       parser.int_operand)
+        operands = [get_operand(operand)
+                    for operand in records[4:4 + num_operands]]
+        return (parser.make(make_ast, bool_result, *operands), bool_result)
+    return handler
 
-    z3_vars = collections.OrderedDict()
-    z3_asserts = []
-    z3_srcs = []
-    for line in sketch_ir.splitlines():
+
+# Wraps z3 C API functions, which take an array of operands, e.g., Z3_mk_add,
+# into functions of two operands.
+def _dag_nary(make_ast):
+    def make_binary_ast(ctx, a, b):
+        return make_ast(ctx, 2, (z3.Ast * 2)(a, b))
+    return make_binary_ast
+
+
+class SketchDagParser:
+    """Builds z3 expressions from the nodes of a Sketch DAG (.dag file), one
+    line at a time.
+
+    Nodes are kept in lists indexed by their ids. Nodes with the same
+    operation on the same operands, which Sketch emits for, e.g., identical
+    ALUs, share one z3 expression.
+    """
+
+    HANDLERS = {
+        'S': _dag_source,
+        'CONST': _dag_const,
+        'ARRACC': _dag_arracc,
+        'ARRASS': _dag_arrass,
+        'NEG': _dag_op(z3.Z3_mk_unary_minus, False, False, 1),
+        'NOT': _dag_op(z3.Z3_mk_not, True, True, 1),
+        'AND': _dag_op(_dag_nary(z3.Z3_mk_and), True, True),
+        'OR': _dag_op(_dag_nary(z3.Z3_mk_or), True, True),
+        'XOR': _dag_op(z3.Z3_mk_xor, True, True),
+        'PLUS': _dag_op(_dag_nary(z3.Z3_mk_add), False, False),
+        'TIMES': _dag_op(_dag_nary(z3.Z3_mk_mul), False, False),
+        'DIV': _dag_op(z3.Z3_mk_div, False, False),
+        'MOD': _dag_op(z3.Z3_mk_mod, False, False),
+        'LT': _dag_op(z3.Z3_mk_lt, False, True),
+        'EQ': _dag_op(z3.Z3_mk_eq, False, True),
+    }
+
+    # Positions of operand ids in the records of each operation, which are
+    # replaced by ids of identical nodes when looking for shared subterms.
+    OPERAND_POSITIONS = dict(
+        {'CONST': (), 'NEG': (4,), 'NOT': (4,), 'ARRACC': (4, 6, 7),
+         'ARRASS': (4, 7, 8)},
+        **{operation: (4, 5) for operation in [
+            'AND', 'OR', 'XOR', 'PLUS', 'TIMES', 'DIV', 'MOD', 'LT', 'EQ']})
+
+    def __init__(self):
+        self.ctx = z3.main_ctx()
+        # z3 expression of each node, indexed by node id.
+        self.nodes = []
+        # Whether each node is a bool, otherwise it's an int.
+        self.is_bool = []
+        # Id of the first node with the same operation and operands as each
+        # node.
+        self.canonical_ids = []
+        # From operation and canonical operand ids to the node id.
+        self.node_ids = {}
+        # Nodes converted to the other sort, see make_int and make_bool.
+        self.conversions = {}
+        self.sources = []
+        self.asserts = []
+
+    def make(self, make_ast, is_bool, *operands):
+        ast = make_ast(self.ctx.ref(),
+                       *[operand.as_ast() for operand in operands])
+        if is_bool:
+            return z3.BoolRef(ast, self.ctx)
+        return z3.ArithRef(ast, self.ctx)
+
+    def make_if(self, predicate, yes_id, no_id):
+        # Same as z3.If, a bool branch is converted to an int if the other
+        # one is an int.
+        is_bool = self.is_bool[int(yes_id)] and self.is_bool[int(no_id)]
+        get_operand = self.bool_operand if is_bool else self.int_operand
+        return (self.make(z3.Z3_mk_ite, is_bool, predicate,
+                          get_operand(yes_id), get_operand(no_id)), is_bool)
+
+    def operand(self, node_id):
+        return self.nodes[int(node_id)]
+
+    def int_operand(self, node_id):
+        node_id = int(node_id)
+        if not self.is_bool[node_id]:
+            return self.nodes[node_id]
+        if node_id not in self.conversions:
+            self.conversions[node_id] = make_int(self.nodes[node_id])
+        return self.conversions[node_id]
+
+    def bool_operand(self, node_id):
+        node_id = int(node_id)
+        if self.is_bool[node_id]:
+            return self.nodes[node_id]
+        if node_id not in self.conversions:
+            self.conversions[node_id] = make_bool(self.nodes[node_id])
+        return self.conversions[node_id]
+
+    def set_node(self, node_id, expr, is_bool, canonical_id):
+        if node_id >= len(self.nodes):
+            padding = node_id + 1 - len(self.nodes)
+            self.nodes += [None] * padding
+            self.is_bool += [None] * padding
+            self.canonical_ids += [None] * padding
+        self.nodes[node_id] = expr
+        self.is_bool[node_id] = is_bool
+        self.canonical_ids[node_id] = canonical_id
+
+    def parse_line(self, line):
         records = line.split()
-        start = records[0]
-        if (start in ['dag', 'TUPLE_DEF']):
-            continue
-        else:
-            # common processing across all nodes
-            output_var = '_n' + records[0]
-            operation = records[2]
-            if operation in ['NEG', 'NOT']:
-                operand1 = z3_vars['_n' + records[4]]
-                check_sort(operand1)
-            elif operation in ['AND', 'OR', 'XOR', 'PLUS',
-                               'TIMES', 'DIV', 'MOD', 'LT',
-                               'EQ']:
-                operand1 = z3_vars['_n' + records[4]]
-                operand2 = z3_vars['_n' + records[5]]
-                check_sort(operand1)
-                check_sort(operand2)
-
-            # node-specific processing
-            if operation == 'ASSERT':
-                z3_asserts += ['_n' + records[3]]
-            elif operation == 'S':
-                var_type = records[3]
-                source_name = records[4]
-                assert var_type == 'INT', ('Unexpected variable type found in \
-                        sketch IR:', line)
-                z3_vars[source_name] = z3.Int(source_name)
-                z3_vars[output_var] = z3.Int(source_name)
-                z3_srcs += [source_name]
-            elif operation in ['NEG']:
-                z3_vars[output_var] = -make_int(operand1)
-            elif operation in ['NOT']:
-                z3_vars[output_var] = z3.Not(make_bool(operand1))
-            elif operation in [
-                    'AND', 'OR', 'XOR', 'PLUS', 'TIMES', 'DIV', 'MOD', 'LT',
-                    'EQ'
-            ]:
-                if operation == 'AND':
-                    z3_vars[output_var] = z3.And(
-                        make_bool(operand1), make_bool(operand2))
-                elif operation == 'OR':
-                    z3_vars[output_var] = z3.Or(
-                        make_bool(operand1), make_bool(operand2))
-                elif operation == 'XOR':
-                    z3_vars[output_var] = z3.Xor(
-                        make_bool(operand1), make_bool(operand2))
-                elif operation == 'PLUS':
-                    z3_vars[output_var] = make_int(
-                        operand1) + make_int(operand2)
-                elif operation == 'TIMES':
-                    z3_vars[output_var] = make_int(
-                        operand1) * make_int(operand2)
-                elif operation == 'DIV':
-                    z3_vars[output_var] = make_int(
-                        operand1) / make_int(operand2)
-                elif operation == 'MOD':
-                    z3_vars[output_var] = make_int(
-                        operand1) % make_int(operand2)
-                elif operation == 'LT':
-                    z3_vars[output_var] = make_int(
-                        operand1) < make_int(operand2)
-                elif operation == 'EQ':
-                    z3_vars[output_var] = make_int(
-                        operand1) == make_int(operand2)
-                else:
-                    assert False, ('Invalid operation', operation)
-            # One can consider ARRACC and ARRASS as array access and
-            # assignment. For more details please refer this sketchusers
-            # mailing list thread.
-            # https://lists.csail.mit.edu/pipermail/sketchusers/2019-August/000104.html
-            elif operation in ['ARRACC']:
-                predicate = make_bool((z3_vars['_n' + records[4]]))
-                yes_val = z3_vars['_n' + records[7]]
-                no_val = z3_vars['_n' + records[6]]
-                z3_vars[output_var] = z3.If(predicate, yes_val, no_val)
-            elif operation in ['ARRASS']:
-                var_type = type(z3_vars['_n' + records[4]])
-                if var_type == z3.BoolRef:
-                    assert records[6] in ['0', '1']
-                    cmp_constant = records[6] == '1'
-                elif var_type == z3.ArithRef:
-                    cmp_constant = int(records[6])
-                else:
-                    assert False, ('Variable type', var_type, 'not supported')
-                predicate = z3_vars['_n' + records[4]] == cmp_constant
-                yes_val = z3_vars['_n' + records[8]]
-                no_val = z3_vars['_n' + records[7]]
-                z3_vars[output_var] = z3.If(predicate, yes_val, no_val)
-            elif operation in ['CONST']:
-                var_type = records[3]
-                if var_type == 'INT':
-                    z3_vars[output_var] = z3.IntVal(int(records[4]))
-                elif var_type == 'BOOL':
-                    assert records[4] in ['0', '1']
-                    z3_vars[output_var] = z3.BoolVal(records[4] == '1')
-                else:
-                    assert False, ('Constant type', var_type, 'not supported')
-            else:
-                assert False, ('Unknown operation:', line)
-
-    # To handle cases where we don't have any assert or source variable, add
-    # a dummy bool variable.
-    constraints = z3.BoolVal(True)
-    for var in z3_asserts:
-        constraints = z3.And(constraints, z3_vars[var])
-
-    variable_range = z3.BoolVal(True)
-    for var in z3_srcs:
+        if not records or records[0] in ['dag', 'TUPLE_DEF']:
+            return
+        node_id = int(records[0])
+        operation = records[2]
+
+        if operation == 'ASSERT':
+            self.asserts.append(self.operand(records[3]))
+            return
+
+        handler = self.HANDLERS.get(operation)
+        assert handler is not None, ('Unknown operation:', line)
+        if operation != 'S':
+            key = records[2:]
+            for position in self.OPERAND_POSITIONS[operation]:
+                key[position - 2] = self.canonical_ids[int(records[position])]
+            key = tuple(key)
+            same_id = self.node_ids.get(key)
+            if same_id is not None:
+                self.set_node(node_id, self.nodes[same_id],
+                              self.is_bool[same_id], same_id)
+                return
+            self.node_ids[key] = node_id
+
+        (expr, is_bool) = handler(self, records)
+        self.set_node(node_id, expr, is_bool, node_id)
+
+    def parse(self, lines):
+        for line in lines:
+            self.parse_line(line)
+        return self
+
+    def in_input_range(self, var, input_bits):
+        return z3.And(0 <= var, var < 2**input_bits)
+
+    def get_formula(self, input_bits):
+        """Returns the formula for all asserts in the DAG, with the specified
+        input bits for source variables."""
+        # To handle cases where we don't have any assert or source variable,
+        # add a dummy bool variable.
+        constraints = z3.And([z3.BoolVal(True)] + self.asserts)
         variable_range = z3.And(
-            variable_range,
-            z3.And(0 <= z3_vars[var], z3_vars[var] < 2**input_bits))
-
-    final_assert = z3.ForAll([z3_vars[x] for x in z3_srcs],
-                             z3.Implies(variable_range, constraints))
-    # We could use z3.simplify on the final assert, however that could result
-    # in a formula that is oversimplified and doesn't have a QuantfierRef which
-    # is expected from the negated_body() function above.
-    return final_assert
+            [z3.BoolVal(True)] +
+            [self.in_input_range(var, input_bits) for var in self.sources])
+
+        # We could use z3.simplify on the final assert, however that could
+        # result in a formula that is oversimplified and doesn't have a
+        # QuantfierRef which is expected from the negated_body() function
+        # above.
+        return z3.ForAll(self.sources,
+                         z3.Implies(variable_range, constraints))
+
+
+def get_signed_width(value):
+    """Returns the number of bits of value as a signed bit-vector."""
+    return (value if value >= 0 else -value - 1).bit_length() + 1
+
+
+def euclidean_remainder(lhs, rhs):
+    # Remainder of z3's integer division, which is never negative, from the
+    # bit-vector one, which has the sign of lhs.
+    remainder = z3.SRem(lhs, rhs)
+    return z3.If(remainder < 0, remainder + z3.If(rhs < 0, -rhs, rhs),
+                 remainder)
+
+
+def euclidean_quotient(lhs, rhs):
+    # lhs minus the remainder is a multiple of rhs, so any rounding works.
+    return (lhs - euclidean_remainder(lhs, rhs)) / rhs
+
+
+def _bv_source(parser, records):
+    assert records[3] == 'INT', (
+        'Unexpected variable type found in sketch IR:', records)
+    parser.sources.append(z3.BitVec(
+        records[4], parser.get_width(parser.input_bits + 1)))
+    return (parser.sources[-1], False)
+
+
+def _bv_const(parser, records):
+    if records[3] != 'INT':
+        return _dag_const(parser, records)
+    return (parser.make_constant(int(records[4])), False)
+
+
+def _bv_arrass(parser, records):
+    if parser.is_bool[int(records[4])]:
+        return _dag_arrass(parser, records)
+    (variable, cmp_constant) = parser.widen(
+        [parser.int_operand(records[4]),
+         parser.make_constant(int(records[6]))])
+    return parser.make_if(variable == cmp_constant, records[8], records[7])
+
+
+def _bv_op(make_expr, get_extra_bits, bool_result=False, num_operands=2):
+    """Returns a handler that applies make_expr to int operands, widened to
+    the widest of them plus get_extra_bits of their widths."""
+    def handler(parser, records):
+        operands = [parser.int_operand(operand)
+                    for operand in records[4:4 + num_operands]]
+        extra_bits = get_extra_bits([operand.size() for operand in operands])
+        return (make_expr(*parser.widen(operands, extra_bits)), bool_result)
+    return handler
+
+
+class BitVecDagParser(SketchDagParser):
+    """Same as SketchDagParser, but builds z3 bit-vector expressions instead
+    of integer ones, which z3 bit-blasts rather than solving as nonlinear
+    integer arithmetic once TIMES, DIV or MOD show up.
+
+    If bit_width is None, every node is wide enough for all of its values,
+    so nothing overflows and formulas are equivalent to integer ones.
+    Otherwise all ints are bit_width wide and wrap around, e.g., at 32 bits
+    like registers of Tofino. Division and modulo are Euclidean in both
+    cases, like z3's for integers, except that dividing by zero has the
+    fixed result of bit-vector division.
+    """
+
+    HANDLERS = dict(SketchDagParser.HANDLERS, **{
+        'S': _bv_source,
+        'CONST': _bv_const,
+        'ARRASS': _bv_arrass,
+        'NEG': _bv_op(lambda operand: -operand, lambda widths: 1,
+                      num_operands=1),
+        'PLUS': _bv_op(lambda lhs, rhs: lhs + rhs, lambda widths: 1),
+        'TIMES': _bv_op(lambda lhs, rhs: lhs * rhs, min),
+        'DIV': _bv_op(euclidean_quotient, lambda widths: 1),
+        'MOD': _bv_op(euclidean_remainder, lambda widths: 1),
+        'LT': _bv_op(lambda lhs, rhs: lhs < rhs, lambda widths: 0, True),
+        'EQ': _bv_op(lambda lhs, rhs: lhs == rhs, lambda widths: 0, True),
+    })
+
+    def __init__(self, input_bits, bit_width=None):
+        super().__init__()
+        # Sources need a bit more than input_bits, as ints are signed.
+        assert bit_width is None or bit_width > input_bits, (
+            'Bit width', bit_width, 'is too small for input bits', input_bits)
+        self.input_bits = input_bits
+        self.bit_width = bit_width
+
+    def get_width(self, width):
+        """Returns the width of a node that needs width bits."""
+        return width if self.bit_width is None else self.bit_width
+
+    def make_constant(self, value):
+        return z3.BitVecVal(value, self.get_width(get_signed_width(value)))
+
+    def widen(self, operands, extra_bits=0):
+        """Sign extends operands to the width of the widest of them plus
+        extra_bits."""
+        width = self.get_width(
+            max(operand.size() for operand in operands) + extra_bits)
+        return [z3.SignExt(width - operand.size(), operand)
+                if operand.size() < width else operand
+                for operand in operands]
+
+    def make_if(self, predicate, yes_id, no_id):
+        if self.is_bool[int(yes_id)] and self.is_bool[int(no_id)]:
+            return (z3.If(predicate, self.operand(yes_id),
+                          self.operand(no_id)), True)
+        (yes, no) = self.widen([self.int_operand(yes_id),
+                                self.int_operand(no_id)])
+        return (z3.If(predicate, yes, no), False)
+
+    def int_operand(self, node_id):
+        node_id = int(node_id)
+        if not self.is_bool[node_id]:
+            return self.nodes[node_id]
+        if node_id not in self.conversions:
+            width = self.get_width(2)
+            self.conversions[node_id] = z3.If(self.nodes[node_id],
+                                              z3.BitVecVal(1, width),
+                                              z3.BitVecVal(0, width))
+        return self.conversions[node_id]
+
+    def bool_operand(self, node_id):
+        node_id = int(node_id)
+        if self.is_bool[node_id]:
+            return self.nodes[node_id]
+        if node_id not in self.conversions:
+            # Same conversion as make_bool, > is signed for bit-vectors.
+            self.conversions[node_id] = self.nodes[node_id] > 0
+        return self.conversions[node_id]
+
+    def in_input_range(self, var, input_bits):
+        return z3.ULT(var, 2**input_bits)
+
+
+def make_dag_parser(input_bits, bit_vector=False, bit_width=None):
+    if bit_vector:
+        return BitVecDagParser(input_bits, bit_width)
+    return SketchDagParser()
+
+
+def get_z3_formula(sketch_ir: str, input_bits: int, bit_vector=False,
+                   bit_width=None) -> z3.QuantifierRef:
+    """Given an intermediate representation of a sketch file and returns a z3
+    formula corresponding to that IR with the specified input bits for source
+    variables. Ints are z3.Int, or z3.BitVec if bit_vector is set, see
+    BitVecDagParser for bit_width."""
+    return make_dag_parser(input_bits, bit_vector, bit_width).parse(
+        sketch_ir.splitlines()).get_formula(input_bits)
+
+
+def get_z3_formula_from_dag_file(dag_filename: str, input_bits: int,
+                                 bit_vector=False,
+                                 bit_width=None) -> z3.QuantifierRef:
+    """Same as get_z3_formula, but reads the IR from a .dag file line by
+    line."""
+    with open(dag_filename) as dag_file:
+        return make_dag_parser(input_bits, bit_vector, bit_width).parse(
+            dag_file).get_formula(input_bits)
 
 
 def simple_check(smt2_filename):
@@ -0,0 +1,247 @@
+from collections import OrderedDict
+from pathlib import Path
+
+import z3
+
+from chipc.alu_parse_cache import get_alu_parse_tree
+from chipc.z3_alu_visitor import Z3StatefulAluVisitor
+from chipc.z3_alu_visitor import Z3StatelessAluVisitor
+from chipc.z3_spec import evaluate_expression
+from chipc.z3_spec import parse_expression
+from chipc.z3_spec import Z3Spec
+from chipc.z3_utils import compare
+from chipc.z3_utils import ite
+from chipc.z3_utils import logical_and
+from chipc.z3_utils import logical_or
+from chipc.z3_utils import select
+from chipc.z3_utils import to_bool
+from chipc.z3_utils import to_z3
+
+
+class Z3Verifier:
+    """Builds the z3 formula of a VERIFY mode sketch directly from the ALU
+    parse trees, the spec and hole value assignments, without running Sketch.
+
+    The formula has the same shape as the one z3_utils.get_z3_formula builds
+    from a Sketch IR, so it can be passed to generate_counterexamples.
+    pipeline() mirrors router_data_path_sketch.j2 and get_z3_formula() the
+    harness in code_generator.j2; changes to either template need to be
+    reflected here.
+    """
+
+    def __init__(self, sketch_code_generator, spec_filename):
+        self.sketch_code_generator = sketch_code_generator
+        self.spec = Z3Spec(Path(spec_filename).read_text())
+        # Parsed predicates of hole constraints, keyed by their text.
+        self.parsed_constraints = {}
+
+    def get_constraints(self, holes):
+        constraints = []
+        for predicate in self.sketch_code_generator.constraints_:
+            if predicate not in self.parsed_constraints:
+                self.parsed_constraints[predicate] = parse_expression(
+                    predicate)
+            constraints.append(to_bool(evaluate_expression(
+                self.parsed_constraints[predicate], holes)))
+        return constraints
+
+    def get_source_names(self):
+        generator = self.sketch_code_generator
+        names = ['pkt_' + str(i) for i in range(generator.num_fields_in_prog_)]
+        for i in range(generator.num_state_groups_):
+            for j in range(generator.num_state_slots_):
+                names.append('state_group_' + str(i) + '_state_' + str(j))
+        return names
+
+    def pipeline(self, state_and_packet, holes, constant_vector, asserts):
+        """Returns fields of state_and_packet after going through the
+        pipeline, given a dict from hole names to values. Predicates asserted
+        along the way are appended to asserts."""
+        generator = self.sketch_code_generator
+        sketch_name = generator.sketch_name_
+        num_containers = generator.num_phv_containers_
+        num_state_slots = generator.num_state_slots_
+        state_and_packet = OrderedDict(state_and_packet)
+        stateless_tree = get_alu_parse_tree(generator.stateless_alu_filename_)
+        stateful_tree = get_alu_parse_tree(generator.stateful_alu_filename_)
+
+        def is_set(hole):
+            return compare('==', holes[hole], 1)
+
+        def state_group_fields(group):
+            return ['state_group_' + str(group) + '_state_' + str(slot)
+                    for slot in range(num_state_slots)]
+
+        asserts += self.get_constraints(holes)
+
+        if generator.synthesized_allocation_:
+            num_stateful_alus = num_containers
+        else:
+            num_stateful_alus = generator.num_state_groups_
+
+        inputs = [0] * num_containers
+        outputs = []
+        for stage in range(generator.num_pipeline_stages_):
+            stage_prefix = sketch_name + '_'
+            stage_suffix = str(stage) + '_'
+            if stage == 0:
+                for idx, field in enumerate(generator.input_packet_fields_):
+                    value = state_and_packet['pkt_' + str(field)]
+                    if generator.synthesized_allocation_:
+                        for container in range(num_containers):
+                            inputs[container] = ite(
+                                is_set('phv_config_' + str(field) + '_' +
+                                       str(container)),
+                                value, inputs[container])
+                    else:
+                        inputs[idx] = value
+            else:
+                inputs = outputs
+
+            destinations = []
+            for alu in range(generator.num_alus_per_stage_):
+                visitor = Z3StatelessAluVisitor(
+                    stage_prefix + 'stateless_alu_' + stage_suffix + str(alu),
+                    inputs, holes, constant_vector)
+                visitor.visit(stateless_tree)
+                asserts += visitor.asserts
+                destinations.append(visitor.return_value)
+
+            state_operands = []
+            for salu in range(num_stateful_alus):
+                state_operands.append([0] * num_state_slots)
+            for group in range(generator.num_state_groups_):
+                values = [state_and_packet[field]
+                          for field in state_group_fields(group)]
+                if generator.synthesized_allocation_:
+                    for container in range(num_containers):
+                        allocated = is_set(
+                            stage_prefix + 'salu_config_' + str(group) + '_' +
+                            stage_suffix + str(container))
+                        state_operands[container] = [
+                            ite(allocated, value, operand) for
+                            (value, operand) in
+                            zip(values, state_operands[container])]
+                else:
+                    allocated = is_set(stage_prefix + 'salu_config_' +
+                                       stage_suffix + str(group))
+                    state_operands[group] = [
+                        ite(allocated, value, operand) for (value, operand)
+                        in zip(values, state_operands[group])]
+
+            returned_states = []
+            for salu in range(num_stateful_alus):
+                alu_name = stage_prefix + 'stateful_alu_' + stage_suffix + \
+                    str(salu)
+                packet_operands = [
+                    select(holes[alu_name + '_operand_mux_' + str(k) +
+                                 '_ctrl'], inputs)
+                    for k in range(generator.num_operands_to_stateful_alu_)]
+                visitor = Z3StatefulAluVisitor(
+                    alu_name, state_operands[salu], packet_operands, holes,
+                    constant_vector)
+                visitor.visit(stateful_tree)
+                asserts += visitor.asserts
+                state_operands[salu] = visitor.state_group
+                returned_states.append(visitor.return_value)
+
+            outputs = []
+            for container in range(num_containers):
+                if generator.target_tofino_:
+                    conditions = [is_set(
+                        stage_prefix + 'stateless_alu_' + stage_suffix +
+                        str(container) + '_demux_ctrl')]
+                    values = [destinations[container]]
+                    for group in range(generator.num_state_groups_):
+                        conditions.append(logical_and(
+                            compare('==', holes[
+                                stage_prefix + 'stateful_alu_' +
+                                stage_suffix + str(group) + '_demux_ctrl'],
+                                container),
+                            is_set(stage_prefix + 'salu_config_' +
+                                   stage_suffix + str(group))))
+                        values.append(returned_states[group])
+                    # The output is never assigned if no condition holds,
+                    # which is asserted against.
+                    output = 0
+                    for (condition, value) in reversed(list(
+                            zip(conditions, values))):
+                        output = ite(condition, value, output)
+                    any_condition = False
+                    for condition in conditions:
+                        any_condition = logical_or(any_condition, condition)
+                    asserts.append(any_condition)
+                else:
+                    mux_inputs = []
+                    for returned_state in returned_states:
+                        mux_inputs += [returned_state] * num_state_slots
+                    mux_inputs.append(destinations[container])
+                    output = select(
+                        holes[stage_prefix + 'output_mux_phv_' +
+                              stage_suffix + str(container) + '_ctrl'],
+                        mux_inputs)
+                outputs.append(output)
+
+            for group in range(generator.num_state_groups_):
+                fields = state_group_fields(group)
+                if generator.synthesized_allocation_:
+                    for container in range(num_containers):
+                        allocated = is_set(
+                            stage_prefix + 'salu_config_' + str(group) + '_' +
+                            stage_suffix + str(container))
+                        for (field, value) in zip(fields,
+                                                  state_operands[container]):
+                            state_and_packet[field] = ite(
+                                allocated, value, state_and_packet[field])
+                else:
+                    allocated = is_set(stage_prefix + 'salu_config_' +
+                                       stage_suffix + str(group))
+                    for (field, value) in zip(fields, state_operands[group]):
+                        state_and_packet[field] = ite(
+                            allocated, value, state_and_packet[field])
+
+        for idx, field in enumerate(generator.output_packet_fields_):
+            field_name = 'pkt_' + str(field)
+            if generator.synthesized_allocation_:
+                for container in range(num_containers):
+                    state_and_packet[field_name] = ite(
+                        is_set('phv_config_' + str(field) + '_' +
+                               str(container)),
+                        outputs[container], state_and_packet[field_name])
+            else:
+                state_and_packet[field_name] = outputs[idx]
+        return state_and_packet
+
+    def get_z3_formula(self, hole_assignments, constant_set, input_bits):
+        """Returns a z3 formula for the VERIFY mode sketch of the given hole
+        value assignments, with the specified input bits for source
+        variables."""
+        generator = self.sketch_code_generator
+        holes = {hole: int(value) for hole, value in hole_assignments.items()}
+        constant_vector = [int(constant) for constant in constant_set]
+
+        sources = OrderedDict(
+            (name, z3.Int(name)) for name in self.get_source_names())
+        asserts = []
+        pipeline_result = self.pipeline(sources, holes, constant_vector,
+                                        asserts)
+        program_result = self.spec.evaluate(sources)
+
+        for group in generator.output_state_groups_:
+            for slot in range(generator.group_size_):
+                field = 'state_group_' + str(group) + '_state_' + str(slot)
+                asserts.append(compare('==', pipeline_result[field],
+                                       program_result[field]))
+        for field in generator.output_packet_fields_:
+            field = 'pkt_' + str(field)
+            asserts.append(compare('==', pipeline_result[field],
+                                   program_result[field]))
+
+        constraints = z3.And([z3.BoolVal(True)] +
+                             [to_z3(predicate) for predicate in asserts])
+        variable_range = z3.And(
+            [z3.BoolVal(True)] +
+            [z3.And(0 <= var, var < 2**input_bits)
+             for var in sources.values()])
+        return z3.ForAll(list(sources.values()),
+                         z3.Implies(variable_range, constraints))
@@ -71,6 +71,9 @@ setup(
     },
     entry_points={
         'console_scripts': [
-            'iterative_solver=' + _PACKAGE_NAME + '.iterative_solver:run_main'
+            'iterative_solver=' + _PACKAGE_NAME + '.iterative_solver:run_main',
+            'resource_search=' + _PACKAGE_NAME + '.resource_search:run_main',
+            'codegen_worker=' + _PACKAGE_NAME + '.job_queue:run_main',
+            'fit_cost_model=' + _PACKAGE_NAME + '.cost_model:run_main'
         ]
     })
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+from os import path
+
+from chipc.alu_parse_cache import AluParseCache
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+
+STATEFUL_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateful_alus/')
+
+
+class AluParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.alu_filename = path.join(self.tmp_dir, 'raw.alu')
+        shutil.copyfile(path.join(STATEFUL_ALU_DIR, 'raw.alu'),
+                        self.alu_filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parses_once(self):
+        cache = AluParseCache()
+        tree = cache.get_parse_tree(self.alu_filename)
+        self.assertIs(tree, cache.get_parse_tree(self.alu_filename))
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_reparses_modified_file(self):
+        cache = AluParseCache()
+        tree = cache.get_parse_tree(self.alu_filename)
+        with open(self.alu_filename, 'a') as f:
+            f.write('\n')
+        stat = os.stat(self.alu_filename)
+        os.utime(self.alu_filename, ns=(stat.st_atime_ns,
+                                        stat.st_mtime_ns + 10**9))
+
+        self.assertIsNot(tree, cache.get_parse_tree(self.alu_filename))
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 0)
+        # Only the parse tree of the latest content is kept around.
+        self.assertEqual(len(cache.trees_), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
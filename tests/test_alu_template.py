@@ -0,0 +1,52 @@
+import unittest
+from os import path
+
+from chipc.alu_parse_cache import get_alu_parse_tree
+from chipc.alu_template import ALU_NAME_PLACEHOLDER
+from chipc.sketch_stateful_alu_visitor import SketchStatefulAluVisitor
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+
+STATEFUL_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateful_alus/')
+
+
+class AluTemplateTest(unittest.TestCase):
+    def visit_stateful_alu(self, alu_filename, alu_name):
+        visitor = SketchStatefulAluVisitor(alu_name, 2)
+        visitor.visit(get_alu_parse_tree(
+            path.join(STATEFUL_ALU_DIR, alu_filename)))
+        return visitor
+
+    def test_instantiate_matches_direct_visit(self):
+        for alu_filename in ['raw.alu', 'pair.alu', 'tofino.alu']:
+            alu_name = 'foo_stateful_alu_1_2'
+            direct = self.visit_stateful_alu(alu_filename, alu_name)
+            alu_template = self.visit_stateful_alu(
+                alu_filename, ALU_NAME_PLACEHOLDER).get_alu_template()
+
+            (code, holes) = alu_template.instantiate(alu_name)
+            self.assertEqual(
+                code, direct.helper_function_strings + direct.main_function)
+            self.assertListEqual(list(holes), sorted(direct.global_holes))
+            self.assertDictEqual(dict(holes), dict(direct.global_holes))
+            self.assertListEqual(alu_template.alu_args,
+                                 sorted(direct.alu_args))
+            self.assertEqual(alu_template.num_packet_fields,
+                             len(direct.packet_fields))
+            self.assertEqual(alu_template.num_state_vars,
+                             len(direct.state_vars))
+
+    def test_instances_are_independent(self):
+        alu_template = self.visit_stateful_alu(
+            'raw.alu', ALU_NAME_PLACEHOLDER).get_alu_template()
+        (code_a, holes_a) = alu_template.instantiate('a')
+        (code_b, holes_b) = alu_template.instantiate('b')
+        self.assertNotIn(ALU_NAME_PLACEHOLDER, code_a)
+        self.assertIn('int a_Mux2_0(', code_a)
+        self.assertIn('int b_Mux2_0(', code_b)
+        self.assertIn('a_Mux2_0_global', holes_a)
+        self.assertIn('b_Mux2_0_global', holes_b)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+
+from chipc.bounded_constant_set import BoundedConstantSet
+from chipc.bounded_constant_set import get_used_constants
+
+
+class BoundedConstantSetTest(unittest.TestCase):
+    def test_unbounded(self):
+        constant_set = BoundedConstantSet(['0', '1'])
+        for constant in ['5', '6', '1']:
+            constant_set.add(constant)
+        self.assertEqual(list(constant_set), ['0', '1', '5', '6'])
+
+    def test_evicts_oldest(self):
+        constant_set = BoundedConstantSet(['0', '1'], max_size=3)
+        for constant in ['5', '6', '7']:
+            # Each constant comes from an iteration of its own.
+            constant_set.set_used([])
+            constant_set.add(constant)
+        # Initial constants are pinned.
+        self.assertEqual(list(constant_set), ['0', '1', '7'])
+        self.assertEqual(constant_set.num_evicted, 2)
+
+    def test_keeps_used_and_pinned(self):
+        constant_set = BoundedConstantSet(['0'], max_size=3)
+        constant_set.add('5')
+        constant_set.add('6')
+        constant_set.set_used(['5'])
+        # Pinning evicts too.
+        constant_set.pin(['9'])
+        self.assertEqual(list(constant_set), ['0', '5', '9'])
+        constant_set.add('7')
+        self.assertEqual(list(constant_set), ['0', '5', '9', '7'])
+
+    def test_keeps_added_in_iteration(self):
+        constant_set = BoundedConstantSet(['0'], max_size=3)
+        constant_set.add('5')
+        constant_set.add('6')
+        # The set is full of constants the candidate doesn't use.
+        constant_set.set_used([])
+        self.assertEqual(constant_set.add('7'), 2)
+        self.assertEqual(list(constant_set), ['0', '6', '7'])
+        # Constants of a counterexample are all kept, over max_size if need
+        # be.
+        constant_set.add('8')
+        constant_set.add('9')
+        self.assertEqual(list(constant_set), ['0', '7', '8', '9'])
+        constant_set.set_used(['9'])
+        constant_set.add('4')
+        self.assertEqual(list(constant_set), ['0', '9', '4'])
+
+    def test_restore_evicted(self):
+        constant_set = BoundedConstantSet(['0'], max_size=2)
+        for constant in ['5', '6', '7']:
+            constant_set.set_used([])
+            constant_set.add(constant)
+        self.assertEqual(constant_set.restore_evicted(), ['5', '6'])
+        self.assertEqual(list(constant_set), ['0', '7', '5', '6'])
+        # Restored constants are pinned, so nothing is left to restore.
+        constant_set.set_used([])
+        constant_set.add('8')
+        self.assertEqual(constant_set.restore_evicted(), ['7'])
+        self.assertEqual(constant_set.restore_evicted(), [])
+        self.assertEqual((constant_set.num_evicted,
+                          constant_set.num_restored), (3, 3))
+
+    def test_initial_over_max_size(self):
+        constant_set = BoundedConstantSet(['0', '1', '2'], max_size=2)
+        self.assertEqual(list(constant_set), ['0', '1', '2'])
+
+    def test_get_used_constants(self):
+        constant_set = BoundedConstantSet(['0', '1', '5', '9'])
+        hole_assignments = {
+            'sample_stateful_alu_0_0_const_0_global': '2',
+            'sample_stateless_alu_0_1_immediate_operand': '3',
+            'sample_stateless_alu_0_1_opcode': '1',
+            # Indices past the end of the constant vector index nothing.
+            'sample_stateful_alu_1_0_const_1_global': '7',
+        }
+        self.assertEqual(get_used_constants(hole_assignments, constant_set),
+                         {'5', '9'})
+
+
+if __name__ == '__main__':
+    unittest.main()
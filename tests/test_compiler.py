@@ -0,0 +1,181 @@
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from os import path
+from pathlib import Path
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from ordered_set import OrderedSet
+
+from chipc.compiler import Compiler
+from chipc.mode import Mode
+from chipc.sketch_pool import SketchPool
+from chipc.sketch_portfolio import SketchPortfolio
+from tests.test_sketch_utils import assert_process_exits
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+
+# Synthesizes the first allocation, or any sketch with seed 2, at once, and
+# never finishes the others.
+FAKE_SKETCH = """#!/bin/sh
+case "$*" in
+    *_1_codegen.sk*|*--slv-seed=2*) cat "$HOLES_FILE";;
+    *) sleep 60 & echo $! > "$PID_FILE"; wait;;
+esac
+"""
+
+
+class ParallelCodegenTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        sketch_path = Path('sketch').resolve()
+        sketch_path.write_text(FAKE_SKETCH)
+        sketch_path.chmod(sketch_path.stat().st_mode | stat.S_IXUSR)
+        self.pid_file = Path('pid').resolve()
+        self.env = patch.dict(os.environ, {
+            'PATH': self.tmp_dir.name + os.pathsep + os.environ['PATH'],
+            'PID_FILE': str(self.pid_file),
+            'HOLES_FILE': str(Path('holes').resolve())})
+        self.env.start()
+
+        # simplest.sk has a single state group, so there is one allocation
+        # per stage.
+        self.compiler = Compiler(
+            path.join(BASE_PATH, '../example_specs/simplest.sk'),
+            path.join(BASE_PATH, '../example_alus/stateful_alus/raw.alu'),
+            path.join(BASE_PATH,
+                      '../example_alus/stateless_alus/stateless_alu.alu'),
+            2, 1, 'test', False, OrderedSet(['0', '1', '2', '3']), 1,
+            use_sketch_cache=False)
+        # Run both allocations at once, whatever the machine.
+        self.compiler.sketch_pool = SketchPool(max_jobs=2, job_memory_bytes=1)
+        self.compiler.write_codegen_sketch(([], '', 'holes.sk'))
+        Path('holes').write_text(''.join(
+            hole + '__ANONYMOUS_s1 = 0\n'
+            for hole in self.compiler.sketch_code_generator.hole_names_))
+
+    def assert_sleep_exits(self):
+        # The slow run may have been cancelled before starting sleep.
+        if self.pid_file.exists() and self.pid_file.read_text():
+            assert_process_exits(self, int(self.pid_file.read_text()))
+            self.pid_file.unlink()
+
+    def tearDown(self):
+        self.env.stop()
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_cancels_other_runs(self):
+        start = time.perf_counter()
+        (ret_code, _, hole_assignments) = self.compiler.parallel_codegen()
+        self.assertLess(time.perf_counter() - start, 30)
+        self.assertEqual(ret_code, 0)
+        self.assertEqual(set(hole_assignments.values()), {'0'})
+        self.assert_sleep_exits()
+
+    def test_verify(self):
+        for counterexamples in [[], [({'pkt_0': 1}, {})]]:
+            verify = Mock(return_value=counterexamples)
+            ((ret_code, _, hole_assignments), result) = \
+                self.compiler.parallel_codegen_and_verify(verify)
+            self.assertEqual(ret_code, 0)
+            verify.assert_called_once_with(hole_assignments)
+            self.assertEqual(result, counterexamples)
+            self.assert_sleep_exits()
+
+    def test_portfolio(self):
+        self.compiler.sketch_portfolio = SketchPortfolio(
+            2, 'spec', history_file=str(Path('portfolio.json').resolve()))
+        (ret_code, _, _) = self.compiler.serial_codegen()
+        self.assertEqual(ret_code, 0)
+        self.assert_sleep_exits()
+        self.assertTrue(Path('test_codegen_iteration_1_seed2.sk').exists())
+        # The next run tries seed 2 first.
+        self.assertEqual(
+            self.compiler.sketch_portfolio.get_configurations()[0],
+            (2, False, ()))
+
+    def test_bounded_pool(self):
+        self.compiler.sketch_pool.max_jobs = 1
+        (ret_code, _, _) = self.compiler.parallel_codegen()
+        self.assertEqual(ret_code, 0)
+        # The first run succeeds before the second one may start.
+        self.assertFalse(self.pid_file.exists())
+        self.assertFalse(Path('test_2_codegen.sk').exists())
+
+    def test_priority(self):
+        self.compiler.num_pipeline_stages = 3
+        self.assertEqual(
+            [sketch_file_name for (_, _, sketch_file_name) in
+             self.compiler.get_parallel_codegen_inputs([], '')],
+            ['test_2_codegen.sk', 'test_1_codegen.sk', 'test_3_codegen.sk'])
+
+    def test_codegen_during_verification(self):
+        generator = self.compiler.sketch_code_generator
+        hole_names = list(self.compiler.codegen_hole_names)
+        codegen_sketch = Path('holes.sk').read_text()
+        output = Path('holes').read_text()
+        verify_key = (self.compiler.spec_filename, Mode.VERIFY, False,
+                      generator.constant_arr_size_)
+        stop = threading.Event()
+
+        # Rebuilds the hole state each time, like the first verification of
+        # parallel_codegen_and_verify.
+        def verify():
+            while not stop.is_set():
+                generator.sketch_cache_.pop(verify_key, None)
+                generator.generate_sketch(
+                    spec_filename=self.compiler.spec_filename,
+                    mode=Mode.VERIFY, synthesized_allocation=False)
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        thread = threading.Thread(target=verify)
+        thread.start()
+        try:
+            for _ in range(200):
+                self.compiler.write_codegen_sketch(([], '', 'holes.sk'))
+                self.assertEqual(Path('holes.sk').read_text(), codegen_sketch)
+                (_, _, holes_to_values) = self.compiler.get_codegen_output(
+                    'holes.sk', 0, output)
+                self.assertEqual(list(holes_to_values), hole_names)
+        finally:
+            stop.set()
+            thread.join()
+            sys.setswitchinterval(switch_interval)
+
+
+class StageAssignmentPruningTest(unittest.TestCase):
+    def make_compiler(self, num_pipeline_stages):
+        return Compiler(
+            path.join(BASE_PATH, '../example_specs/blue_increase.sk'),
+            path.join(BASE_PATH, '../example_alus/stateful_alus/raw.alu'),
+            path.join(BASE_PATH,
+                      '../example_alus/stateless_alus/stateless_alu.alu'),
+            num_pipeline_stages, 2, 'test', False,
+            OrderedSet(['0', '1', '2', '3']), 1, use_sketch_cache=False)
+
+    def test_dependencies(self):
+        # state_group_0 depends on state_group_1, so state_group_0 has to be
+        # in the second stage and state_group_1 in the first one.
+        compiler = self.make_compiler(2)
+        compiler_inputs = compiler.get_parallel_codegen_inputs([], '')
+        self.assertEqual(len(compiler_inputs), 1)
+        self.assertIn('test_salu_config_1_0 == 1', compiler_inputs[0][0])
+        self.assertIn('test_salu_config_0_1 == 1', compiler_inputs[0][0])
+
+    def test_no_assignment_left(self):
+        (ret_code, output, _) = self.make_compiler(1).parallel_codegen()
+        self.assertNotEqual(ret_code, 0)
+        self.assertIn('No assignment', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import contextlib
+import io
+import json
+import math
+import os
+import tempfile
+import unittest
+from os import path
+
+from chipc import iterative_solver
+from chipc.cost_model import CostModel
+from chipc.cost_model import solve_linear
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+
+STATELESS_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateless_alus/')
+STATEFUL_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateful_alus/')
+SPEC_DIR = path.join(BASE_PATH, '../example_specs/')
+
+
+def make_record(hole_bits, num_testcases):
+    return {'initial_hole_bits': hole_bits, 'mux_hole_bits': hole_bits // 4,
+            'num_state_groups': 1, 'num_testcases': num_testcases,
+            'spec_tokens': 40,
+            'wall_seconds': math.exp(0.1 * hole_bits + 0.5 * num_testcases),
+            'peak_rss_bytes': 2 ** 20 * hole_bits}
+
+
+class CostModelTest(unittest.TestCase):
+    def test_solve_linear(self):
+        self.assertEqual(solve_linear([[0, 2], [4, 1]], [2, 9]), [2.0, 1.0])
+
+    def test_fit_and_predict(self):
+        records = [make_record(hole_bits, num_testcases)
+                   for hole_bits in [40, 60, 80, 100]
+                   for num_testcases in [0, 2, 4]]
+        # Runs without features are skipped.
+        records.append({'wall_seconds': 1.0, 'peak_rss_bytes': 1})
+        model = CostModel.fit(records)
+        # The ridge penalty shrinks weights a little.
+        (seconds, _) = model.predict(make_record(70, 3))
+        self.assertAlmostEqual(math.log(seconds), 8.5, delta=0.2)
+        (small_seconds, small_bytes) = model.predict(make_record(50, 0))
+        (large_seconds, large_bytes) = model.predict(make_record(90, 0))
+        self.assertLess(small_seconds, large_seconds)
+        self.assertLess(small_bytes, large_bytes)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = path.join(tmp_dir, 'cost_model.json')
+            model.save(file_name)
+            self.assertEqual(CostModel.load(file_name).predict(
+                make_record(70, 3)), model.predict(make_record(70, 3)))
+
+    def test_dry_run(self):
+        records = [make_record(hole_bits, 0) for hole_bits in [40, 60, 80]]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'cost_model.json')
+            CostModel.fit(records).save(file_name)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(0, iterative_solver.main([
+                    'iterative_solver',
+                    path.join(SPEC_DIR, 'sampling.sk'),
+                    path.join(STATEFUL_ALU_DIR, 'if_else_raw.alu'),
+                    path.join(STATELESS_ALU_DIR, 'stateless_alu.alu'),
+                    '2', '1', '0,1,2,3', '10', '--dry-run', '--cost-model',
+                    file_name]))
+        prediction = json.loads(output.getvalue().splitlines()[-1])
+        self.assertEqual(prediction['num_state_groups'], 1)
+        self.assertEqual(prediction['num_testcases'], 0)
+        self.assertGreater(prediction['initial_hole_bits'],
+                           prediction['mux_hole_bits'])
+        self.assertGreater(prediction['predicted_seconds'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+from chipc.counterexample_store import CounterexampleStore
+from chipc.counterexample_store import load_counterexamples
+
+
+def render(pkt_fields, state_vars, name):
+    return name + ';'
+
+
+class CounterexampleStoreTest(unittest.TestCase):
+    def test_dedupe(self):
+        store = CounterexampleStore(render)
+        self.assertTrue(store.add({'pkt_0': 1, 'pkt_1': 2}, {}, '1'))
+        self.assertFalse(store.add({'pkt_1': 2, 'pkt_0': 1}, {}, '2'))
+        self.assertTrue(store.add({'pkt_0': 1, 'pkt_1': 3}, {}, '3'))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get_testcases(), '1;3;')
+
+    def test_renders_incrementally(self):
+        rendered = []
+
+        def render_once(pkt_fields, state_vars, name):
+            rendered.append(name)
+            return name + ';'
+
+        store = CounterexampleStore(render_once)
+        store.add({'pkt_0': 1}, {}, '1')
+        self.assertEqual(store.get_testcases(), '1;')
+        store.add({'pkt_0': 2}, {}, '2')
+        self.assertEqual(store.get_testcases(), '1;2;')
+        self.assertEqual(rendered, ['1', '2'])
+
+    def test_max_testcases(self):
+        store = CounterexampleStore(render, max_testcases=2)
+        for value in range(3):
+            store.add({'pkt_0': value}, {}, str(value))
+        self.assertEqual(store.get_testcases(), '1;2;')
+
+        # A dropped counterexample found again is never dropped again.
+        store.add({'pkt_0': 0}, {}, '3')
+        store.add({'pkt_0': 4}, {}, '4')
+        self.assertEqual(store.get_testcases(), '3;4;')
+        store.add({'pkt_0': 5}, {}, '5')
+        self.assertEqual(store.get_testcases(), '3;5;')
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'counterexamples.json')
+            self.assertEqual(load_counterexamples(file_name), [])
+            store = CounterexampleStore(render, file_name)
+            store.add({'pkt_0': 1}, {'state_group_0_state_0': 2}, '1')
+            store.add({'pkt_0': 3}, {'state_group_0_state_0': 4}, '2')
+            self.assertEqual(load_counterexamples(file_name),
+                             store.get_counterexamples())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
+import contextlib
+import io
+import os
+import tempfile
 import unittest
 from os import path
 
 from chipc import iterative_solver
 from chipc.iterative_solver import generate_hole_elimination_assert
+from chipc.z3_utils import CounterexampleGenerator
 
 BASE_PATH = path.abspath(path.dirname(__file__))
 
@@ -25,6 +30,76 @@ class GenerateHoleEliminationTest(unittest.TestCase):
         )
 
 
+class FakeCompiler:
+    """Stands in for Compiler in solve. Synthesis fails from iteration 3 on
+    unless 5 is in the constant set, or always if infeasible. Candidates fail
+    verification with pkt_0 = 5, then 6."""
+
+    sketch_name = 'fake'
+    num_alus_per_stage = 1
+    num_pipeline_stages = 1
+
+    def __init__(self, constant_set, infeasible):
+        self.constant_set = list(constant_set)
+        self.infeasible = infeasible
+        self.counterexample_generator = CounterexampleGenerator()
+        self.counterexample_generator.check_times.append(0)
+
+    def update_constants_for_synthesis(self, constant_set):
+        self.constant_set = list(constant_set)
+
+    def serial_codegen(self, iter_cnt, additional_constraints,
+                       additional_testcases):
+        if self.infeasible or \
+                iter_cnt >= 3 and '5' not in self.constant_set:
+            return (1, 'UNSAT', None)
+        return (0, '', {})
+
+    def verify_all(self, hole_assignments, input_bits, num_counterexamples,
+                   iter_cnt):
+        if iter_cnt > 2:
+            return []
+        return [({'pkt_0': 4 + iter_cnt}, {})]
+
+
+class RestoreEvictedConstantsTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def solve(self, max_constants, infeasible=False):
+        args = iterative_solver.get_argument_parser().parse_args([
+            path.join(SPEC_DIR, 'sampling.sk'),
+            path.join(STATEFUL_ALU_DIR, 'if_else_raw.alu'),
+            path.join(STATELESS_ALU_DIR, 'stateless_alu.alu'),
+            '1', '1', '0', '10', '--max-constants', str(max_constants)])
+        constant_set = iterative_solver.make_constant_set(args)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            (ret_code, _) = iterative_solver.solve(
+                FakeCompiler(constant_set, infeasible), args, constant_set)
+        return (ret_code, output.getvalue())
+
+    def test_retries_with_evicted_constants(self):
+        # 6 evicts 5, which synthesis needs.
+        (ret_code, output) = self.solve(2)
+        self.assertEqual(ret_code, 0)
+        self.assertIn('retrying with evicted constants 5', output)
+        self.assertIn('Evicted 1 constants to keep at most 2 and restored 1 '
+                      'of them, in 4 iterations', output)
+
+    def test_fails_without_evictions(self):
+        (ret_code, output) = self.solve(2, infeasible=True)
+        self.assertEqual(ret_code, 1)
+        self.assertIn('Evicted 0 constants to keep at most 2 and restored 0 '
+                      'of them, in 1 iterations', output)
+
+
 class IterativeSolverTest(unittest.TestCase):
     def test_sampling_2_1_if_else_raw_cex_mode(self):
         self.assertEqual(
@@ -37,6 +112,17 @@ class IterativeSolverTest(unittest.TestCase):
                 '2', '1', '0,1,2,3', '10']),
         )
 
+    def test_sampling_2_1_if_else_raw_spec_constants(self):
+        self.assertEqual(
+            0,
+            iterative_solver.main([
+                'iterative_solver',
+                path.join(SPEC_DIR, 'sampling.sk'),
+                path.join(STATEFUL_ALU_DIR, 'if_else_raw.alu'),
+                path.join(STATELESS_ALU_DIR, 'stateless_alu.alu'),
+                '2', '1', '0', '10', '--spec-constants']),
+        )
+
     def test_sampling_2_1_if_else_raw_cex_mode_synthesized_alloc(self):
         self.assertEqual(
             0,
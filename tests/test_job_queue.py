@@ -0,0 +1,149 @@
+import asyncio
+import os
+import sqlite3
+import stat
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import psutil
+
+from chipc.job_queue import JobQueue
+from chipc.job_queue import run_worker
+from chipc.sketch_utils import SketchResult
+
+# Stands in for sketch, which workers run on a copy of the sketch file.
+FAKE_SKETCH = """#!/bin/sh
+case "$1" in
+    */parse_error.sk) echo 'Program Parse Error: foo'; exit 1;;
+    */sleep.sk) sleep 60 & echo $! > "$PID_FILE"; wait;;
+    *) cat "$1"; echo "$2";;
+esac
+"""
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        sketch_path = Path(self.tmp_dir.name) / 'sketch'
+        sketch_path.write_text(FAKE_SKETCH)
+        sketch_path.chmod(sketch_path.stat().st_mode | stat.S_IXUSR)
+        self.pid_file = Path(self.tmp_dir.name) / 'pid'
+        self.env = patch.dict(os.environ, {
+            'PATH': self.tmp_dir.name + os.pathsep + os.environ['PATH'],
+            'PID_FILE': str(self.pid_file)})
+        self.env.start()
+        self.job_queue = JobQueue(os.path.join(self.tmp_dir.name, 'jobs.db'),
+                                  poll_interval=0.05)
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp_dir.cleanup()
+
+    def write_sketch(self, base_name, text='int x;\n'):
+        sketch_file_name = os.path.join(self.tmp_dir.name, base_name)
+        Path(sketch_file_name).write_text(text)
+        return sketch_file_name
+
+    def test_claim(self):
+        first = self.job_queue.submit(self.write_sketch('a.sk'), [])
+        second = self.job_queue.submit(self.write_sketch('b.sk'), [])
+        self.job_queue.cancel(first)
+        self.assertEqual(self.job_queue.claim('worker')[0], second)
+        self.assertIsNone(self.job_queue.claim('worker'))
+        self.assertFalse(self.job_queue.keep_alive(second, 'worker'))
+
+    def test_stale_job_claimed_again(self):
+        job_id = self.job_queue.submit(self.write_sketch('a.sk'), [])
+        self.job_queue.claim('worker')
+        self.job_queue.stale_seconds = -1
+        self.assertEqual(self.job_queue.claim('other_worker')[0], job_id)
+
+        # The first worker no longer holds the job.
+        self.assertTrue(self.job_queue.keep_alive(job_id, 'worker'))
+        self.job_queue.finish(job_id, 'worker',
+                              SketchResult(0, 'stale', 1, 1))
+        self.assertEqual(self.job_queue.get_state(job_id), 'running')
+        self.job_queue.finish(job_id, 'other_worker',
+                              SketchResult(0, 'fresh', 1, 1))
+        self.assertEqual(self.job_queue.get_result(job_id).output, 'fresh')
+        # Done jobs are finished once.
+        self.job_queue.finish(job_id, 'other_worker',
+                              SketchResult(0, 'again', 1, 1))
+        self.assertEqual(self.job_queue.get_result(job_id).output, 'fresh')
+
+    def test_run_on_worker(self):
+        sketch_file_name = self.write_sketch('foo.sk')
+
+        async def run():
+            task = asyncio.ensure_future(self.job_queue.run_async(
+                sketch_file_name, [sketch_file_name, '--bnd-inbits=2']))
+            # Let the job be submitted.
+            await asyncio.sleep(0)
+            await run_worker(self.job_queue, stop_when_idle=True)
+            return await task
+
+        result = asyncio.run(run())
+        self.assertEqual(result.return_code, 0)
+        self.assertEqual(result.output, 'int x;\n--bnd-inbits=2\n')
+
+    def test_locked_database_does_not_block_loop(self):
+        sketch_file_name = self.write_sketch('foo.sk')
+        other_host = sqlite3.connect(self.job_queue.db_path,
+                                     isolation_level=None)
+        other_host.execute('BEGIN IMMEDIATE')
+
+        async def run():
+            task = asyncio.ensure_future(self.job_queue.run_async(
+                sketch_file_name, [sketch_file_name]))
+            # The submission waits for the lock off the event loop, so the
+            # loop gets to release it.
+            await asyncio.sleep(0.2)
+            self.assertFalse(task.done())
+            other_host.execute('COMMIT')
+            await run_worker(self.job_queue, stop_when_idle=True)
+            return await task
+
+        result = asyncio.run(asyncio.wait_for(run(), 30))
+        other_host.close()
+        self.assertEqual(result.return_code, 0)
+
+    def test_error(self):
+        sketch_file_name = self.write_sketch('parse_error.sk')
+
+        async def run():
+            task = asyncio.ensure_future(self.job_queue.run_async(
+                sketch_file_name, [sketch_file_name]))
+            await asyncio.sleep(0)
+            await run_worker(self.job_queue, stop_when_idle=True)
+            return await task
+
+        with self.assertRaisesRegex(Exception, 'contains a syntax error'):
+            asyncio.run(run())
+
+    def test_cancel_reaches_worker(self):
+        sketch_file_name = self.write_sketch('sleep.sk')
+
+        async def run():
+            task = asyncio.ensure_future(self.job_queue.run_async(
+                sketch_file_name, [sketch_file_name]))
+            worker = asyncio.ensure_future(run_worker(self.job_queue))
+            while not self.pid_file.exists() or \
+                    not self.pid_file.read_text().strip():
+                await asyncio.sleep(0.05)
+            pid = int(self.pid_file.read_text())
+            task.cancel()
+            # The worker kills sketch once it sees the cancellation.
+            while psutil.pid_exists(pid) and \
+                    psutil.Process(pid).status() != psutil.STATUS_ZOMBIE:
+                await asyncio.sleep(0.05)
+            worker.cancel()
+            await asyncio.gather(task, worker, return_exceptions=True)
+
+        asyncio.run(asyncio.wait_for(run(), 30))
+        self.assertEqual(self.job_queue.get_state(1), 'cancelled')
+
+
+if __name__ == '__main__':
+    unittest.main()
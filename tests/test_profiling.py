@@ -0,0 +1,88 @@
+import os
+import pstats
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from chipc import profiling
+from chipc.profiling import ChildSampler
+
+
+def synthesize():
+    return sum(range(1000))
+
+
+def verify():
+    return sorted(range(1000))
+
+
+def check():
+    return max(range(1000))
+
+
+def get_function_names(stats):
+    return {function_name for (_, _, function_name) in stats.stats}
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_phases(self):
+        profiler = profiling.start()
+        try:
+            with profiling.phase('synthesis'):
+                synthesize()
+                # Nested phases of the same name are one phase.
+                with profiling.phase('synthesis'):
+                    synthesize()
+
+            def run_verify():
+                with profiling.phase('verification'):
+                    verify()
+
+            thread = threading.Thread(target=run_verify)
+            thread.start()
+            thread.join()
+            # The main thread is back in its phase.
+            check()
+        finally:
+            profiling.stop()
+
+        stats = profiler.get_stats()
+        self.assertIn('synthesize', get_function_names(stats['synthesis']))
+        self.assertNotIn('synthesize', get_function_names(stats['other']))
+        self.assertIn('verify', get_function_names(stats['verification']))
+        self.assertIn('check', get_function_names(stats['other']))
+        self.assertNotIn('check', get_function_names(stats['verification']))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            prefix = os.path.join(tmp_dir, 'profile')
+            profiler.write(prefix, num_functions=5)
+            merged = pstats.Stats(prefix + '.pstats')
+            self.assertTrue({'synthesize', 'verify'} <=
+                            get_function_names(merged))
+            self.assertTrue(os.path.exists(prefix + '_synthesis.pstats'))
+            with open(prefix + '.txt') as summary_file:
+                self.assertIn('Hottest functions', summary_file.read())
+
+    def test_no_profiler(self):
+        with profiling.phase('synthesis'):
+            self.assertEqual(synthesize(), 499500)
+
+
+class ChildSamplerTest(unittest.TestCase):
+    def test_sample(self):
+        sampler = ChildSampler(lambda: 'synthesis')
+        process = subprocess.Popen(['sh', '-c', 'while :; do :; done'])
+        try:
+            sampler.sample()
+            time.sleep(0.5)
+            sampler.sample()
+        finally:
+            process.kill()
+            process.wait()
+        self.assertGreater(sampler.cpu_times[('synthesis', 'sh')], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from chipc import resource_search
+from chipc.resource_search import GridSearch
+
+
+class GridSearchTest(unittest.TestCase):
+    def test_infer(self):
+        grid_search = GridSearch(3, 3)
+        grid_search.record((2, 2), True)
+        grid_search.record((1, 3), False)
+        self.assertTrue(grid_search.infer((3, 2)))
+        self.assertFalse(grid_search.infer((1, 1)))
+        self.assertIsNone(grid_search.infer((2, 1)))
+        self.assertEqual(grid_search.get_unknown_grids(), [(2, 1), (3, 1)])
+
+    def test_frontier(self):
+        grid_search = GridSearch(3, 3)
+        for grid in [(1, 3), (2, 2), (3, 1), (2, 3), (3, 3)]:
+            grid_search.record(grid, True)
+        grid_search.record((1, 2), False)
+        self.assertEqual(grid_search.get_frontier(), [(1, 3), (2, 2), (3, 1)])
+
+
+class SearchTest(unittest.TestCase):
+    def solve_grid(self, args, num_pipeline_stages, num_alus_per_stage,
+                   counterexamples):
+        self.runs.append(((num_pipeline_stages, num_alus_per_stage),
+                          counterexamples))
+        grid = (num_pipeline_stages, num_alus_per_stage)
+        return (grid, num_pipeline_stages + num_alus_per_stage >= 4,
+                [((('pkt_0', resource_search.get_cost(grid)),), ())], None)
+
+    def test_search(self):
+        self.runs = []
+        args = Namespace(num_pipeline_stages=3, num_alus_per_stage=3,
+                         search_jobs=1)
+        with patch('chipc.resource_search.solve_grid', self.solve_grid), \
+                ThreadPoolExecutor(max_workers=1) as executor:
+            (frontier, profile_prefixes) = resource_search.search(args,
+                                                                  executor)
+        self.assertEqual(frontier, [(1, 3), (2, 2), (3, 1)])
+        self.assertEqual(profile_prefixes, [])
+        # Grids inferred from others never run.
+        self.assertEqual([grid for (grid, _) in self.runs],
+                         [(1, 1), (1, 2), (2, 1), (1, 3), (3, 1), (2, 2)])
+        # Later runs start with the counterexamples of earlier ones.
+        self.assertEqual(self.runs[2][1], [((('pkt_0', 1),), ()),
+                                           ((('pkt_0', 2),), ())])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from chipc import sketch_cache
+from chipc import sketch_utils
+from chipc.sketch_cache import SketchCache
+from chipc.sketch_utils import SketchResult
+
+
+class SketchCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = SketchCache(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        key = SketchCache.get_key('int x;', ['synthesize', 2], '1.7.6')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, {'return_code': 0, 'output': 'foo'})
+        self.assertEqual(self.cache.get(key),
+                         {'return_code': 0, 'output': 'foo'})
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_key(self):
+        key = SketchCache.get_key('int x;', ['a', 'b'], '1.7.6')
+        self.assertEqual(key,
+                         SketchCache.get_key('int x;', ['a', 'b'], '1.7.6'))
+        self.assertNotEqual(key,
+                            SketchCache.get_key('int y;', ['a', 'b'], '1.7.6'))
+        self.assertNotEqual(key,
+                            SketchCache.get_key('int x;', ['ab'], '1.7.6'))
+        self.assertNotEqual(key,
+                            SketchCache.get_key('int x;', ['a', 'b'], '1.7.5'))
+
+    def test_evicts_least_recently_used(self):
+        keys = [SketchCache.get_key(str(i), [], '') for i in range(3)]
+        entry = {'output': 'x' * 100}
+        for (i, key) in enumerate(keys):
+            self.cache.put(key, entry)
+            # Order modification times, which may be coarse.
+            os.utime(self.cache.get_entry_path(key), (i, i))
+        entry_size = self.cache.get_entry_path(keys[0]).stat().st_size
+
+        # Make keys[0] the most recently used.
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.cache.max_bytes = 2 * entry_size
+        self.cache.evict()
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+
+    def test_evicts_over_max_bytes(self):
+        keys = [SketchCache.get_key(str(i), [], '') for i in range(4)]
+        entry = {'output': 'x' * 100}
+        with patch.object(self.cache, 'evict',
+                          wraps=self.cache.evict) as mock_evict:
+            # Only the first put scans the cache.
+            for key in keys[:3]:
+                self.cache.put(key, entry)
+            self.assertEqual(mock_evict.call_count, 1)
+            entry_size = self.cache.get_entry_path(keys[0]).stat().st_size
+            self.assertEqual(self.cache.total_bytes, 3 * entry_size)
+            # Overwriting an entry doesn't grow the cache.
+            self.cache.put(keys[0], entry)
+            self.assertEqual(self.cache.total_bytes, 3 * entry_size)
+
+            self.cache.max_bytes = 3 * entry_size
+            self.cache.put(keys[3], entry)
+            self.assertEqual(mock_evict.call_count, 2)
+        self.assertEqual(self.cache.total_bytes, 3 * entry_size)
+        self.assertEqual(len(list(Path(self.tmp_dir.name).glob('*/*.json'))),
+                         3)
+
+    def test_bypass(self):
+        with patch.dict(os.environ, {sketch_cache.CACHE_ENV: '0'}):
+            self.assertIsNone(sketch_cache.get_default_cache())
+        with patch.dict(os.environ,
+                        {sketch_cache.CACHE_ENV: '1',
+                         sketch_cache.CACHE_DIR_ENV: self.tmp_dir.name}):
+            self.assertEqual(sketch_cache.get_default_cache().cache_dir,
+                             Path(self.tmp_dir.name))
+
+
+@patch('chipc.sketch_utils.get_sketch_version', return_value='1.7.6')
+class CachedSketchUtilsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = SketchCache(os.path.join(self.tmp_dir.name, 'cache'))
+        self.sketch_file_name = os.path.join(self.tmp_dir.name, 'foo.sk')
+        Path(self.sketch_file_name).write_text('int x;')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @patch('chipc.sketch_utils.run_sketch',
+           return_value=SketchResult(0, 'hole values', 1, 1))
+    def test_synthesize(self, mock_run_sketch, mock_get_sketch_version):
+        for _ in range(2):
+            self.assertEqual(
+                sketch_utils.synthesize(self.sketch_file_name, 2, 1,
+                                        cache=self.cache),
+                (0, 'hole values'))
+        self.assertEqual(mock_run_sketch.call_count, 1)
+
+        # Different flags miss the cache.
+        sketch_utils.synthesize(self.sketch_file_name, 3, 1, cache=self.cache)
+        self.assertEqual(mock_run_sketch.call_count, 2)
+
+    @patch('chipc.sketch_utils.run_sketch',
+           return_value=SketchResult(-9, '', 1, 1, timed_out=True))
+    def test_killed_synthesize_not_cached(self, mock_run_sketch,
+                                          mock_get_sketch_version):
+        for _ in range(2):
+            sketch_utils.synthesize(self.sketch_file_name, 2, 1,
+                                    cache=self.cache)
+        self.assertEqual(mock_run_sketch.call_count, 2)
+
+    def test_generate_ir(self, mock_get_sketch_version):
+        dag_file_name = os.path.join(self.tmp_dir.name, 'foo.dag')
+
+        def run_sketch(*args, **kwargs):
+            Path(dag_file_name).write_text('0 = S INT x 2\n')
+            return SketchResult(0, '', 1, 1)
+
+        with patch('chipc.sketch_utils.run_sketch',
+                   side_effect=run_sketch) as mock_run:
+            for _ in range(2):
+                # Removed DAGs are written back from the cache.
+                if os.path.exists(dag_file_name):
+                    os.remove(dag_file_name)
+                self.assertEqual(
+                    sketch_utils.generate_ir(self.sketch_file_name,
+                                             self.cache),
+                    '0 = S INT x 2\n')
+            self.assertEqual(mock_run.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
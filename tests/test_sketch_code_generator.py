@@ -0,0 +1,71 @@
+import unittest
+from collections import OrderedDict
+from os import path
+
+from ordered_set import OrderedSet
+
+from chipc.compiler import Compiler
+from chipc.mode import Mode
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+
+STATELESS_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateless_alus/')
+STATEFUL_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateful_alus/')
+SPEC_DIR = path.join(BASE_PATH, '../example_specs/')
+
+
+def make_compiler(constant_set, synthesized_allocation):
+    return Compiler(path.join(SPEC_DIR, 'simple.sk'),
+                    path.join(STATEFUL_ALU_DIR, 'raw.alu'),
+                    path.join(STATELESS_ALU_DIR, 'stateless_alu.alu'),
+                    2, 2, 'simple_raw_stateless_alu_2_2', False,
+                    constant_set, 1, synthesized_allocation)
+
+
+class IncrementalGenerateSketchTest(unittest.TestCase):
+    def check_matches_fresh_generator(self, synthesized_allocation):
+        compiler = make_compiler(OrderedSet(['0', '1', '2', '3']),
+                                 synthesized_allocation)
+        generator = compiler.sketch_code_generator
+        # Grow the constant set across and within hole bit widths, then go
+        # back to a width that was already generated.
+        steps = [
+            (['0', '1', '2', '3'], [], ''),
+            (['0', '1', '2', '3', '7'], ['a == 1'], 'assert(1);\n'),
+            (['0', '1', '2', '3', '7', '9'], [], 'assert(2);\n'),
+            (['4', '5', '6', '8'], ['b == 0'], ''),
+        ]
+        for (constants, constraints, testcases) in steps:
+            compiler.update_constants_for_synthesis(OrderedSet(constants))
+            fresh = make_compiler(OrderedSet(constants),
+                                  synthesized_allocation)
+            fresh.update_constants_for_synthesis(OrderedSet(constants))
+            for mode in [Mode.CODEGEN, Mode.VERIFY]:
+                hole_assignments = OrderedDict(
+                    (hole, '0') for hole in generator.hole_names_)
+                kwargs = dict(
+                    spec_filename=compiler.spec_filename,
+                    mode=mode,
+                    synthesized_allocation=synthesized_allocation,
+                    additional_constraints=constraints,
+                    hole_assignments=hole_assignments,
+                    additional_testcases=testcases)
+                self.assertEqual(
+                    generator.generate_sketch(**kwargs),
+                    fresh.sketch_code_generator.generate_sketch(**kwargs))
+                self.assertEqual(
+                    generator.hole_names_,
+                    fresh.sketch_code_generator.hole_names_)
+                self.assertEqual(
+                    generator.total_hole_bits_,
+                    fresh.sketch_code_generator.total_hole_bits_)
+
+    def test_canonical_allocation(self):
+        self.check_matches_fresh_generator(False)
+
+    def test_synthesized_allocation(self):
+        self.check_matches_fresh_generator(True)
+
+
+if __name__ == '__main__':
+    unittest.main()
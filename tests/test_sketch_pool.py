@@ -0,0 +1,36 @@
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from chipc.sketch_pool import SketchPool
+
+
+def mock_available_memory(available):
+    return patch('psutil.virtual_memory',
+                 return_value=Mock(available=available))
+
+
+class SketchPoolTest(unittest.TestCase):
+    def test_bounded_by_max_jobs(self):
+        pool = SketchPool(max_jobs=4, job_memory_bytes=1)
+        with mock_available_memory(100):
+            self.assertEqual(pool.get_num_free_slots(0), 4)
+            self.assertEqual(pool.get_num_free_slots(3), 1)
+            self.assertEqual(pool.get_num_free_slots(4), 0)
+
+    def test_bounded_by_memory(self):
+        pool = SketchPool(max_jobs=4, job_memory_bytes=10)
+        with mock_available_memory(25):
+            self.assertEqual(pool.get_num_free_slots(1), 2)
+        with mock_available_memory(5):
+            self.assertEqual(pool.get_num_free_slots(1), 0)
+            # Always lets one run start.
+            self.assertEqual(pool.get_num_free_slots(0), 1)
+
+    @patch('psutil.cpu_count', return_value=8)
+    def test_defaults_to_cores(self, mock_cpu_count):
+        self.assertEqual(SketchPool().max_jobs, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
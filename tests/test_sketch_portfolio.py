@@ -0,0 +1,94 @@
+import json
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+from pathlib import Path
+from unittest.mock import patch
+
+from chipc.sketch_portfolio import get_configuration_name
+from chipc.sketch_portfolio import SketchPortfolio
+
+
+def record_wins(history_file, configuration, num_wins=20):
+    portfolio = SketchPortfolio(3, 'spec', history_file=history_file)
+    for _ in range(num_wins):
+        portfolio.record_win(configuration)
+
+
+class SketchPortfolioTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.history_file = path.join(self.tmp_dir.name, 'portfolio.json')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_configurations(self):
+        portfolio = SketchPortfolio(6, 'spec', history_file=self.history_file)
+        self.assertEqual(portfolio.get_configurations()[0], (1, False, ()))
+        self.assertEqual(len(set(portfolio.configurations)), 6)
+        self.assertEqual(
+            SketchPortfolio(1, 'spec', slv_parallel=True).configurations,
+            [(1, True, ())])
+        self.assertEqual(
+            get_configuration_name((3, True, ('--slv-lightverif',))),
+            'seed3_parallel_slv_lightverif')
+
+    def test_winners_first(self):
+        portfolio = SketchPortfolio(3, 'spec', history_file=self.history_file)
+        (first, second, third) = portfolio.get_configurations()
+        portfolio.record_win(third)
+        portfolio.record_win(third)
+        portfolio.record_win(second)
+        self.assertEqual(portfolio.get_configurations(),
+                         [third, second, first])
+        # Wins are recorded on disk, and per spec.
+        self.assertEqual(
+            SketchPortfolio(3, 'spec', history_file=self.history_file).
+            get_configurations(), [third, second, first])
+        self.assertEqual(
+            SketchPortfolio(3, 'other spec', history_file=self.history_file).
+            get_configurations(), [first, second, third])
+
+    def test_history_read_once(self):
+        portfolio = SketchPortfolio(3, 'spec', history_file=self.history_file)
+        (first, second, third) = portfolio.get_configurations()
+        portfolio.record_win(third)
+        with patch.object(portfolio, 'read_history') as mock_read_history:
+            for _ in range(3):
+                self.assertEqual(portfolio.get_configurations()[0], third)
+        mock_read_history.assert_not_called()
+
+    def test_concurrent_wins(self):
+        # Compilations of other processes, which read the history before
+        # either records a win.
+        portfolios = [SketchPortfolio(3, spec, history_file=self.history_file)
+                      for spec in ['spec', 'spec', 'other spec']]
+        (first, second, third) = portfolios[0].get_configurations()
+        portfolios[0].record_win(third)
+        portfolios[1].record_win(third)
+        portfolios[2].record_win(second)
+        self.assertEqual(
+            json.loads(Path(self.history_file).read_text()),
+            {portfolios[0].spec_key: {get_configuration_name(third): 2},
+             portfolios[2].spec_key: {get_configuration_name(second): 1}})
+
+    def test_wins_recorded_concurrently(self):
+        configurations = SketchPortfolio(3, 'spec').configurations
+        with ProcessPoolExecutor(max_workers=3) as executor:
+            list(executor.map(record_wins,
+                              [self.history_file] * len(configurations),
+                              configurations))
+        wins = json.loads(Path(self.history_file).read_text())
+        self.assertEqual(sorted(list(wins.values())[0].values()),
+                         [20, 20, 20])
+
+    def test_no_history_without_portfolio(self):
+        portfolio = SketchPortfolio(1, 'spec', history_file=self.history_file)
+        portfolio.record_win(portfolio.configurations[0])
+        self.assertFalse(path.exists(self.history_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import stat
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import psutil
+
+from chipc import sketch_utils
+
+# Stands in for sketch, which starts a JVM from a wrapper script.
+FAKE_SKETCH = """#!/bin/sh
+case "$1" in
+    parse_error.sk) echo 'Program Parse Error: foo'; exit 1;;
+    sleep.sk) sleep 60 & echo $! > "$PID_FILE"; echo started; wait;;
+    *) echo "$@"; echo 'to stderr' >&2;;
+esac
+"""
+
+
+class RunSketchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        sketch_path = Path(self.tmp_dir.name) / 'sketch'
+        sketch_path.write_text(FAKE_SKETCH)
+        sketch_path.chmod(sketch_path.stat().st_mode | stat.S_IXUSR)
+        self.pid_file = Path(self.tmp_dir.name) / 'pid'
+        self.env = patch.dict(os.environ, {
+            'PATH': self.tmp_dir.name + os.pathsep + os.environ['PATH'],
+            'PID_FILE': str(self.pid_file)})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp_dir.cleanup()
+
+    def test_success(self):
+        result = sketch_utils.run_sketch(['foo.sk', '--bnd-inbits=2'])
+        self.assertEqual(result.return_code, 0)
+        self.assertEqual(result.output, 'foo.sk --bnd-inbits=2\nto stderr\n')
+        self.assertFalse(result.timed_out)
+        self.assertGreaterEqual(result.wall_time, 0)
+        self.assertGreaterEqual(result.cpu_time, 0)
+
+    def test_sketch_version(self):
+        sketch_dir = Path(self.tmp_dir.name)
+        jar_path = sketch_dir / 'sketch-1.7.5-noarch.jar'
+        jar_path.write_text('frontend')
+        backend_path = sketch_dir / 'backend' / 'cegis'
+        backend_path.parent.mkdir()
+        backend_path.write_text('backend')
+        (sketch_dir / 'runtime' / 'bin').mkdir(parents=True)
+        (sketch_dir / 'runtime' / 'bin' / 'cegis').symlink_to(backend_path)
+
+        def get_version():
+            sketch_utils.get_sketch_version.cache_clear()
+            return sketch_utils.get_sketch_version()
+
+        self.addCleanup(sketch_utils.get_sketch_version.cache_clear)
+        with patch.dict(os.environ):
+            os.environ.pop('SKETCH_HOME', None)
+            self.assertEqual(
+                sketch_utils.get_sketch_artifacts(sketch_dir / 'sketch'),
+                [(sketch_dir / 'sketch').resolve(), jar_path.resolve(),
+                 backend_path.resolve()])
+            versions = [get_version()]
+            # Rebuilds of the frontend or the backend change the version.
+            jar_path.write_text('rebuilt frontend')
+            versions.append(get_version())
+            backend_path.write_text('rebuilt backend')
+            versions.append(get_version())
+            self.assertEqual(len(set(versions)), 3)
+            self.assertEqual(get_version(), versions[-1])
+
+            sketch_home = sketch_dir / 'home'
+            (sketch_home / 'bin').mkdir(parents=True)
+            (sketch_home / 'bin' / 'cegis').write_text('other backend')
+            os.environ['SKETCH_HOME'] = str(sketch_home)
+            self.assertEqual(
+                sketch_utils.get_sketch_artifacts(sketch_dir / 'sketch')[-1],
+                (sketch_home / 'bin' / 'cegis').resolve())
+
+    def test_parse_error(self):
+        with self.assertRaisesRegex(Exception, 'contains a syntax error'):
+            sketch_utils.run_sketch(['parse_error.sk'])
+
+    def test_timeout(self):
+        start = time.perf_counter()
+        result = sketch_utils.run_sketch(['sleep.sk'], timeout=0.5)
+        # The child of the wrapper script is killed too, or reading the
+        # output would wait for it.
+        self.assertLess(time.perf_counter() - start, 30)
+        self.assertTrue(result.timed_out)
+        self.assertLess(result.return_code, 0)
+
+    def test_synthesize_runs_sketch_once(self):
+        with patch('subprocess.Popen', wraps=sketch_utils.subprocess.Popen) \
+                as mock_popen:
+            (return_code, output) = sketch_utils.synthesize('foo.sk', 2, 1)
+        self.assertEqual(mock_popen.call_count, 1)
+        self.assertEqual(return_code, 0)
+        self.assertIn('--bnd-inbits=2', output)
+
+    def test_async(self):
+        lines = []
+        result = asyncio.run(sketch_utils.run_sketch_async(
+            ['foo.sk'], on_output=lines.append))
+        self.assertEqual(result.return_code, 0)
+        self.assertEqual(lines, ['foo.sk\n', 'to stderr\n'])
+        self.assertEqual(result.output, 'foo.sk\nto stderr\n')
+        self.assertIsNone(result.cpu_time)
+
+    def test_async_cancel(self):
+        async def run_and_cancel():
+            started = asyncio.Event()
+            task = asyncio.ensure_future(sketch_utils.run_sketch_async(
+                ['sleep.sk'], on_output=lambda line: started.set()))
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run_and_cancel())
+        assert_process_exits(self, int(self.pid_file.read_text()))
+
+    def test_async_cancel_while_starting(self):
+        async def run_and_cancel():
+            task = asyncio.ensure_future(sketch_utils.run_sketch_async(
+                ['sleep.sk']))
+            # Let the task start creating the process.
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.perf_counter()
+        asyncio.run(run_and_cancel())
+        self.assertLess(time.perf_counter() - start, 30)
+        if self.pid_file.exists() and self.pid_file.read_text():
+            assert_process_exits(self, int(self.pid_file.read_text()))
+
+    def test_async_timeout(self):
+        result = asyncio.run(sketch_utils.run_sketch_async(['sleep.sk'],
+                                                           timeout=0.5))
+        self.assertTrue(result.timed_out)
+        self.assertLess(result.return_code, 0)
+        assert_process_exits(self, int(self.pid_file.read_text()))
+
+
+def assert_process_exits(test_case, pid, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if psutil.Process(pid).status() == psutil.STATUS_ZOMBIE:
+                return
+        except psutil.NoSuchProcess:
+            return
+        time.sleep(0.05)
+    test_case.fail('Process {} is still running'.format(pid))
+
+
+if __name__ == '__main__':
+    unittest.main()
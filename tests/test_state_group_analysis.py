@@ -0,0 +1,76 @@
+import unittest
+from os import path
+from pathlib import Path
+
+from chipc.state_group_analysis import is_assignment_allowed
+from chipc.state_group_analysis import StateGroupAnalysis
+from chipc.utils import get_num_pkt_fields
+from chipc.utils import get_state_group_info
+
+SPEC_DIR = path.join(path.abspath(path.dirname(__file__)), '../example_specs/')
+
+
+def make_analysis(program_content):
+    return StateGroupAnalysis(program_content,
+                              get_num_pkt_fields(program_content),
+                              get_state_group_info(program_content))
+
+
+def make_spec(body):
+    return ('|StateAndPacket| program (|StateAndPacket| state_and_packet) {' +
+            body + 'return state_and_packet; }')
+
+
+class StateGroupAnalysisTest(unittest.TestCase):
+    def test_example_specs(self):
+        for (spec, dependencies, symmetry_classes) in [
+                ('blue_increase.sk', [(0, 1)], []),
+                ('test.sk', [(1, 0)], []),
+                ('rcp.sk', [], []),
+                ('learn_filter_modified_for_test.sk', [], [[0, 1, 2]])]:
+            program_content = Path(SPEC_DIR, spec).read_text()
+            analysis = make_analysis(program_content)
+            self.assertEqual(analysis.get_dependencies(
+                get_state_group_info(program_content)), dependencies, spec)
+            self.assertEqual(analysis.get_symmetry_classes(),
+                             symmetry_classes, spec)
+
+    def test_dependency_through_packet_field(self):
+        analysis = make_analysis(make_spec('''
+            state_and_packet.pkt_0 = state_and_packet.state_group_0_state_0;
+            state_and_packet.state_group_1_state_0 = state_and_packet.pkt_0;
+            state_and_packet.state_group_0_state_0 =
+                state_and_packet.state_group_0_state_0 + 1;'''))
+        self.assertEqual(analysis.get_dependencies(['0', '1']), [(1, 0)])
+        # Only state groups checked for correctness get dependencies.
+        self.assertEqual(analysis.get_dependencies(['0']), [])
+
+    def test_no_syntactic_dependency(self):
+        # state_group_1 is read but doesn't affect the result.
+        analysis = make_analysis(make_spec('''
+            state_and_packet.state_group_0_state_0 =
+                state_and_packet.state_group_1_state_0 -
+                state_and_packet.state_group_1_state_0;
+            state_and_packet.state_group_1_state_0 = 1;'''))
+        self.assertEqual(analysis.get_dependencies(['0', '1']), [])
+        self.assertEqual(analysis.get_symmetry_classes(), [])
+
+    def test_symmetry_needs_matching_packet_fields(self):
+        # Swapping the state groups also swaps which packet field gets
+        # which state.
+        analysis = make_analysis(make_spec('''
+            state_and_packet.pkt_0 = state_and_packet.state_group_0_state_0;
+            state_and_packet.pkt_1 = state_and_packet.state_group_1_state_0;
+            state_and_packet.state_group_0_state_0 = 1;
+            state_and_packet.state_group_1_state_0 = 1;'''))
+        self.assertEqual(analysis.get_symmetry_classes(), [])
+
+    def test_is_assignment_allowed(self):
+        self.assertTrue(is_assignment_allowed((1, 0), [(0, 1)], []))
+        self.assertFalse(is_assignment_allowed((0, 0), [(0, 1)], []))
+        self.assertTrue(is_assignment_allowed((0, 1, 1), [], [[0, 1, 2]]))
+        self.assertFalse(is_assignment_allowed((1, 0, 1), [], [[0, 1, 2]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
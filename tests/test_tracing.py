@@ -0,0 +1,62 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from chipc.tracing import Tracer
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        self.tracer = Tracer()
+
+    def test_span(self):
+        with self.tracer.span('outer', iteration=1):
+            with self.tracer.span('inner') as attributes:
+                attributes['sketch_bytes'] = 10
+        (inner, outer) = self.tracer.spans
+        self.assertEqual(inner['name'], 'inner')
+        self.assertEqual(inner['attributes'], {'sketch_bytes': 10})
+        self.assertEqual(outer['attributes'], {'iteration': 1})
+        self.assertEqual(inner['track'], outer['track'])
+        self.assertLessEqual(outer['start'], inner['start'])
+        self.assertGreaterEqual(outer['duration'], inner['duration'])
+
+    def test_span_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.span('failing'):
+                raise ValueError()
+        self.assertEqual(len(self.tracer.spans), 1)
+
+    def test_tasks_get_tracks(self):
+        async def run():
+            async def run_span():
+                with self.tracer.span('synthesis'):
+                    await asyncio.sleep(0.01)
+
+            with self.tracer.span('parallel codegen'):
+                await asyncio.gather(run_span(), run_span())
+
+        asyncio.run(run())
+        self.assertEqual(len({span['track'] for span in self.tracer.spans}),
+                         3)
+
+    def test_write(self):
+        with self.tracer.span('codegen', hole_bits=3):
+            pass
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            prefix = os.path.join(tmp_dir, 'trace')
+            self.tracer.write(prefix)
+            with open(prefix + '.jsonl') as json_lines_file:
+                spans = [json.loads(line) for line in json_lines_file]
+            with open(prefix + '.json') as chrome_trace_file:
+                events = json.load(chrome_trace_file)['traceEvents']
+        self.assertEqual(spans, self.tracer.spans)
+        self.assertEqual(events[0]['name'], 'codegen')
+        self.assertEqual(events[0]['ph'], 'X')
+        self.assertEqual(events[0]['args'], {'hole_bits': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import itertools
 import unittest
 from pathlib import Path
 from unittest.mock import patch
@@ -70,6 +71,102 @@ class GenerateCounterexamplesTest(unittest.TestCase):
         self.assertDictEqual(pkt_fields, {})
         self.assertTrue('state_group_1_state_0' in state_vars)
 
+
+class CounterexampleGeneratorTest(unittest.TestCase):
+    def test_reuse_across_formulas(self):
+        generator = z3_utils.CounterexampleGenerator()
+        x = z3.Int('pkt_0_0_0_0')
+        # Formulas from earlier calls must not leak into later ones.
+        pkt_fields, _ = generator.generate(z3.ForAll([x], x < 5))
+        self.assertGreaterEqual(pkt_fields['pkt_0'], 5)
+        pkt_fields, _ = generator.generate(z3.ForAll([x], x > 5))
+        self.assertLessEqual(pkt_fields['pkt_0'], 5)
+        self.assertEqual(generator.generate(z3.ForAll([x], x == x)),
+                         ({}, {}))
+        self.assertEqual(len(generator.check_times), 3)
+        self.assertEqual(generator.total_check_time,
+                         sum(generator.check_times))
+
+    def test_generate_all(self):
+        x = z3.Int('pkt_0_0_0_0')
+        y = z3.Int('pkt_1_0_0_0')
+        formula = z3.ForAll([x, y], z3.Implies(
+            z3.And(x >= 0, x < 8, y >= 0, y < 8),
+            z3.And(z3.BoolVal(True), z3.And(x < 6, y < 6))))
+        generator = z3_utils.CounterexampleGenerator()
+        counterexamples = generator.generate_all(formula, 3)
+        self.assertEqual(len(counterexamples), 3)
+        inputs = [(pkt_fields['pkt_0'], pkt_fields['pkt_1'])
+                  for (pkt_fields, _) in counterexamples]
+        self.assertEqual(len(set(inputs)), 3)
+        for (x_value, y_value) in inputs:
+            self.assertTrue(x_value >= 6 or y_value >= 6)
+        # Both asserts are failed by the first two counterexamples.
+        self.assertTrue(any(x_value >= 6 for (x_value, _) in inputs[:2]))
+        self.assertTrue(any(y_value >= 6 for (_, y_value) in inputs[:2]))
+        self.assertEqual(len(generator.check_times), 1)
+
+    def test_generate_all_runs_out(self):
+        x = z3.Int('pkt_0_0_0_0')
+        formula = z3.ForAll([x], z3.Implies(z3.And(x >= 0, x < 4), x < 2))
+        counterexamples = z3_utils.CounterexampleGenerator().generate_all(
+            formula, 5)
+        self.assertEqual(sorted(pkt_fields['pkt_0'] for (pkt_fields, _) in
+                                counterexamples), [2, 3])
+
+    def test_generalize(self):
+        x = z3.Int('pkt_0_0_0_0')
+        y = z3.Int('pkt_1_0_0_0')
+        z = z3.Int('state_group_0_state_0_0')
+        formula = z3.ForAll([x, y, z], z3.Implies(
+            z3.And(x >= 0, x < 1024, y >= 0, y < 1024, z >= 0, z < 1024),
+            z3.Or(x < 600, y < 3)))
+        generator = z3_utils.CounterexampleGenerator(generalize=True)
+        counterexamples = generator.generate_all(formula, 2)
+        self.assertEqual(len(counterexamples), 2)
+        (pkt_fields, state_vars) = counterexamples[0]
+        self.assertGreaterEqual(pkt_fields['pkt_0'], 600)
+        self.assertEqual(pkt_fields['pkt_1'], 3)
+        # z plays no part in the failure.
+        self.assertEqual(state_vars['state_group_0_state_0'], 0)
+        # Generalized counterexamples are blocked, so the next one differs.
+        self.assertNotEqual(counterexamples[1], counterexamples[0])
+
+    def test_generate_all_generalized(self):
+        x = z3.Int('pkt_0_0_0_0')
+        y = z3.Int('pkt_1_0_0_0')
+        formula = z3.ForAll([x, y], z3.Implies(
+            z3.And(x >= 0, x < 100, y >= 0, y < 100),
+            z3.And(z3.BoolVal(True), z3.And(x + y < 10, x < 50))))
+        generator = z3_utils.CounterexampleGenerator(generalize=True)
+        counterexamples = generator.generate_all(formula, 3)
+        inputs = [(pkt_fields['pkt_0'], pkt_fields['pkt_1'])
+                  for (pkt_fields, _) in counterexamples]
+        self.assertEqual(len(set(inputs)), 3)
+        for (x_value, y_value) in inputs:
+            self.assertGreaterEqual(x_value + y_value, 10)
+        # Generalization keeps the second one failing x < 50, which the
+        # first one doesn't.
+        self.assertLess(inputs[0][0], 50)
+        self.assertGreaterEqual(inputs[1][0], 50)
+
+    def test_get_conjuncts(self):
+        x, y = z3.Ints('x y')
+        formula = z3.ForAll([x, y], z3.Implies(
+            x > 0, z3.And(z3.And(z3.BoolVal(True), x < 6), y < 6)))
+        self.assertEqual([str(predicate) for predicate in
+                          z3_utils.get_conjuncts(formula)],
+                         ['x < 6', 'y < 6'])
+        self.assertEqual(z3_utils.get_conjuncts(z3.ForAll([x], x > 0)), [])
+
+    def test_proof_and_unsat_core(self):
+        generator = z3_utils.CounterexampleGenerator(proof=True,
+                                                     unsat_core=True)
+        x = z3.Int('state_group_0_state_0_0')
+        _, state_vars = generator.generate(z3.ForAll([x], x < 5))
+        self.assertGreaterEqual(state_vars['state_group_0_state_0'], 5)
+
+
 class GetZ3FormulaTest(unittest.TestCase):
     def test_conversion(self):
         # Smoke test for bool-to-int and int-to-bool conversion
@@ -119,6 +216,104 @@ class GetZ3FormulaTest(unittest.TestCase):
         self.assertDictEqual(ir_pkt_fields, smt_pkt_fields)
         self.assertDictEqual(ir_state_vars, smt_state_vars)
 
+    def test_from_dag_file(self):
+        dag_filename = str(Path(__file__).parent / 'data/sampling.dag')
+        self.assertTrue(z3_utils.get_z3_formula_from_dag_file(
+            dag_filename, 2).eq(z3_utils.get_z3_formula(
+                Path(dag_filename).read_text(), 2)))
+
+
+class SketchDagParserTest(unittest.TestCase):
+    def test_shared_subterms(self):
+        parser = z3_utils.SketchDagParser().parse("""0 = S INT a 2
+                                                     1 = CONST INT 1
+                                                     2 = PLUS INT 0 1
+                                                     3 = CONST INT 1
+                                                     4 = PLUS INT 0 3
+                                                     5 = LT BOOL 2 4
+                                                     6 = LT BOOL 4 2""".
+                                                  splitlines())
+        self.assertIs(parser.nodes[2], parser.nodes[4])
+        self.assertIs(parser.nodes[5], parser.nodes[6])
+        self.assertIsNot(parser.nodes[2], parser.nodes[5])
+
+    def test_mixed_sorts(self):
+        parser = z3_utils.SketchDagParser().parse("""0 = S INT a 2
+                                                     1 = CONST BOOL 1
+                                                     2 = ARRACC INT 0 2 0 1
+                                                     3 = ARRASS INT 1 == 1 1 1
+                                                     4 = NOT BOOL 0""".
+                                                  splitlines())
+        a = z3.Int('a')
+        self.assertTrue(parser.nodes[2].eq(
+            z3.If(a > 0, z3.If(z3.BoolVal(True), 1, 0), a)))
+        self.assertTrue(z3.is_bool(parser.nodes[3]))
+        self.assertTrue(parser.nodes[4].eq(z3.Not(a > 0)))
+
+    def test_unknown_operation(self):
+        with self.assertRaisesRegex(AssertionError, 'Unknown operation'):
+            z3_utils.SketchDagParser().parse(['0 = FOO INT 1'])
+
+
+# Asserts 0 <= pkt_0 * 16 and pkt_0 * pkt_0 < 50.
+SQUARE_DAG = """0 = S INT pkt_0 2
+                1 = CONST INT 16
+                2 = TIMES INT 0 1
+                3 = CONST INT 0
+                4 = LT BOOL 2 3
+                5 = NOT BOOL 4
+                6 = ASSERT 5 "pkt_0 * 16 overflows"
+                7 = TIMES INT 0 0
+                8 = CONST INT 50
+                9 = LT BOOL 7 8
+                10 = ASSERT 9 "pkt_0 * pkt_0 is too large"
+"""
+
+
+class BitVecDagParserTest(unittest.TestCase):
+    def test_matches_int(self):
+        for name in ['hello', 'sampling']:
+            sketch_ir = (Path(__file__).parent / 'data' /
+                         (name + '.dag')).read_text()
+            self.assertEqual(
+                z3_utils.generate_counterexamples(
+                    z3_utils.get_z3_formula(sketch_ir, 10, bit_vector=True)),
+                z3_utils.generate_counterexamples(
+                    z3_utils.get_z3_formula(sketch_ir, 10)))
+
+    def test_arithmetic(self):
+        for (lhs, rhs) in itertools.product([-7, -2, 0, 3, 8], [-3, -1, 2, 5]):
+            for operation in ['PLUS', 'TIMES', 'DIV', 'MOD']:
+                sketch_ir = ('0 = CONST INT ' + str(lhs) + '\n'
+                             '1 = CONST INT ' + str(rhs) + '\n'
+                             '2 = ' + operation + ' INT 0 1\n'
+                             '3 = NEG INT 2').splitlines()
+                bit_vector = z3_utils.BitVecDagParser(2).parse(sketch_ir)
+                integer = z3_utils.SketchDagParser().parse(sketch_ir)
+                self.assertEqual(
+                    z3.simplify(bit_vector.nodes[3]).as_signed_long(),
+                    z3.simplify(integer.nodes[3]).as_long(),
+                    (lhs, operation, rhs))
+
+    def test_counterexamples(self):
+        for bit_width in [None, 32]:
+            self.assertEqual(z3_utils.generate_counterexamples(
+                z3_utils.get_z3_formula(SQUARE_DAG, 3, True, bit_width)),
+                ({}, {}))
+            (pkt_fields, _) = z3_utils.generate_counterexamples(
+                z3_utils.get_z3_formula(SQUARE_DAG, 4, True, bit_width))
+            self.assertGreaterEqual(pkt_fields['pkt_0'] ** 2, 50)
+
+    def test_wrap_around(self):
+        # pkt_0 * 16 is negative for pkt_0 >= 8 in 8 bits.
+        generator = z3_utils.CounterexampleGenerator()
+        (pkt_fields, _) = generator.generate(
+            z3_utils.get_z3_formula(SQUARE_DAG, 3, True, 8))
+        self.assertEqual(pkt_fields, {})
+        (pkt_fields, _) = generator.generate(
+            z3_utils.get_z3_formula(SQUARE_DAG, 4, True, 8))
+        self.assertGreaterEqual(pkt_fields['pkt_0'], 8)
+
 
 class SimpleCheckTest(unittest.TestCase):
     def test_success(self):
@@ -0,0 +1,259 @@
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+from os import path
+from pathlib import Path
+
+import z3
+from ordered_set import OrderedSet
+from z3.z3util import get_vars
+
+from chipc import sketch_utils
+from chipc import z3_utils
+from chipc.compiler import Compiler
+from chipc.mode import Mode
+from chipc.utils import get_num_pkt_fields
+from chipc.utils import get_state_group_info
+from chipc.z3_spec import evaluate_expression
+from chipc.z3_spec import get_spec_constants
+from chipc.z3_spec import parse_expression
+from chipc.z3_spec import Z3Spec
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+
+STATELESS_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateless_alus/')
+STATEFUL_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateful_alus/')
+SPEC_DIR = path.join(BASE_PATH, '../example_specs/')
+
+
+def make_compiler(spec, stateful_alu, stateless_alu, num_pipeline_stages,
+                  num_alus_per_stage, synthesized_allocation=False,
+                  target_tofino=False, group_size=1):
+    compiler = Compiler(path.join(SPEC_DIR, spec),
+                        path.join(STATEFUL_ALU_DIR, stateful_alu),
+                        path.join(STATELESS_ALU_DIR, stateless_alu),
+                        num_pipeline_stages, num_alus_per_stage, 'test',
+                        False, OrderedSet(['0', '1', '2', '3']), group_size,
+                        synthesized_allocation, target_tofino=target_tofino,
+                        native_verify=True)
+    # Holes are only known after a sketch has been generated.
+    compiler.sketch_code_generator.generate_sketch(
+        spec_filename=compiler.spec_filename, mode=Mode.CODEGEN,
+        synthesized_allocation=synthesized_allocation)
+    return compiler
+
+
+def get_example_specs():
+    """Yields the keyword arguments of make_compiler for every spec in
+    SPEC_DIR, with the stateful ALUs that fit its state groups and the ALUs
+    per stage it needs."""
+    for spec in sorted(os.listdir(SPEC_DIR)):
+        program_content = Path(path.join(SPEC_DIR, spec)).read_text()
+        state_groups = get_state_group_info(program_content)
+        group_size = max(len(state_vars) for state_vars in
+                         state_groups.values())
+        num_alus_per_stage = max(2, get_num_pkt_fields(program_content),
+                                 len(state_groups))
+        if group_size == 2:
+            stateful_alus = ['pair.alu']
+        else:
+            stateful_alus = ['raw.alu', 'if_else_raw.alu']
+        for stateful_alu in stateful_alus:
+            for synthesized_allocation in [False, True]:
+                yield {'spec': spec, 'stateful_alu': stateful_alu,
+                       'stateless_alu':
+                       'stateless_alu_arith_rel_cond_bool.alu',
+                       'num_pipeline_stages': 2,
+                       'num_alus_per_stage': num_alus_per_stage,
+                       'synthesized_allocation': synthesized_allocation,
+                       'group_size': group_size}
+
+
+def get_random_hole_assignments(compiler, rng):
+    hole_assignments = {}
+    for hole in compiler.sketch_code_generator.holes_:
+        max_value = hole.max
+        if 'const' in hole.name or 'immediate' in hole.name:
+            max_value = len(compiler.constant_set) - 1
+        hole_assignments[hole.name] = str(rng.randint(0, max_value))
+    return hole_assignments
+
+
+def substitute_counterexample(formula, counterexample):
+    """Returns the negated body of formula with its inputs replaced by the
+    values of a counterexample from generate_counterexamples."""
+    values = dict(counterexample[0])
+    values.update(counterexample[1])
+    body = z3_utils.negated_body(formula)
+    substitutions = []
+    for var in get_vars(body):
+        match_object = re.match(r'pkt_\d+|state_group_\d+_state_\d+',
+                                str(var))
+        if match_object and match_object.group(0) in values:
+            substitutions.append((var, z3.IntVal(
+                values[match_object.group(0)])))
+    return z3.substitute(body, *substitutions)
+
+
+class Z3SpecTest(unittest.TestCase):
+    def test_evaluate_concrete(self):
+        spec = Z3Spec(open(path.join(SPEC_DIR, 'times_two.sk')).read())
+        result = spec.evaluate({'pkt_0': 3, 'pkt_1': 6,
+                                'state_group_0_state_0': 5})
+        self.assertEqual(result['state_group_0_state_0'], 1)
+        result = spec.evaluate({'pkt_0': 3, 'pkt_1': 7,
+                                'state_group_0_state_0': 5})
+        self.assertEqual(result['state_group_0_state_0'], 0)
+        self.assertEqual(result['pkt_1'], 7)
+
+    def test_evaluate_symbolic(self):
+        spec = Z3Spec(open(path.join(SPEC_DIR, 'times_two.sk')).read())
+        pkt_0, pkt_1, state = z3.Ints('pkt_0 pkt_1 state')
+        result = spec.evaluate({'pkt_0': pkt_0, 'pkt_1': pkt_1,
+                                'state_group_0_state_0': state})
+        solver = z3.Solver()
+        solver.add(result['state_group_0_state_0'] == 1, pkt_0 == 4)
+        self.assertEqual(solver.check(), z3.sat)
+        self.assertEqual(solver.model()[pkt_1].as_long(), 8)
+
+    def test_expression_precedence(self):
+        self.assertEqual(
+            evaluate_expression(parse_expression('1 + 2 * 3 == 7'), {}),
+            True)
+        self.assertEqual(
+            evaluate_expression(parse_expression('!a && b'),
+                                {'a': 0, 'b': 0}),
+            False)
+        self.assertEqual(
+            evaluate_expression(parse_expression('(a + b + 0) <= 1'),
+                                {'a': 1, 'b': 1}),
+            False)
+
+    def test_get_spec_constants(self):
+        spec = open(path.join(SPEC_DIR, 'sampling.sk')).read()
+        # Literals in the commented out original program and digits in field
+        # names are skipped.
+        self.assertEqual(get_spec_constants(spec),
+                         ['3', '1', '0', '-3', '2', '4', '-1'])
+
+
+class NativeVerifyTest(unittest.TestCase):
+    def setUp(self):
+        self.compiler = make_compiler('simplest.sk', 'raw.alu',
+                                      'stateless_alu.alu', 1, 1)
+        # Pass state_0 through the stateful ALU unchanged, and write its old
+        # value to pkt_0.
+        self.hole_assignments = {
+            hole: '0' for hole in
+            self.compiler.sketch_code_generator.hole_names_}
+        self.hole_assignments.update({
+            'test_stateful_alu_0_0_Mux2_0_global': '1',
+            'test_salu_config_0_0': '1',
+        })
+
+    def test_correct_hole_assignments(self):
+        self.assertEqual(
+            self.compiler.verify(self.hole_assignments, 10), ({}, {}))
+
+    def test_incorrect_hole_assignments(self):
+        # Write the stateless ALU result to pkt_0 instead.
+        self.hole_assignments['test_output_mux_phv_0_0_ctrl'] = '1'
+        pkt_fields, state_vars = self.compiler.verify(self.hole_assignments,
+                                                      10)
+        self.assertIn('state_group_0_state_0', state_vars)
+        self.assertNotEqual(state_vars['state_group_0_state_0'], 0)
+
+    def test_state_not_allocated(self):
+        self.hole_assignments['test_salu_config_0_0'] = '0'
+        pkt_fields, state_vars = self.compiler.verify(self.hole_assignments,
+                                                      10)
+        self.assertNotEqual((pkt_fields, state_vars), ({}, {}))
+
+
+class NativeExampleSpecsTest(unittest.TestCase):
+    """Checks the native verifier handles every example spec, also without
+    sketch installed. MatchesSketchIrTest compares it with Sketch IRs."""
+
+    def test_example_specs(self):
+        rng = random.Random(1)
+        for kwargs in get_example_specs():
+            compiler = make_compiler(**kwargs)
+            hole_assignments = get_random_hole_assignments(compiler, rng)
+            formula = compiler.z3_verifier.get_z3_formula(
+                hole_assignments, compiler.constant_set, 4)
+            counterexample = z3_utils.generate_counterexamples(formula)
+            if counterexample == ({}, {}):
+                continue
+            # Counterexamples have to fail the formula they came from.
+            solver = z3.Solver()
+            solver.add(substitute_counterexample(formula, counterexample))
+            self.assertEqual(solver.check(), z3.sat,
+                             (kwargs, hole_assignments))
+
+
+@unittest.skipUnless(shutil.which('sketch'), 'sketch is not installed')
+class MatchesSketchIrTest(unittest.TestCase):
+    """Checks native formulas against the ones from Sketch IRs for random hole
+    value assignments."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def check_matches(self, compiler, rng, num_trials=5):
+        generator = compiler.sketch_code_generator
+        for trial in range(num_trials):
+            hole_assignments = get_random_hole_assignments(compiler, rng)
+
+            sketch_filename = 'verify_' + str(trial) + '.sk'
+            with open(sketch_filename, 'w') as sketch_file:
+                sketch_file.write(generator.generate_sketch(
+                    spec_filename=compiler.spec_filename,
+                    mode=Mode.VERIFY,
+                    synthesized_allocation=compiler.synthesized_allocation,
+                    hole_assignments=hole_assignments))
+            ir_formula = z3_utils.get_z3_formula(
+                sketch_utils.generate_ir(sketch_filename), 4)
+            native_formula = compiler.z3_verifier.get_z3_formula(
+                hole_assignments, compiler.constant_set, 4)
+
+            ir_counterexamples = z3_utils.generate_counterexamples(
+                ir_formula)
+            native_counterexamples = z3_utils.generate_counterexamples(
+                native_formula)
+            self.assertEqual(ir_counterexamples == ({}, {}),
+                             native_counterexamples == ({}, {}),
+                             hole_assignments)
+            if native_counterexamples == ({}, {}):
+                continue
+
+            # The native counterexample has to fail the Sketch IR too.
+            solver = z3.Solver()
+            solver.add(substitute_counterexample(ir_formula,
+                                                 native_counterexamples))
+            self.assertEqual(solver.check(), z3.sat, hole_assignments)
+
+    def test_example_specs(self):
+        rng = random.Random(1)
+        for kwargs in get_example_specs():
+            self.check_matches(make_compiler(**kwargs), rng)
+
+    def test_tofino(self):
+        rng = random.Random(1)
+        for spec in ['simple.sk', 'sampling.sk', 'marple_new_flow.sk']:
+            compiler = make_compiler(spec, 'tofino.alu',
+                                     'stateless_alu_for_tofino.alu', 2, 2,
+                                     target_tofino=True)
+            self.check_matches(compiler, rng)
+
+
+if __name__ == '__main__':
+    unittest.main()